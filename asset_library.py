@@ -0,0 +1,270 @@
+"""Lazy, indexed access to the emoji and GIF asset folders.
+
+Startup only records each file's name, size and mtime (one scandir, or
+nothing at all when the persisted index is still current). Images are
+decoded on first access into an LRU cache bounded by decoded bytes, and
+thumbnails are written to disk keyed by the file's content hash so they
+survive restarts and renames.
+
+    library = AssetLibrary('assests/emojis', EMOJI_EXTENSIONS)
+    image = library['smile.png']          # decoded on first use
+    thumb = library.thumbnail('smile.png')  # cached on disk
+"""
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from collections.abc import Mapping
+
+from PIL import Image
+
+EMOJI_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp')
+GIF_EXTENSIONS = ('.gif',)
+DEFAULT_CACHE_BYTES = 64 * 1024 * 1024
+DEFAULT_THUMB_SIZE = (64, 64)
+INDEX_VERSION = 1
+# New content hashes are written to the index this long after the first one,
+# unless a batch (refresh, GIF indexing, atlas build) saves it sooner
+INDEX_SAVE_DELAY = 5.0
+
+
+def default_cache_dir():
+    """Directory for persisted indexes and thumbnails (EMOJIE_CACHE_DIR overrides)"""
+    path = os.environ.get('EMOJIE_CACHE_DIR') or os.path.join(os.path.expanduser('~'), '.cache', 'emojie')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def write_json_atomic(path, data):
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def _image_nbytes(image):
+    return image.width * image.height * len(image.getbands())
+
+
+class AssetLibrary(Mapping):
+    """Read-only mapping of file name -> decoded image (or path if decode=False)"""
+
+    def __init__(self, directory, extensions, decode=True, cache_dir=None,
+                 cache_bytes=DEFAULT_CACHE_BYTES, thumb_size=DEFAULT_THUMB_SIZE):
+        self.directory = os.path.abspath(directory)
+        self.extensions = tuple(ext.lower() for ext in extensions)
+        self.decode = decode
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.cache_bytes = cache_bytes
+        self.thumb_size = tuple(thumb_size)
+        self.thumb_dir = os.path.join(self.cache_dir, 'thumbs')
+        dir_key = hashlib.sha1(self.directory.encode('utf-8')).hexdigest()[:16]
+        self.index_path = os.path.join(self.cache_dir, f'index_{dir_key}.json')
+        self.entries = {}
+        self._images = OrderedDict()
+        self._images_size = 0
+        self._lock = threading.RLock()
+        self._dirty = False
+        self._save_timer = None
+        self._scanned_mtime = None  # folder mtime when self.entries was last brought up to date
+        self.refresh()
+
+    # --- index -----------------------------------------------------------
+
+    def _dir_mtime(self):
+        try:
+            return os.stat(self.directory).st_mtime_ns
+        except OSError:
+            return None
+
+    def _load_index(self):
+        try:
+            with open(self.index_path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get('version') != INDEX_VERSION or data.get('directory') != self.directory:
+            return None
+        return data
+
+    def refresh(self, force=False):
+        """Bring the index up to date with the folder; returns True if it changed.
+
+        Without `force`, a persisted index is trusted while the folder's own
+        mtime is unchanged (no files added, removed or renamed). `force`
+        re-stats every file to also catch in-place edits.
+        """
+        with self._lock:
+            dir_mtime = self._dir_mtime()
+            if dir_mtime is None:
+                changed = bool(self.entries)
+                self.entries = {}
+                self._scanned_mtime = None
+                self._images.clear()
+                self._images_size = 0
+                return changed
+            if not force and dir_mtime == self._scanned_mtime:
+                # Nothing was added, removed or renamed since the last scan
+                return False
+            saved = self._load_index() if not self.entries else None
+            if (not force and saved
+                    and saved.get('dir_mtime') == dir_mtime
+                    and saved.get('extensions') == list(self.extensions)):
+                # Nothing was added, removed or renamed since the index was written
+                self.entries = saved['entries']
+                self._scanned_mtime = dir_mtime
+                return False
+            known = self.entries or (saved or {}).get('entries', {})
+            entries = {}
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    if not entry.name.lower().endswith(self.extensions) or not entry.is_file():
+                        continue
+                    stat = entry.stat()
+                    record = {'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+                    old = known.get(entry.name)
+                    if old and old['size'] == record['size'] and old['mtime'] == record['mtime']:
+                        # Unchanged file: keep its content hash
+                        record = old
+                    else:
+                        self._evict(entry.name)
+                    entries[entry.name] = record
+            for name in set(self.entries) - set(entries):
+                self._evict(name)
+            changed = entries != self.entries
+            # Only rewrite the index when a record (or the folder mtime it was taken at) changed
+            persisted = self.entries if self._scanned_mtime is not None else (saved or {}).get('entries')
+            if entries != persisted or dir_mtime != self._scanned_mtime:
+                self._dirty = True
+            self.entries = entries
+            self._scanned_mtime = dir_mtime
+            self.save_index()
+            return changed
+
+    def save_index(self):
+        """Write the index if anything in it changed since the last save"""
+        with self._lock:
+            if self._save_timer is not None:
+                self._save_timer.cancel()
+                self._save_timer = None
+            if not self._dirty:
+                return
+            write_json_atomic(self.index_path, {
+                'version': INDEX_VERSION,
+                'directory': self.directory,
+                'extensions': list(self.extensions),
+                'dir_mtime': self._scanned_mtime,
+                'entries': self.entries,
+            })
+            self._dirty = False
+
+    def _schedule_save(self):
+        # Called with self._lock held
+        if self._save_timer is None:
+            self._save_timer = threading.Timer(INDEX_SAVE_DELAY, self.save_index)
+            self._save_timer.daemon = True
+            self._save_timer.start()
+
+    # --- mapping interface ----------------------------------------------
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(sorted(self.entries))
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def __getitem__(self, name):
+        if name not in self.entries:
+            raise KeyError(name)
+        if not self.decode:
+            return self.path(name)
+        return self.image(name)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def info(self, name):
+        """Index record: size, mtime and (once computed) content hash"""
+        return dict(self.entries[name])
+
+    # --- decoding and thumbnails ----------------------------------------
+
+    def _evict(self, name):
+        image = self._images.pop(name, None)
+        if image is not None:
+            self._images_size -= _image_nbytes(image)
+
+    def image(self, name):
+        """Decoded image, from the LRU cache when possible"""
+        with self._lock:
+            image = self._images.get(name)
+            if image is not None:
+                self._images.move_to_end(name)
+                return image
+        with open(self.path(name), 'rb') as f:
+            image = Image.open(f)
+            image.load()  # decode now so no file handle stays open
+        nbytes = _image_nbytes(image)
+        with self._lock:
+            if nbytes <= self.cache_bytes:
+                self._evict(name)
+                self._images[name] = image
+                self._images_size += nbytes
+                while self._images_size > self.cache_bytes:
+                    _, evicted = self._images.popitem(last=False)
+                    self._images_size -= _image_nbytes(evicted)
+        return image
+
+    def content_hash(self, name):
+        """sha256 of the file, computed once and stored in the index"""
+        with self._lock:
+            entry = self.entries[name]
+            digest = entry.get('sha256')
+        if digest is None:
+            digest = file_sha256(self.path(name))
+            with self._lock:
+                entry['sha256'] = digest
+                self._dirty = True
+                self._schedule_save()
+        return digest
+
+    def thumbnail_path(self, name, size=None):
+        width, height = size or self.thumb_size
+        return os.path.join(self.thumb_dir, f'{self.content_hash(name)}_{width}x{height}.png')
+
+    def thumbnail(self, name, size=None):
+        """Thumbnail image, generated once per content hash and reused from disk"""
+        size = tuple(size or self.thumb_size)
+        path = self.thumbnail_path(name, size)
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                thumb = Image.open(f)
+                thumb.load()
+            return thumb
+        with open(self.path(name), 'rb') as f:
+            source = Image.open(f)
+            # draft() lets JPEG decode straight at a reduced scale
+            source.draft('RGB', size)
+            thumb = source.convert('RGBA')
+        thumb.thumbnail(size, Image.Resampling.LANCZOS)
+        os.makedirs(self.thumb_dir, exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        thumb.save(tmp_path, format='PNG')
+        os.replace(tmp_path, path)
+        return thumb
+
+    def cache_info(self):
+        with self._lock:
+            return {'images': len(self._images), 'bytes': self._images_size, 'limit': self.cache_bytes}
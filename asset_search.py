@@ -0,0 +1,422 @@
+"""In-memory search over the emoji and GIF libraries by name and tag.
+
+Each asset is split into search terms: the words of its file name (split on
+punctuation, digits and camelCase), the Unicode names of codepoint-named
+files such as '1f602.png' ("face with tears of joy"), and any tags listed
+for it in a tags.json next to the assets ({"smile.png": ["happy"]}).
+
+Every library gets its own term index:
+
+* a prefix trie over the terms for autocomplete. Each node caches the best
+  TOP_K assets below it, so a prefix query reads one cached list instead of
+  merging the postings of every completion;
+* a bigram inverted index over the terms for fuzzy matches ('smlie' ->
+  'smile') when the prefix matches don't fill the page.
+
+Results rank exact term matches first, then prefix completions, then fuzzy
+matches; within each group shorter names come first, and the libraries'
+results are merged lazily in that order. Multi-word queries are driven
+from their rarest word. The index is built once and refreshed
+incrementally: only assets added or removed since the last refresh (or
+whose tags changed) are re-indexed.
+
+    search = AssetSearch([('emoji', AssetLibrary('assests/emojis', EMOJI_EXTENSIONS, decode=False))])
+    page = search.search('hap', limit=20)   # {'results': [...], 'has_more': ...}
+"""
+import argparse
+import heapq
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter, defaultdict
+from itertools import chain, islice
+
+TOP_K = 64
+TAGS_FILE = 'tags.json'
+NGRAM = 2
+# Minimum n-gram similarity (Dice coefficient) for a fuzzy match
+FUZZY_MIN = 0.5
+REFRESH_INTERVAL = 30
+# Match groups, best first
+EXACT, PREFIX, FUZZY = 0, 1, 2
+MATCH_NAMES = ('exact', 'prefix', 'fuzzy')
+# Joiners and variation selectors in codepoint file names carry no words
+_SILENT_CODEPOINTS = {0x200d, 0xfe0e, 0xfe0f}
+
+_CAMEL = re.compile(r'(?<=[a-z])(?=[A-Z])|(?<=[a-z])(?=[0-9])|(?<=[0-9])(?=[a-zA-Z])')
+_SPLIT = re.compile(r'[^0-9a-z]+')
+_CODEPOINTS = re.compile(r'^[0-9a-f]{4,6}(?:[-_][0-9a-f]{4,6})*$')
+
+
+def words(text):
+    """Lower-case search words of a name or query"""
+    return [word for word in _SPLIT.split(_CAMEL.sub(' ', text).lower()) if word]
+
+
+def asset_terms(name, tags=()):
+    """Unique search terms of an asset, from its file name and tags"""
+    stem = os.path.splitext(name)[0]
+    if _CODEPOINTS.match(stem.lower()):
+        terms = []
+        for part in re.split('[-_]', stem.lower()):
+            codepoint = int(part, 16)
+            if codepoint in _SILENT_CODEPOINTS:
+                continue
+            terms.append(part)
+            try:
+                terms += words(unicodedata.name(chr(codepoint)))
+            except ValueError:
+                pass
+    else:
+        terms = words(stem)
+    for tag in tags:
+        terms += words(tag)
+    return list(dict.fromkeys(terms))
+
+
+def ngrams(term, n=NGRAM):
+    padded = f' {term} '
+    return {padded[i:i + n] for i in range(len(padded) - n + 1)}
+
+
+def _unique(docs):
+    seen = set()
+    for doc in docs:
+        if doc not in seen:
+            seen.add(doc)
+            yield doc
+
+
+def _has_prefixes(terms, prefixes):
+    return all(any(term.startswith(prefix) for term in terms) for prefix in prefixes)
+
+
+class _Node:
+    __slots__ = ('children', 'term', 'top')
+
+    def __init__(self):
+        self.children = {}
+        self.term = None  # set when a term ends here
+        self.top = None   # cached best TOP_K doc ids of the subtree
+
+
+class _TermIndex:
+    """Trie, postings and n-gram index over one library's terms"""
+
+    def __init__(self, docs, rank, top_k):
+        self.docs = docs  # shared: doc id -> (kind, name, terms)
+        self.rank = rank  # shared: doc id -> sort key within a match group
+        self.top_k = top_k
+        self.names = {}      # file name -> doc id
+        self.postings = {}   # term -> doc ids sorted by rank
+        self.grams = defaultdict(set)  # n-gram -> terms
+        self.gram_counts = {}          # term -> number of n-grams
+        self.root = _Node()
+
+    # --- updates ---------------------------------------------------------
+
+    def node(self, term, create=False):
+        node = self.root
+        for char in term:
+            child = node.children.get(char)
+            if child is None:
+                if not create:
+                    return None
+                child = node.children[char] = _Node()
+            node = child
+        return node
+
+    def add(self, doc, terms, touched):
+        for term in terms:
+            postings = self.postings.get(term)
+            if postings is None:
+                postings = self.postings[term] = []
+                self.node(term, create=True).term = term
+                grams = ngrams(term)
+                for gram in grams:
+                    self.grams[gram].add(term)
+                self.gram_counts[term] = len(grams)
+            postings.append(doc)
+            touched.add(term)
+
+    def remove(self, doc, terms, touched):
+        for term in terms:
+            postings = self.postings[term]
+            postings.remove(doc)
+            touched.add(term)
+            if not postings:
+                del self.postings[term]
+                del self.gram_counts[term]
+                self.node(term).term = None
+                for gram in ngrams(term):
+                    self.grams[gram].discard(term)
+
+    def finish(self, touched):
+        """Re-sort the changed postings and recompute the cached tops above them"""
+        for term in touched:
+            if term in self.postings:
+                self.postings[term].sort(key=self.rank.__getitem__)
+            # Trie nodes stay even when their term goes, so the path exists
+            node = self.root
+            node.top = None
+            for char in term:
+                node = node.children[char]
+                node.top = None
+        # Refill them now rather than on the first query (untouched subtrees are reused)
+        self._top(self.root)
+
+    # --- lookups ---------------------------------------------------------
+
+    def _top(self, node):
+        if node.top is None:
+            streams = [self._top(child) for child in node.children.values()]
+            if node.term is not None:
+                streams.append(self.postings[node.term][:self.top_k])
+            merged = heapq.merge(*streams, key=self.rank.__getitem__)
+            node.top = list(islice(_unique(merged), self.top_k))
+        return node.top
+
+    def prefix_terms(self, prefix):
+        """Every term starting with `prefix`"""
+        node = self.node(prefix)
+        stack = [node] if node is not None else []
+        terms = []
+        while stack:
+            node = stack.pop()
+            if node.term is not None:
+                terms.append(node.term)
+            stack.extend(node.children.values())
+        return terms
+
+    def completions(self, prefix):
+        """Docs with a term starting with `prefix`, best first"""
+        node = self.node(prefix)
+        if node is None:
+            return
+        top = self._top(node)
+        yield from top
+        if len(top) < self.top_k:
+            return
+        # Past the cached head: merge the postings of every completion
+        streams = [self.postings[term] for term in self.prefix_terms(prefix)]
+        yield from islice(_unique(heapq.merge(*streams, key=self.rank.__getitem__)), len(top), None)
+
+    def similar_terms(self, word):
+        """{term: similarity} of other terms sharing enough n-grams with `word`"""
+        if len(word) < 3:
+            return {}
+        grams = ngrams(word)
+        shared = Counter()
+        for gram in grams:
+            shared.update(self.grams.get(gram, ()))
+        similar = {}
+        for term, count in shared.items():
+            similarity = 2 * count / (len(grams) + self.gram_counts[term])
+            if similarity >= FUZZY_MIN and term != word:
+                similar[term] = similarity
+        return similar
+
+    def _fuzzy(self, word):
+        """(sort key, doc) of the docs with a term similar to `word`, in order"""
+        groups = defaultdict(list)
+        for term, similarity in self.similar_terms(word).items():
+            groups[similarity].append(self.postings[term])
+        # Most similar terms first; a doc comes with its most similar term
+        for similarity in sorted(groups, reverse=True):
+            for doc in heapq.merge(*groups[similarity], key=self.rank.__getitem__):
+                yield (FUZZY, -similarity, self.rank[doc]), doc
+
+    def _ranked(self, docs, last):
+        """(sort key, doc) of a candidate set matched against the last query word, in order"""
+        similar = None
+        ranked = []
+        for doc in docs:
+            terms = self.docs[doc][2]
+            if last in terms:
+                ranked.append(((EXACT, 0, self.rank[doc]), doc))
+            elif any(term.startswith(last) for term in terms):
+                ranked.append(((PREFIX, 0, self.rank[doc]), doc))
+            else:
+                if similar is None:
+                    similar = self.similar_terms(last)
+                similarity = max((similar.get(term, 0) for term in terms), default=0)
+                if similarity:
+                    ranked.append(((FUZZY, -similarity, self.rank[doc]), doc))
+        ranked.sort()
+        return ranked
+
+    def _postings_count(self, terms):
+        return sum(len(self.postings[term]) for term in terms)
+
+    def matches(self, last, leading=()):
+        """(sort key, doc) of every match, best first"""
+        if leading:
+            # Start from the rarest word rather than stream a common last word
+            terms = {word: self.prefix_terms(word) for word in leading}
+            rarest = min(leading, key=lambda word: self._postings_count(terms[word]))
+            if self._postings_count(terms[rarest]) < self._postings_count(self.prefix_terms(last)):
+                candidates = set()
+                for term in terms[rarest]:
+                    candidates.update(self.postings[term])
+                yield from self._ranked(
+                    (doc for doc in candidates if _has_prefixes(self.docs[doc][2], leading)), last)
+                return
+        stream = chain(
+            (((EXACT, 0, self.rank[doc]), doc) for doc in self.postings.get(last, ())),
+            (((PREFIX, 0, self.rank[doc]), doc) for doc in self.completions(last)),
+            self._fuzzy(last),  # a generator: only computed if the stream gets this far
+        )
+        seen = set()
+        for key, doc in stream:
+            if doc in seen:
+                continue
+            seen.add(doc)
+            if not leading or _has_prefixes(self.docs[doc][2], leading):
+                yield key, doc
+
+
+class AssetSearch:
+    """Search index over (kind, AssetLibrary) pairs, e.g. [('emoji', ...), ('gif', ...)]"""
+
+    def __init__(self, libraries, top_k=TOP_K):
+        self.libraries = list(libraries)
+        self.docs = {}
+        self.rank = {}
+        self.indexes = {kind: _TermIndex(self.docs, self.rank, top_k) for kind, _ in self.libraries}
+        self.refreshed = 0.0
+        self._tags = {}  # kind -> (tags.json mtime, tags)
+        self._next_id = 0
+        self._refreshing = False
+        self._lock = threading.RLock()
+        self.refresh()
+
+    def __len__(self):
+        return len(self.docs)
+
+    def _load_tags(self, kind, directory):
+        """(tags, changed) from the library's tags.json"""
+        path = os.path.join(directory, TAGS_FILE)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            mtime = None
+        old_mtime, old_tags = self._tags.get(kind, (None, {}))
+        if mtime == old_mtime:
+            return old_tags, False
+        tags = {}
+        if mtime is not None:
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    tags = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Could not read {path}: {e}")
+        self._tags[kind] = (mtime, tags)
+        return tags, tags != old_tags
+
+    def refresh(self):
+        """Bring the index up to date with the libraries; returns (added, removed)"""
+        added = removed = 0
+        for kind, library in self.libraries:
+            library.refresh()
+            current = set(library.entries)
+            index = self.indexes[kind]
+            with self._lock:
+                old_tags = self._tags.get(kind, (None, {}))[1]
+                tags, tags_changed = self._load_tags(kind, library.directory)
+                indexed = set(index.names)
+                stale = indexed - current
+                fresh = current - indexed
+                if tags_changed:
+                    retagged = {name for name in indexed & current if old_tags.get(name) != tags.get(name)}
+                    stale |= retagged
+                    fresh |= retagged
+                touched = set()
+                for name in stale:
+                    doc = index.names.pop(name)
+                    index.remove(doc, self.docs.pop(doc)[2], touched)
+                    del self.rank[doc]
+                for name in fresh:
+                    doc = self._next_id
+                    self._next_id += 1
+                    terms = asset_terms(name, tags.get(name, ()))
+                    stem = os.path.splitext(name)[0].lower()
+                    self.docs[doc] = (kind, name, terms)
+                    self.rank[doc] = (len(stem), stem, kind, name)
+                    index.names[name] = doc
+                    index.add(doc, terms, touched)
+                index.finish(touched)
+                added += len(fresh)
+                removed += len(stale)
+        self.refreshed = time.time()
+        return added, removed
+
+    def maybe_refresh(self, max_age=REFRESH_INTERVAL):
+        """Refresh in a background thread if the last one is older than max_age seconds"""
+        with self._lock:
+            if self._refreshing or time.time() - self.refreshed < max_age:
+                return False
+            self._refreshing = True
+
+        def run():
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Asset search refresh failed: {e}")
+            finally:
+                self._refreshing = False
+        threading.Thread(target=run, daemon=True).start()
+        return True
+
+    def search(self, query, limit=20, offset=0, kind=None):
+        """One page of ranked matches: {'results': [...], 'has_more': bool}.
+
+        The last query word is matched as a prefix (or fuzzily); any earlier
+        words must each start one of the asset's terms.
+        """
+        query_words = words(query)
+        if not query_words:
+            return {'results': [], 'has_more': False}
+        *leading, last = query_words
+        if kind:
+            indexes = [self.indexes[kind]] if kind in self.indexes else []
+        else:
+            indexes = list(self.indexes.values())
+        with self._lock:
+            merged = heapq.merge(*(index.matches(last, leading) for index in indexes))
+            page = []
+            for key, doc in islice(merged, offset + limit + 1):
+                doc_kind, name, _ = self.docs[doc]
+                page.append({'kind': doc_kind, 'name': name, 'match': MATCH_NAMES[key[0]]})
+        return {'results': page[offset:offset + limit], 'has_more': len(page) > offset + limit}
+
+
+def main(argv=None):
+    from asset_library import AssetLibrary, EMOJI_EXTENSIONS, GIF_EXTENSIONS
+
+    root = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description='Search the emoji and GIF libraries')
+    parser.add_argument('queries', nargs='+')
+    parser.add_argument('--emojis', default=os.path.join(root, 'assests', 'emojis'))
+    parser.add_argument('--gifs', default=os.path.join(root, 'assests', 'gifs'))
+    parser.add_argument('--limit', type=int, default=10)
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    search = AssetSearch([
+        ('emoji', AssetLibrary(args.emojis, EMOJI_EXTENSIONS, decode=False)),
+        ('gif', AssetLibrary(args.gifs, GIF_EXTENSIONS, decode=False)),
+    ])
+    print(f'Indexed {len(search)} assets in {time.perf_counter() - started:.2f}s')
+    for query in args.queries:
+        started = time.perf_counter()
+        page = search.search(query, args.limit)
+        took = (time.perf_counter() - started) * 1000
+        names = ', '.join(f"{item['name']} ({item['match']})" for item in page['results'])
+        print(f'{query!r} [{took:.2f} ms]: {names}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,286 @@
+"""Pack the emoji library into sprite atlases.
+
+Every emoji (scaled to fit --size) is packed into one or more atlas pages
+with shelf bin-packing (first-fit, decreasing height). The output folder
+gets:
+
+  atlas_<n>.<hash>.png   the pages
+  atlas.<hash>.css       .emoji-sprite/.emoji-<name> classes for the website
+  atlas.json             sprite name -> page and rectangle, plus the inputs
+
+build_assets.py runs this into dist/static/atlas and links the CSS from the
+built pages; sticker_renderer.use_built_atlas() loads the pages for sticker
+labels.
+
+Rebuilds are incremental: nothing is written when no asset changed, changed
+sprites that keep their size are patched into their page in place, and only
+added, removed or resized sprites trigger a repack.
+
+    python atlas_builder.py                       # assests/emojis -> dist/static/atlas
+    python atlas_builder.py --src my/emojis --size 48 --page-size 1024
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+
+from PIL import Image
+
+from asset_library import AssetLibrary, EMOJI_EXTENSIONS, write_json_atomic
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_SOURCE = os.path.join(ROOT, 'assests', 'emojis')
+DEFAULT_OUT = os.path.join(ROOT, 'dist', 'static', 'atlas')
+DEFAULT_SPRITE_SIZE = 64
+DEFAULT_PAGE_SIZE = 2048
+DEFAULT_PADDING = 1
+INDEX_NAME = 'atlas.json'
+ATLAS_VERSION = 1
+
+
+def css_class(name):
+    stem = os.path.splitext(name)[0].lower()
+    return 'emoji-' + re.sub(r'[^a-z0-9_-]+', '-', stem).strip('-')
+
+
+def pack_shelves(sizes, page_size, padding=DEFAULT_PADDING):
+    """Shelf first-fit decreasing-height packing.
+
+    `sizes` maps name -> (width, height). Returns (placements, pages) where
+    placements maps name -> (page, x, y) and pages is a list of the used
+    (width, height) of each page.
+    """
+    order = sorted(sizes, key=lambda name: (-sizes[name][1], -sizes[name][0], name))
+    pages = []       # per page: list of shelves [y, height, next_x]
+    extents = []     # per page: [used_width, used_height]
+    placements = {}
+    for name in order:
+        width, height = sizes[name]
+        w, h = width + padding, height + padding
+        if w > page_size or h > page_size:
+            raise ValueError(f'{name} ({width}x{height}) does not fit in a {page_size}px page')
+        placed = False
+        for page_index, shelves in enumerate(pages):
+            for shelf in shelves:
+                if h <= shelf[1] and shelf[2] + w <= page_size:
+                    placements[name] = (page_index, shelf[2], shelf[0])
+                    shelf[2] += w
+                    placed = True
+                    break
+            if not placed:
+                top = shelves[-1][0] + shelves[-1][1] if shelves else 0
+                if top + h <= page_size:
+                    shelves.append([top, h, w])
+                    placements[name] = (page_index, 0, top)
+                    placed = True
+            if placed:
+                extent = extents[page_index]
+                x, y = placements[name][1:]
+                extent[0] = max(extent[0], x + width)
+                extent[1] = max(extent[1], y + height)
+                break
+        if not placed:
+            pages.append([[0, h, w]])
+            extents.append([width, height])
+            placements[name] = (len(pages) - 1, 0, 0)
+    return placements, [tuple(extent) for extent in extents]
+
+
+def _file_hash(data):
+    return hashlib.sha256(data).hexdigest()[:10]
+
+
+def _save_png(image, out_dir, stem):
+    """Save an image under a content-hashed name and return that name"""
+    tmp_path = os.path.join(out_dir, f'{stem}.tmp.png')
+    image.save(tmp_path, format='PNG', optimize=True)
+    with open(tmp_path, 'rb') as f:
+        digest = _file_hash(f.read())
+    name = f'{stem}.{digest}.png'
+    os.replace(tmp_path, os.path.join(out_dir, name))
+    return name
+
+
+def _write_css(out_dir, index):
+    lines = ['.emoji-sprite{display:inline-block;background-repeat:no-repeat}']
+    for name, sprite in sorted(index['sprites'].items()):
+        page = index['pages'][sprite['page']]['file']
+        lines.append(
+            f".{css_class(name)}{{background-image:url({page});"
+            f"background-position:-{sprite['x']}px -{sprite['y']}px;"
+            f"width:{sprite['w']}px;height:{sprite['h']}px;"
+            # The emoji character stays in the element as the fallback and for copying
+            f"color:transparent;overflow:hidden}}"
+        )
+    data = ('\n'.join(lines) + '\n').encode('utf-8')
+    css_name = f'atlas.{_file_hash(data)}.css'
+    with open(os.path.join(out_dir, css_name), 'wb') as f:
+        f.write(data)
+    return css_name
+
+
+def load_index(out_dir):
+    try:
+        with open(os.path.join(out_dir, INDEX_NAME), 'r') as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return index if index.get('version') == ATLAS_VERSION else None
+
+
+def _remove_unreferenced(out_dir, index):
+    keep = {INDEX_NAME, index['css']} | {page['file'] for page in index['pages']}
+    for name in os.listdir(out_dir):
+        if name.startswith('atlas') and name not in keep:
+            os.remove(os.path.join(out_dir, name))
+
+
+def build_atlas(source_dir=DEFAULT_SOURCE, out_dir=DEFAULT_OUT, sprite_size=DEFAULT_SPRITE_SIZE,
+                page_size=DEFAULT_PAGE_SIZE, padding=DEFAULT_PADDING, force=False, log=print):
+    """Build or incrementally update the atlas; returns the index dict"""
+    library = AssetLibrary(source_dir, EMOJI_EXTENSIONS)
+    # Re-stat every file so edits that keep the folder mtime are seen too
+    library.refresh(force=True)
+    os.makedirs(out_dir, exist_ok=True)
+    settings = {'sprite_size': sprite_size, 'page_size': page_size, 'padding': padding}
+    sources = {name: [library.entries[name]['size'], library.entries[name]['mtime']] for name in library}
+    previous = None if force else load_index(out_dir)
+
+    if previous and previous['settings'] == settings:
+        if previous['sources'] == sources:
+            log('atlas: up to date')
+            return previous
+        changed = [name for name in sources if previous['sources'].get(name) != sources[name]]
+        if set(previous['sources']) == set(sources):
+            patched = _patch_in_place(library, out_dir, previous, changed, sprite_size)
+            library.save_index()  # content hashes of the new thumbnails
+            if patched is not None:
+                patched['sources'] = sources
+                patched['css'] = _write_css(out_dir, patched)
+                write_json_atomic(os.path.join(out_dir, INDEX_NAME), patched)
+                _remove_unreferenced(out_dir, patched)
+                log(f'atlas: patched {len(changed)} sprite(s) in place')
+                return patched
+
+    # Full repack
+    sprites = {}
+    for name in library:
+        sprites[name] = library.thumbnail(name, (sprite_size, sprite_size))
+    library.save_index()
+    placements, extents = pack_shelves({name: img.size for name, img in sprites.items()}, page_size, padding)
+    page_images = [Image.new('RGBA', extent, (0, 0, 0, 0)) for extent in extents]
+    index_sprites = {}
+    for name, (page, x, y) in placements.items():
+        image = sprites[name]
+        page_images[page].paste(image, (x, y))
+        index_sprites[name] = {'page': page, 'x': x, 'y': y, 'w': image.width, 'h': image.height}
+    index = {
+        'version': ATLAS_VERSION,
+        'settings': settings,
+        'sources': sources,
+        'pages': [{'file': _save_png(img, out_dir, f'atlas_{i}'), 'width': img.width, 'height': img.height}
+                  for i, img in enumerate(page_images)],
+        'sprites': index_sprites,
+    }
+    index['css'] = _write_css(out_dir, index)
+    write_json_atomic(os.path.join(out_dir, INDEX_NAME), index)
+    _remove_unreferenced(out_dir, index)
+    log(f'atlas: packed {len(index_sprites)} sprite(s) into {len(page_images)} page(s)')
+    return index
+
+
+def _patch_in_place(library, out_dir, index, changed, sprite_size):
+    """Redraw changed sprites into their existing slots, or None if a size changed"""
+    updates = {}
+    for name in changed:
+        image = library.thumbnail(name, (sprite_size, sprite_size))
+        sprite = index['sprites'][name]
+        if image.size != (sprite['w'], sprite['h']):
+            return None
+        updates[name] = image
+    index = json.loads(json.dumps(index))
+    for page_number in sorted({index['sprites'][name]['page'] for name in updates}):
+        page = index['pages'][page_number]
+        with open(os.path.join(out_dir, page['file']), 'rb') as f:
+            page_image = Image.open(f)
+            page_image.load()
+        for name, image in updates.items():
+            sprite = index['sprites'][name]
+            if sprite['page'] != page_number:
+                continue
+            box = (sprite['x'], sprite['y'], sprite['x'] + sprite['w'], sprite['y'] + sprite['h'])
+            page_image.paste((0, 0, 0, 0), box)
+            page_image.paste(image, box[:2])
+        page['file'] = _save_png(page_image, out_dir, f'atlas_{page_number}')
+    return index
+
+
+class SpriteAtlas:
+    """In-memory sprite lookups backed by the atlas pages"""
+
+    def __init__(self, out_dir=DEFAULT_OUT):
+        self.out_dir = out_dir
+        self.index = load_index(out_dir) or {'pages': [], 'sprites': {}}
+        self._pages = {}
+        self._sprites = {}
+        self._by_stem = {os.path.splitext(name)[0].lower(): name for name in self.index['sprites']}
+
+    def __contains__(self, name):
+        return name in self.index['sprites']
+
+    def __len__(self):
+        return len(self.index['sprites'])
+
+    def _page(self, number):
+        page = self._pages.get(number)
+        if page is None:
+            with open(os.path.join(self.out_dir, self.index['pages'][number]['file']), 'rb') as f:
+                page = Image.open(f)
+                page.load()
+            self._pages[number] = page
+        return page
+
+    def get(self, name):
+        """Sprite image by file name (e.g. 'smile.png'), or None"""
+        sprite = self._sprites.get(name)
+        if sprite is None:
+            rect = self.index['sprites'].get(name)
+            if rect is None:
+                return None
+            box = (rect['x'], rect['y'], rect['x'] + rect['w'], rect['y'] + rect['h'])
+            sprite = self._page(rect['page']).crop(box)
+            self._sprites[name] = sprite
+        return sprite
+
+    def find(self, stem):
+        """Sprite by file name without extension (case-insensitive), or None"""
+        name = self._by_stem.get(stem.lower())
+        return self.get(name) if name else None
+
+    def find_emoji(self, emoji):
+        """Sprite for an emoji character, using codepoint file names like '1f604.png'"""
+        codepoints = [f'{ord(char):x}' for char in emoji if char != '\ufe0f']
+        return self.find('-'.join(codepoints)) or self.find('_'.join(codepoints))
+
+
+def load_atlas(out_dir=DEFAULT_OUT):
+    """The built atlas as a SpriteAtlas, or None if it hasn't been built"""
+    atlas = SpriteAtlas(out_dir)
+    return atlas if len(atlas) else None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Pack the emoji library into sprite atlases')
+    parser.add_argument('--src', default=DEFAULT_SOURCE, help='Emoji folder')
+    parser.add_argument('--out', default=DEFAULT_OUT, help='Output folder')
+    parser.add_argument('--size', type=int, default=DEFAULT_SPRITE_SIZE, help='Max sprite width/height')
+    parser.add_argument('--page-size', type=int, default=DEFAULT_PAGE_SIZE, help='Max atlas page size')
+    parser.add_argument('--padding', type=int, default=DEFAULT_PADDING, help='Gap between sprites')
+    parser.add_argument('--force', action='store_true', help='Repack even if nothing changed')
+    args = parser.parse_args(argv)
+    build_atlas(args.src, args.out, args.size, args.page_size, args.padding, args.force)
+
+
+if __name__ == '__main__':
+    main()
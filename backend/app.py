@@ -1,20 +1,53 @@
-from flask import Flask, request, jsonify, session, redirect
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask import Flask, Response, request, jsonify, session, redirect, send_from_directory, send_file, abort
 from flask_cors import CORS
+import hashlib
 import json
+import mimetypes
 import os
-import requests
+import re
+import threading
+import time
+from urllib.parse import quote
+from datetime import datetime, timezone
+from werkzeug.security import generate_password_hash, check_password_hash, safe_join
 from dotenv import load_dotenv
-from datetime import datetime
+try:
+    from hll import HyperLogLog
+    from compression import Compress, accepts_gzip
+    from sticker_jobs import StickerJobs, QueueFull, UserLimitReached, ExportFailed, DEFAULT_WORKERS
+    from json_store import JsonFile, locked
+except ImportError:
+    from backend.hll import HyperLogLog
+    from backend.compression import Compress, accepts_gzip
+    from backend.sticker_jobs import StickerJobs, QueueFull, UserLimitReached, ExportFailed, DEFAULT_WORKERS
+    from backend.json_store import JsonFile, locked
+# Loaded before any setting below is read, so .env can set all of them
 load_dotenv(os.path.join(os.path.dirname(__file__), '.env'))
 
 # --- Google OAuth routes merged from google_oauth_demo.py ---
-GOOGLE_CLIENT_ID = os.environ.get('GOOGLE_CLIENT_ID', 'YOUR_CLIENT_ID')
-GOOGLE_CLIENT_SECRET = os.environ.get('GOOGLE_CLIENT_SECRET', 'YOUR_CLIENT_SECRET')
-GOOGLE_REDIRECT_URI = os.environ.get('GOOGLE_REDIRECT_URI', 'http://127.0.0.1:5000/api/auth/google/callback')
+# Built on first use by an OAuth route
+_google_config = None
 
-app = Flask(__name__)
-app.secret_key = os.urandom(24)  # Needed for session management
+def google_config():
+    global _google_config
+    if _google_config is None:
+        _google_config = {
+            'client_id': os.environ.get('GOOGLE_CLIENT_ID', 'YOUR_CLIENT_ID'),
+            'client_secret': os.environ.get('GOOGLE_CLIENT_SECRET', 'YOUR_CLIENT_SECRET'),
+            'redirect_uri': os.environ.get('GOOGLE_REDIRECT_URI', 'http://127.0.0.1:5000/api/auth/google/callback')
+        }
+    return _google_config
+
+# Output of build_assets.py (fingerprinted, minified, precompressed site)
+DIST_DIR = os.environ.get('STATIC_DIST_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dist'))
+# Hashed filenames never change content, so they can be cached forever
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# Build outputs named <name>.<10 hex digit hash>.<ext>
+FINGERPRINTED_NAME = re.compile(r'\.[0-9a-f]{10}\.[a-z0-9]+$')
+
+app = Flask(__name__, static_folder=None)  # /static is served from DIST_DIR below
+# Needed for session management; set FLASK_SECRET_KEY so several workers accept each other's cookies
+app.secret_key = os.environ.get('FLASK_SECRET_KEY') or os.urandom(24)
 # --- Fix: Set session cookie attributes for OAuth/session sharing ---
 app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
 app.config['SESSION_COOKIE_SECURE'] = False  # Set to True if using HTTPS
@@ -25,48 +58,126 @@ CORS(app, supports_credentials=True, origins=[
     "http://127.0.0.1:5507",
     "http://127.0.0.1:5000",
     "http://192.168.1.5:5507"
-])  # Allow localhost, 127.0.0.1, and LAN IP
+], expose_headers=['X-Download-Count'])  # Allow localhost, 127.0.0.1, and LAN IP
+# gzip JSON responses; tune with COMPRESS_MIN_SIZE / COMPRESS_LEVEL / COMPRESS_CACHE_BYTES
+app.config['COMPRESS_MIN_SIZE'] = int(os.environ.get('COMPRESS_MIN_SIZE', 500))
+app.config['COMPRESS_LEVEL'] = int(os.environ.get('COMPRESS_LEVEL', 6))
+app.config['COMPRESS_CACHE_BYTES'] = int(os.environ.get('COMPRESS_CACHE_BYTES', 8 * 1024 * 1024))
+Compress(app)
 USERS_FILE = 'users.json'
 # File to store channel join data
 CHANNELS_FILE = 'channels.json'
 # File to store analytics data
 ANALYTICS_FILE = 'analytics.json'
+# Folder of per-event, per-hour HyperLogLog sketches of unique users and IPs,
+# one file per event type and hour so an event only rewrites its own bucket
+SKETCHES_DIR = 'analytics_sketches'
+
+# Each worker caches the parsed files and reloads them when another worker
+# writes; STORAGE_MAX_STALE lets reads skip the check for that many seconds
+STORAGE_MAX_STALE = float(os.environ.get('STORAGE_MAX_STALE', 0))
+users_file = JsonFile(USERS_FILE, max_stale=STORAGE_MAX_STALE)
+channels_file = JsonFile(CHANNELS_FILE, indent=2, max_stale=STORAGE_MAX_STALE)
+analytics_file = JsonFile(ANALYTICS_FILE, indent=2, max_stale=STORAGE_MAX_STALE)
 
-# Helper to load users
+# Helper to load users (a private copy to modify; hold locked(users_file) until saved)
 def load_users():
-    if not os.path.exists(USERS_FILE):
-        return {}
-    with open(USERS_FILE, 'r') as f:
-        return json.load(f)
+    return users_file.load()
+
+# Helper to read users without modifying them (shared cached copy)
+def read_users():
+    return users_file.read()
 
 # Helper to save users
 def save_users(users):
-    with open(USERS_FILE, 'w') as f:
-        json.dump(users, f)
+    users_file.save(users)
 
 # Helper to load channel data
 def load_channels():
-    if not os.path.exists(CHANNELS_FILE):
-        return {}
-    with open(CHANNELS_FILE, 'r') as f:
-        return json.load(f)
+    return channels_file.load()
+
+# Helper to read channel data without modifying it
+def read_channels():
+    return channels_file.read()
 
 # Helper to save channel data
 def save_channels(channels):
-    with open(CHANNELS_FILE, 'w') as f:
-        json.dump(channels, f, indent=2)
+    channels_file.save(channels)
 
 # Helper to load analytics data
 def load_analytics():
-    if not os.path.exists(ANALYTICS_FILE):
-        return {}
-    with open(ANALYTICS_FILE, 'r') as f:
-        return json.load(f)
+    return analytics_file.load()
 
 # Helper to save analytics data
 def save_analytics(analytics):
-    with open(ANALYTICS_FILE, 'w') as f:
-        json.dump(analytics, f, indent=2)
+    analytics_file.save(analytics)
+
+# Helper to map an event timestamp to its hourly sketch bucket ('YYYY-MM-DDTHH');
+# raises ValueError for a malformed timestamp
+def sketch_bucket(timestamp):
+    when = datetime.fromisoformat(str(timestamp).replace('Z', '+00:00'))
+    if when.tzinfo is not None:
+        when = when.astimezone(timezone.utc).replace(tzinfo=None)
+    return when.strftime('%Y-%m-%dT%H')
+
+# Helper to find the folder of an event type's sketches (event names are client input,
+# so the folder is named after their hash)
+def sketch_dir(event_type):
+    return os.path.join(SKETCHES_DIR, hashlib.sha256(event_type.encode('utf-8')).hexdigest()[:16])
+
+# Helper to get the file holding one event type's sketches for one hour
+def sketch_file(event_type, bucket):
+    return JsonFile(os.path.join(sketch_dir(event_type), bucket + '.json'))
+
+# Helper to fold one event into its hour's unique-count sketches at ingest time;
+# reads and rewrites only that bucket's file, so the cost doesn't grow with history
+def record_event_sketch(event_type, timestamp, user_email, ip):
+    try:
+        bucket = sketch_bucket(timestamp)
+    except ValueError:
+        bucket = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H')
+    sketch = sketch_file(event_type, bucket)
+    os.makedirs(os.path.dirname(sketch.path), exist_ok=True)
+    with locked(sketch):
+        entry = sketch.load()
+        if entry:
+            users_hll = HyperLogLog.from_dict(entry['users'])
+            ips_hll = HyperLogLog.from_dict(entry['ips'])
+        else:
+            entry = {'event': event_type, 'events': 0}
+            users_hll = HyperLogLog()
+            ips_hll = HyperLogLog()
+        users_hll.add(user_email)
+        ips_hll.add(ip)
+        entry['events'] += 1
+        entry['users'] = users_hll.to_dict()
+        entry['ips'] = ips_hll.to_dict()
+        sketch.save(entry)
+
+# Helper to list (bucket, entry) for the stored sketches in a bucket range; buckets
+# outside the range are skipped by file name without being read
+def read_sketch_buckets(event_type=None, start_bucket=None, end_bucket=None):
+    if event_type:
+        folders = [sketch_dir(event_type)]
+    else:
+        try:
+            folders = [entry.path for entry in os.scandir(SKETCHES_DIR) if entry.is_dir()]
+        except FileNotFoundError:
+            folders = []
+    for folder in folders:
+        try:
+            names = os.listdir(folder)
+        except FileNotFoundError:
+            continue
+        for name in names:
+            if name.startswith('.') or not name.endswith('.json'):
+                continue
+            bucket = name[:-len('.json')]
+            if start_bucket and bucket < start_bucket:
+                continue
+            if end_bucket and bucket > end_bucket:
+                continue
+            yield bucket, JsonFile(os.path.join(folder, name)).read()
 
 # Helper to load user channel joins
 def load_user_joins():
@@ -84,15 +195,19 @@ def signup():
     username = data.get('username')
     if not email or not password or not username:
         return jsonify({'success': False, 'message': 'Missing fields'}), 400
-    users = load_users()
-    if email in users:
+    if email in read_users():
         return jsonify({'success': False, 'message': 'Email already registered'}), 409
-    users[email] = {
-        'username': username,
-        'password_hash': generate_password_hash(password),
-        'download_count': 0
-    }
-    save_users(users)
+    password_hash = generate_password_hash(password)
+    with locked(users_file):
+        users = load_users()
+        if email in users:
+            return jsonify({'success': False, 'message': 'Email already registered'}), 409
+        users[email] = {
+            'username': username,
+            'password_hash': password_hash,
+            'download_count': 0
+        }
+        save_users(users)
     return jsonify({'success': True, 'message': 'Account created'})
 
 @app.route('/api/login', methods=['POST'])
@@ -102,7 +217,7 @@ def login():
     password = data.get('password')
     if not email or not password:
         return jsonify({'success': False, 'message': 'Missing fields'}), 400
-    users = load_users()
+    users = read_users()
     user = users.get(email)
     if not user or not check_password_hash(user['password_hash'], password):
         return jsonify({'success': False, 'message': 'Invalid credentials'}), 401
@@ -119,7 +234,7 @@ def get_user():
     print(f"Debug: Full session data: {dict(session)}")
     if email and username:
         # Load user data to get profile picture
-        users = load_users()
+        users = read_users()
         user_data = users.get(email, {})
         user_response = {
             'logged_in': True,
@@ -144,7 +259,8 @@ def test_endpoint():
 @app.route('/api/health')
 def health_check():
     print("Debug: /api/health endpoint called")
-    return jsonify({'status': 'healthy', 'timestamp': str(os.popen('date /t && time /t').read().strip())})
+    return jsonify({'status': 'healthy', 'timestamp': str(os.popen('date /t && time /t').read().strip()),
+                    'sticker_jobs': sticker_jobs.stats()})
 
 @app.route('/api/debug/session')
 def debug_session():
@@ -159,10 +275,11 @@ def debug_session():
 
 @app.route('/api/auth/google')
 def google_login():
+    config = google_config()
     # For testing purposes, let's add some debugging
-    print(f"Google OAuth endpoint hit. Client ID: {GOOGLE_CLIENT_ID[:10]}...")
+    print(f"Google OAuth endpoint hit. Client ID: {config['client_id'][:10]}...")
     
-    if GOOGLE_CLIENT_ID == 'YOUR_CLIENT_ID':
+    if config['client_id'] == 'YOUR_CLIENT_ID':
         return jsonify({
             'error': 'Google OAuth not configured',
             'message': 'Please set up GOOGLE_CLIENT_ID and GOOGLE_CLIENT_SECRET environment variables'
@@ -171,8 +288,8 @@ def google_login():
     google_auth_url = (
         'https://accounts.google.com/o/oauth2/v2/auth'
         '?response_type=code'
-        f'&client_id={GOOGLE_CLIENT_ID}'
-        f'&redirect_uri={GOOGLE_REDIRECT_URI}'
+        f'&client_id={config["client_id"]}'
+        f'&redirect_uri={config["redirect_uri"]}'
         '&scope=openid%20email%20profile'
         '&access_type=online'
         '&prompt=select_account'
@@ -186,13 +303,16 @@ def google_callback():
     if not code:
         print("No code provided in callback")
         return 'No code provided', 400
+    # requests is only needed here, so it is imported on first use
+    import requests
+    config = google_config()
     # Exchange code for token
     token_url = 'https://oauth2.googleapis.com/token'
     data = {
         'code': code,
-        'client_id': GOOGLE_CLIENT_ID,
-        'client_secret': GOOGLE_CLIENT_SECRET,
-        'redirect_uri': GOOGLE_REDIRECT_URI,
+        'client_id': config['client_id'],
+        'client_secret': config['client_secret'],
+        'redirect_uri': config['redirect_uri'],
         'grant_type': 'authorization_code',
     }
     token_resp = requests.post(token_url, data=data)
@@ -211,21 +331,24 @@ def google_callback():
         return 'Failed to get user info', 400
     userinfo = userinfo_resp.json()
     # --- Integrate with user DB ---
-    users = load_users()
     email = userinfo.get('email')
     username = userinfo.get('name') or userinfo.get('email', '').split('@')[0]
     if not email:
         return 'No email from Google', 400
+    users = read_users()
     if email not in users:
-        # Register new user (no password, mark as google)
-        users[email] = {
-            'username': username,
-            'google_id': userinfo.get('id'),
-            'profile_pic': userinfo.get('picture', ''),
-            'oauth_provider': 'google',
-            'download_count': 0
-        }
-        save_users(users)
+        with locked(users_file):
+            users = load_users()
+            if email not in users:
+                # Register new user (no password, mark as google)
+                users[email] = {
+                    'username': username,
+                    'google_id': userinfo.get('id'),
+                    'profile_pic': userinfo.get('picture', ''),
+                    'oauth_provider': 'google',
+                    'download_count': 0
+                }
+                save_users(users)
     # Set session
     session['user_email'] = email
     session['username'] = users[email]['username']
@@ -312,18 +435,26 @@ def logout():
     session.clear()
     return jsonify({'success': True, 'message': 'Logged out'})
 
+# Helper to count one download for a user; returns the new count, or None if unknown
+def record_download(email):
+    with locked(users_file):
+        users = load_users()
+        if email not in users:
+            return None
+        users[email]['download_count'] = users[email].get('download_count', 0) + 1
+        save_users(users)
+    return users[email]['download_count']
+
 # Endpoint to increment user's download count
 @app.route('/api/user/increment_download', methods=['POST'])
 def increment_download():
     email = session.get('user_email')
     if not email:
         return jsonify({'success': False, 'message': 'Not logged in'}), 401
-    users = load_users()
-    if email not in users:
+    count = record_download(email)
+    if count is None:
         return jsonify({'success': False, 'message': 'User not found'}), 404
-    users[email]['download_count'] = users[email].get('download_count', 0) + 1
-    save_users(users)
-    return jsonify({'success': True, 'download_count': users[email]['download_count']})
+    return jsonify({'success': True, 'download_count': count})
 
 # Endpoint to join a channel/server
 @app.route('/api/join-channel', methods=['POST'])
@@ -341,51 +472,52 @@ def join_channel():
     if not all([channel_id, link, platform]):
         return jsonify({'success': False, 'message': 'Missing required fields'}), 400
     
-    # Load existing data
-    users = load_user_joins()
-    channels = load_channels()
+    with locked(users_file, channels_file):
+        # Load existing data
+        users = load_user_joins()
+        channels = load_channels()
     
-    # Update user's joined channels
-    if email not in users:
-        return jsonify({'success': False, 'message': 'User not found'}), 404
+        # Update user's joined channels
+        if email not in users:
+            return jsonify({'success': False, 'message': 'User not found'}), 404
     
-    if 'joined_channels' not in users[email]:
-        users[email]['joined_channels'] = []
+        if 'joined_channels' not in users[email]:
+            users[email]['joined_channels'] = []
     
-    # Check if already joined
-    already_joined = any(
-        join['channelId'] == channel_id for join in users[email]['joined_channels']
-    )
+        # Check if already joined
+        already_joined = any(
+            join['channelId'] == channel_id for join in users[email]['joined_channels']
+        )
     
-    if already_joined:
-        return jsonify({'success': False, 'message': 'Already joined this channel'}), 409
+        if already_joined:
+            return jsonify({'success': False, 'message': 'Already joined this channel'}), 409
     
-    # Add to user's joined channels
-    join_data = {
-        'channelId': channel_id,
-        'link': link,
-        'platform': platform,
-        'joinedAt': timestamp or datetime.now().isoformat()
-    }
-    users[email]['joined_channels'].append(join_data)
-    
-    # Update channel statistics
-    if channel_id not in channels:
-        channels[channel_id] = {
-            'id': channel_id,
-            'platform': platform,
+        # Add to user's joined channels
+        join_data = {
+            'channelId': channel_id,
             'link': link,
-            'members': [],
-            'joinCount': 0
+            'platform': platform,
+            'joinedAt': timestamp or datetime.now().isoformat()
         }
+        users[email]['joined_channels'].append(join_data)
     
-    if email not in channels[channel_id]['members']:
-        channels[channel_id]['members'].append(email)
-        channels[channel_id]['joinCount'] += 1
+        # Update channel statistics
+        if channel_id not in channels:
+            channels[channel_id] = {
+                'id': channel_id,
+                'platform': platform,
+                'link': link,
+                'members': [],
+                'joinCount': 0
+            }
     
-    # Save data
-    save_users(users)
-    save_channels(channels)
+        if email not in channels[channel_id]['members']:
+            channels[channel_id]['members'].append(email)
+            channels[channel_id]['joinCount'] += 1
+    
+        # Save data
+        save_users(users)
+        save_channels(channels)
     
     return jsonify({
         'success': True, 
@@ -404,11 +536,6 @@ def track_event():
     if not event_type:
         return jsonify({'success': False, 'message': 'Event type required'}), 400
     
-    analytics = load_analytics()
-    
-    if event_type not in analytics:
-        analytics[event_type] = []
-    
     event_data = {
         'timestamp': timestamp,
         'user_email': session.get('user_email'),
@@ -416,11 +543,55 @@ def track_event():
         'ip': request.remote_addr
     }
     
-    analytics[event_type].append(event_data)
-    save_analytics(analytics)
+    with locked(analytics_file):
+        analytics = load_analytics()
+        if event_type not in analytics:
+            analytics[event_type] = []
+        analytics[event_type].append(event_data)
+        save_analytics(analytics)
+    record_event_sketch(event_type, timestamp, event_data['user_email'], event_data['ip'])
     
     return jsonify({'success': True, 'message': 'Event tracked'})
 
+# Endpoint to estimate distinct users and IPs for an event type over a time range
+@app.route('/api/analytics/uniques', methods=['GET'])
+def get_unique_counts():
+    # Admin check can be more sophisticated
+    email = session.get('user_email')
+    users = read_users()
+    if not email or email != 'admin@example.com' or email not in users:
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 403
+    event_type = request.args.get('event')
+    start = request.args.get('start')
+    end = request.args.get('end')
+    try:
+        start_bucket = sketch_bucket(start) if start else None
+        end_bucket = sketch_bucket(end) if end else None
+    except ValueError:
+        return jsonify({'success': False, 'message': 'start and end must be ISO 8601 timestamps'}), 400
+    
+    # Merge every bucket in range; registers are fixed-size so this is O(buckets)
+    users_hll = HyperLogLog()
+    ips_hll = HyperLogLog()
+    total_events = 0
+    bucket_count = 0
+    for bucket, entry in read_sketch_buckets(event_type, start_bucket, end_bucket):
+        users_hll.merge(HyperLogLog.from_dict(entry['users']))
+        ips_hll.merge(HyperLogLog.from_dict(entry['ips']))
+        total_events += entry.get('events', 0)
+        bucket_count += 1
+    
+    return jsonify({
+        'success': True,
+        'event': event_type,
+        'start': start_bucket,
+        'end': end_bucket,
+        'buckets': bucket_count,
+        'events': total_events,
+        'uniqueUsers': users_hll.count(),
+        'uniqueIps': ips_hll.count()
+    })
+
 # Endpoint to get user's joined channels
 @app.route('/api/user-channels', methods=['GET'])
 def get_user_channels():
@@ -428,7 +599,7 @@ def get_user_channels():
     if not email:
         return jsonify({'success': False, 'message': 'Not logged in'}), 401
     
-    users = load_users()
+    users = read_users()
     if email not in users:
         return jsonify({'success': False, 'message': 'User not found'}), 404
     
@@ -442,7 +613,7 @@ def get_user_channels():
 # Endpoint to get channel statistics
 @app.route('/api/channel-stats', methods=['GET'])
 def get_channel_stats():
-    channels = load_channels()
+    channels = read_channels()
     
     stats = {
         'totalChannels': len(channels),
@@ -469,7 +640,7 @@ def get_channel_stats():
 # Endpoint to get popular channels
 @app.route('/api/popular-channels', methods=['GET'])
 def get_popular_channels():
-    channels = load_channels()
+    channels = read_channels()
     platform = request.args.get('platform', None)
     
     # Sort by join count
@@ -495,10 +666,10 @@ def get_popular_channels():
 def get_all_channels():
     # Admin check can be more sophisticated
     email = session.get('user_email')
-    users = load_users()
+    users = read_users()
     if not email or email != 'admin@example.com' or email not in users:
         return jsonify({'success': False, 'message': 'Unauthorized'}), 403
-    channels = load_channels()
+    channels = read_channels()
     return jsonify({'success': True, 'channels': channels})
 
 # Endpoint to create a new channel (admin)
@@ -511,20 +682,400 @@ def create_channel():
     channel_id = data.get('channel_id')
     if not channel_id:
         return jsonify({'success': False, 'message': 'Channel ID required'}), 400
-    users = load_users()
-    channels = load_channels()
+    users = read_users()
     # Admin check can be more sophisticated
     if email != 'admin@example.com' or email not in users:
         return jsonify({'success': False, 'message': 'Unauthorized'}), 403
-    if channel_id in channels:
-        return jsonify({'success': False, 'message': 'Channel ID already exists'}), 409
-    # Create new channel
-    channels[channel_id] = {
-        'members': [],
-        'join_time': str(datetime.now())
-    }
-    save_channels(channels)
+    with locked(channels_file):
+        channels = load_channels()
+        if channel_id in channels:
+            return jsonify({'success': False, 'message': 'Channel ID already exists'}), 409
+        # Create new channel
+        channels[channel_id] = {
+            'members': [],
+            'join_time': str(datetime.now())
+        }
+        save_channels(channels)
     return jsonify({'success': True, 'message': 'Channel created', 'channel_id': channel_id})
 
+# Sticker rendering runs in a process pool fed by a bounded job queue
+STICKER_MAX_UPLOAD = int(os.environ.get('STICKER_MAX_UPLOAD', 20 * 1024 * 1024))
+sticker_jobs = StickerJobs(
+    os.environ.get('STICKER_JOBS_DIR', 'sticker_jobs'),
+    workers=int(os.environ.get('STICKER_WORKERS', DEFAULT_WORKERS)),
+    max_pending=int(os.environ.get('STICKER_MAX_PENDING', 32)),
+    per_user_limit=int(os.environ.get('STICKER_USER_LIMIT', 2)),
+    # Rendered sheets are shared with the desktop app through the cache dir
+    store_dir=os.environ.get('STICKER_STORE_DIR'),
+    store_bytes=int(os.environ.get('STICKER_STORE_BYTES', 256 * 1024 * 1024))
+)
+
+# Endpoint to upload a photo and queue a sticker sheet render
+@app.route('/api/stickers', methods=['POST'])
+def create_sticker_job():
+    email = session.get('user_email')
+    if not email:
+        return jsonify({'success': False, 'message': 'Not logged in'}), 401
+    if request.content_length and request.content_length > STICKER_MAX_UPLOAD:
+        return jsonify({'success': False, 'message': 'Photo is too large'}), 413
+    photo = request.files.get('photo')
+    if not photo:
+        return jsonify({'success': False, 'message': 'No photo uploaded'}), 400
+    photo_bytes = photo.read(STICKER_MAX_UPLOAD + 1)
+    if len(photo_bytes) > STICKER_MAX_UPLOAD:
+        return jsonify({'success': False, 'message': 'Photo is too large'}), 413
+    try:
+        job = sticker_jobs.submit(email, photo_bytes, request.form.get('style'))
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except UserLimitReached as e:
+        return jsonify({'success': False, 'message': str(e)}), 429
+    except QueueFull as e:
+        response = jsonify({'success': False, 'message': str(e)})
+        response.headers['Retry-After'] = '5'
+        return response, 503
+    return jsonify({
+        'success': True,
+        'job': job,
+        'status_url': f"/api/stickers/{job['id']}",
+        'events_url': f"/api/stickers/{job['id']}/events",
+        'sheet_url': f"/api/stickers/{job['id']}/sheet"
+    }), 200 if job['status'] == 'done' else 202  # done already when served from the sticker store
+
+# Endpoint to poll a sticker job
+@app.route('/api/stickers/<job_id>', methods=['GET'])
+def get_sticker_job(job_id):
+    email = session.get('user_email')
+    if not email:
+        return jsonify({'success': False, 'message': 'Not logged in'}), 401
+    job = sticker_jobs.get(job_id, email)
+    if not job:
+        return jsonify({'success': False, 'message': 'Job not found'}), 404
+    return jsonify({'success': True, 'job': sticker_jobs.describe(job)})
+
+# Endpoint to fetch a finished sticker sheet
+@app.route('/api/stickers/<job_id>/sheet', methods=['GET'])
+def get_sticker_sheet(job_id):
+    email = session.get('user_email')
+    if not email:
+        return jsonify({'success': False, 'message': 'Not logged in'}), 401
+    job = sticker_jobs.get(job_id, email)
+    if not job:
+        return jsonify({'success': False, 'message': 'Job not found'}), 404
+    if job['status'] == 'failed':
+        return jsonify({'success': False, 'message': job['error'], 'job': sticker_jobs.describe(job)}), 500
+    if job['status'] != 'done':
+        return jsonify({'success': False, 'message': 'Not ready yet', 'job': sticker_jobs.describe(job)}), 202
+    return send_file(job['output_path'], mimetype='image/png', download_name='chibi_stickers.png')
+
+# Endpoint to stream a sticker job's progress as Server-Sent Events
+@app.route('/api/stickers/<job_id>/events', methods=['GET'])
+def stream_sticker_events(job_id):
+    email = session.get('user_email')
+    if not email:
+        return jsonify({'success': False, 'message': 'Not logged in'}), 401
+    job = sticker_jobs.get(job_id, email)
+    if not job:
+        return jsonify({'success': False, 'message': 'Job not found'}), 404
+    try:
+        last_id = int(request.headers.get('Last-Event-ID', 0))
+    except ValueError:
+        last_id = 0
+
+    def generate():
+        yield 'retry: 2000\n\n'
+        for item in sticker_jobs.follow_events(job, last_id):
+            if item is None:
+                yield ': keep-alive\n\n'
+                continue
+            event_id, event = item
+            if event['stage'] == 'sticker':
+                event['url'] = f"/api/stickers/{job_id}/stickers/{event['index']}"
+            elif event['stage'] == 'done':
+                event['sheet_url'] = f"/api/stickers/{job_id}/sheet"
+            yield f"id: {event_id}\nevent: {event['stage']}\ndata: {json.dumps(event)}\n\n"
+
+    response = Response(generate(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # don't let nginx buffer the stream
+    return response
+
+# Endpoint to fetch one finished sticker while the sheet is still rendering
+@app.route('/api/stickers/<job_id>/stickers/<int:index>', methods=['GET'])
+def get_sticker_image(job_id, index):
+    email = session.get('user_email')
+    if not email:
+        return jsonify({'success': False, 'message': 'Not logged in'}), 401
+    job = sticker_jobs.get(job_id, email)
+    path = sticker_jobs.sticker_file(job, index) if job else None
+    if not path:
+        return jsonify({'success': False, 'message': 'Sticker not found'}), 404
+    return send_file(path, mimetype='image/png', max_age=3600)
+
+# Helper to send a job's export file, or 202 while the render pool encodes it
+def send_sticker_export(job, name, kind, mimetype, download_name, as_attachment=False, **options):
+    try:
+        path = sticker_jobs.export_file(job, name, kind, **options)
+    except ExportFailed as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+    except QueueFull as e:
+        response = jsonify({'success': False, 'message': str(e)})
+        response.headers['Retry-After'] = '5'
+        return response, 503
+    if path is None:
+        response = jsonify({'success': False, 'message': 'Encoding, try again shortly', 'job': sticker_jobs.describe(job)})
+        response.headers['Retry-After'] = '2'
+        return response, 202
+    # conditional=True answers Range and If-None-Match requests
+    return send_file(path, mimetype=mimetype, as_attachment=as_attachment, download_name=download_name,
+                     conditional=True, max_age=3600)
+
+# Endpoint to download a finished job as a ZIP sticker pack, encoded once in the render pool
+@app.route('/api/stickers/<job_id>/pack', methods=['GET'])
+def get_sticker_pack(job_id):
+    email = session.get('user_email')
+    if not email:
+        return jsonify({'success': False, 'message': 'Not logged in'}), 401
+    job = sticker_jobs.get(job_id, email)
+    if not job:
+        return jsonify({'success': False, 'message': 'Job not found'}), 404
+    if job['status'] != 'done':
+        return jsonify({'success': False, 'message': 'Not ready yet', 'job': sticker_jobs.describe(job)}), 409
+    import sticker_export
+    try:
+        sizes = [int(size) for size in request.args.get('sizes', '').split(',') if size] or sticker_export.EXPORT_SIZES
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Invalid sizes'}), 400
+    if any(size < 16 or size > 1024 for size in sizes):
+        return jsonify({'success': False, 'message': 'Sizes must be between 16 and 1024'}), 400
+    sizes = sorted(set(sizes))
+    return send_sticker_export(job, f"pack_{'-'.join(map(str, sizes))}.zip", 'pack', 'application/zip',
+                               'chibi_sticker_pack.zip', as_attachment=True, sizes=sizes)
+
+# Endpoint to download a finished job as an animated GIF or WebP, encoded once in the render pool
+@app.route('/api/stickers/<job_id>/animated.<fmt>', methods=['GET'])
+def get_sticker_animation(job_id, fmt):
+    email = session.get('user_email')
+    if not email:
+        return jsonify({'success': False, 'message': 'Not logged in'}), 401
+    if fmt not in ('gif', 'webp'):
+        return jsonify({'success': False, 'message': 'Format must be gif or webp'}), 400
+    job = sticker_jobs.get(job_id, email)
+    if not job:
+        return jsonify({'success': False, 'message': 'Job not found'}), 404
+    if job['status'] != 'done':
+        return jsonify({'success': False, 'message': 'Not ready yet', 'job': sticker_jobs.describe(job)}), 409
+    tween = request.args.get('tween', '0')
+    if not tween.isdigit() or int(tween) > 8:
+        return jsonify({'success': False, 'message': 'tween must be 0-8'}), 400
+    return send_sticker_export(job, f'animated_t{int(tween)}.{fmt}', 'animation', f'image/{fmt}',
+                               f'chibi_stickers.{fmt}', fmt=fmt, tween=int(tween))
+
+# Emoji/GIF files, served by /api/download and indexed for /api/emojis/search and /api/gifs
+ASSETS_DIR = os.path.abspath(os.environ.get('ASSETS_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'assests')))
+ASSET_FOLDERS = {'emoji': 'emojis', 'gif': 'gifs'}
+# Unversioned asset URLs may change content, so they are only cached briefly
+ASSET_CACHE_SECONDS = int(os.environ.get('ASSET_CACHE_SECONDS', 3600))
+# Optional nginx internal location aliased to ASSETS_DIR: nginx then sends the file itself
+ASSETS_ACCEL_REDIRECT = os.environ.get('ASSETS_ACCEL_REDIRECT')
+SEARCH_MAX_LIMIT = 100
+SEARCH_MAX_OFFSET = 1000
+_asset_search = None
+_asset_search_lock = threading.Lock()
+
+# Helper to get the shared emoji/GIF search index
+def get_asset_search():
+    global _asset_search
+    with _asset_search_lock:
+        if _asset_search is None:
+            from asset_library import AssetLibrary, EMOJI_EXTENSIONS, GIF_EXTENSIONS
+            from asset_search import AssetSearch
+            _asset_search = AssetSearch([
+                ('emoji', AssetLibrary(os.path.join(ASSETS_DIR, ASSET_FOLDERS['emoji']), EMOJI_EXTENSIONS, decode=False)),
+                ('gif', AssetLibrary(os.path.join(ASSETS_DIR, ASSET_FOLDERS['gif']), GIF_EXTENSIONS, decode=False))
+            ])
+        else:
+            _asset_search.maybe_refresh()
+        return _asset_search
+
+# Endpoint to search emojis and GIFs by name or tag (prefix autocomplete, fuzzy fallback)
+@app.route('/api/emojis/search', methods=['GET'])
+def search_emojis():
+    query = request.args.get('q', '').strip()[:100]
+    if not query:
+        return jsonify({'success': False, 'message': 'Missing search query'}), 400
+    try:
+        limit = int(request.args.get('limit', 20))
+        offset = int(request.args.get('offset', 0))
+    except ValueError:
+        return jsonify({'success': False, 'message': 'limit and offset must be numbers'}), 400
+    if not 1 <= limit <= SEARCH_MAX_LIMIT or not 0 <= offset <= SEARCH_MAX_OFFSET:
+        return jsonify({'success': False, 'message': f'limit must be 1-{SEARCH_MAX_LIMIT}, offset 0-{SEARCH_MAX_OFFSET}'}), 400
+    kind = request.args.get('kind')
+    if kind not in (None, 'emoji', 'gif'):
+        return jsonify({'success': False, 'message': 'kind must be emoji or gif'}), 400
+    started = time.perf_counter()
+    search = get_asset_search()
+    page = search.search(query, limit, offset, kind)
+    libraries = dict(search.libraries)
+    for item in page['results']:
+        item['id'] = f"{ASSET_FOLDERS[item['kind']]}/{item['name']}"
+        item['url'] = f"/api/download/{quote(item['id'])}"
+        info = libraries[item['kind']].entries.get(item['name'])
+        if info:
+            # Versioned URLs can be cached forever
+            item['url'] += f"?v={asset_version(info['mtime'], info['size'])}"
+    response = jsonify({
+        'success': True,
+        'query': query,
+        'results': page['results'],
+        'offset': offset,
+        'limit': limit,
+        'next_offset': offset + limit if page['has_more'] else None,
+        'took_ms': round((time.perf_counter() - started) * 1000, 3)
+    })
+    response.headers['Cache-Control'] = 'public, max-age=60'
+    return response
+
+GIF_PAGE_MAX = 200
+GIF_REINDEX_INTERVAL = 60
+_gif_index = None
+_gif_indexed = 0.0
+
+# Helper to get the GIF metadata index, re-indexing changed files in the background
+def get_gif_index():
+    global _gif_index, _gif_indexed
+    with _asset_search_lock:
+        if _gif_index is None:
+            from asset_library import AssetLibrary, GIF_EXTENSIONS
+            from gif_index import GifIndex
+            _gif_index = GifIndex(AssetLibrary(os.path.join(ASSETS_DIR, ASSET_FOLDERS['gif']), GIF_EXTENSIONS, decode=False))
+        if time.time() - _gif_indexed >= GIF_REINDEX_INTERVAL:
+            _gif_indexed = time.time()
+            _gif_index.start()
+        return _gif_index
+
+# Endpoint to list the GIF gallery (size, frames, duration, poster) from the GIF index
+@app.route('/api/gifs', methods=['GET'])
+def list_gifs():
+    try:
+        limit = int(request.args.get('limit', 50))
+        offset = int(request.args.get('offset', 0))
+    except ValueError:
+        return jsonify({'success': False, 'message': 'limit and offset must be numbers'}), 400
+    if not 1 <= limit <= GIF_PAGE_MAX or offset < 0:
+        return jsonify({'success': False, 'message': f'limit must be 1-{GIF_PAGE_MAX}, offset at least 0'}), 400
+    gif_index = get_gif_index()
+    listing = gif_index.listing()
+    gifs = []
+    for item in listing[offset:offset + limit]:
+        asset_id = f"{ASSET_FOLDERS['gif']}/{item['name']}"
+        gifs.append({
+            'id': asset_id,
+            'name': item['name'],
+            'width': item['width'],
+            'height': item['height'],
+            'frames': item['frames'],
+            'duration_ms': item['duration_ms'],
+            'loop': item['loop'],
+            'url': f"/api/download/{quote(asset_id)}?v={asset_version(item['mtime'], item['size'])}",
+            'poster': f"/api/gifs/posters/{item['sha256']}.png"
+        })
+    response = jsonify({
+        'success': True,
+        'gifs': gifs,
+        'total': len(listing),
+        'offset': offset,
+        'limit': limit,
+        'next_offset': offset + limit if offset + limit < len(listing) else None,
+        # Still reading new or changed files; the listing grows as they are indexed
+        'indexing': not gif_index.ready.is_set()
+    })
+    response.headers['Cache-Control'] = 'public, max-age=60'
+    return response
+
+# Endpoint to get a GIF's poster thumbnail; named by content hash, so it never changes
+@app.route('/api/gifs/posters/<sha256>.png', methods=['GET'])
+def gif_poster(sha256):
+    if not re.fullmatch(r'[0-9a-f]{64}', sha256):
+        return jsonify({'success': False, 'message': 'Poster not found'}), 404
+    gif_index = get_gif_index()
+    width, height = gif_index.poster_size
+    filename = f'{sha256}_{width}x{height}.png'
+    if not os.path.isfile(os.path.join(gif_index.library.thumb_dir, filename)):
+        return jsonify({'success': False, 'message': 'Poster not found'}), 404
+    response = send_from_directory(gif_index.library.thumb_dir, filename, mimetype='image/png')
+    response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    return response
+
+# Helper to get an asset's version token: also its ETag, in the same format nginx uses
+def asset_version(mtime_ns, size):
+    return f'{mtime_ns // 1000000000:x}-{size:x}'
+
+# Helper to decide whether a download response counts as one download
+def counts_as_download(response, version):
+    if request.method != 'GET' or response.status_code not in (200, 206):
+        return False
+    if request.if_none_match.contains(version):
+        return False  # nginx answers these with 304 after an X-Accel-Redirect
+    # Resumed or split downloads count once, for the part starting at byte 0
+    return request.range is None or request.range.ranges[0][0] == 0
+
+# Endpoint to download an emoji/GIF file, counting it for the logged-in user in the same request
+@app.route('/api/download/<path:asset_id>', methods=['GET', 'HEAD'])
+def download_asset(asset_id):
+    path = safe_join(ASSETS_DIR, asset_id)
+    if path is None or not os.path.isfile(path):
+        return jsonify({'success': False, 'message': 'Asset not found'}), 404
+    stat = os.stat(path)
+    version = asset_version(stat.st_mtime_ns, stat.st_size)
+    if ASSETS_ACCEL_REDIRECT:
+        # nginx serves the file with sendfile and handles Range and conditional requests
+        response = Response(mimetype=mimetypes.guess_type(path)[0] or 'application/octet-stream')
+        response.headers['X-Accel-Redirect'] = f"{ASSETS_ACCEL_REDIRECT.rstrip('/')}/{quote(asset_id)}"
+        response.headers['Content-Disposition'] = f"attachment; filename*=UTF-8''{quote(os.path.basename(path))}"
+    else:
+        # Range, If-None-Match and If-Modified-Since are answered here (206/304/416). Full
+        # responses go out through the server's wsgi.file_wrapper (sendfile under gunicorn)
+        response = send_file(path, as_attachment=True, conditional=True, etag=version,
+                             last_modified=stat.st_mtime)
+    if request.args.get('v') == version:
+        response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    else:
+        response.headers['Cache-Control'] = f'public, max-age={ASSET_CACHE_SECONDS}'
+    email = session.get('user_email')
+    if email and counts_as_download(response, version):
+        count = record_download(email)
+        if count is not None:
+            response.headers['X-Download-Count'] = str(count)
+    return response
+
+# Helper to send a built file, preferring its precompressed .gz sibling
+def send_built_file(directory, filename, cache_control):
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    use_gzip = (accepts_gzip(request.headers.get('Accept-Encoding'))
+                and os.path.isfile(os.path.join(directory, filename + '.gz')))
+    response = send_from_directory(directory, filename + '.gz' if use_gzip else filename, mimetype=mimetype)
+    if use_gzip:
+        response.headers['Content-Encoding'] = 'gzip'
+    response.headers['Cache-Control'] = cache_control
+    response.vary.add('Accept-Encoding')
+    return response
+
+# Fingerprinted CSS/JS/atlas pages produced by build_assets.py; files without a
+# content hash in their name (atlas.json) are revalidated instead
+@app.route('/static/<path:filename>')
+def fingerprinted_asset(filename):
+    cache_control = IMMUTABLE_CACHE_CONTROL if FINGERPRINTED_NAME.search(filename) else 'no-cache'
+    return send_built_file(os.path.join(DIST_DIR, 'static'), filename, cache_control)
+
+# Built HTML pages; revalidated every time so they pick up new asset hashes
+@app.route('/')
+@app.route('/<page_name>.html')
+def built_page(page_name='index'):
+    if not os.path.isfile(os.path.join(DIST_DIR, page_name + '.html')):
+        abort(404)
+    return send_built_file(DIST_DIR, page_name + '.html', 'no-cache')
+
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,124 @@
+"""Measure backend cold-start cost.
+
+Runs fresh interpreters and reports:
+  * `python -X importtime` totals for importing app.py, plus the slowest imports
+  * time-to-first-request: interpreter start -> import app -> first response
+
+Usage:
+    python bench_startup.py
+    python bench_startup.py --runs 10 --top 15 --path /api/test --json startup.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Executed in a fresh interpreter; prints a JSON line with the timings
+FIRST_REQUEST_SNIPPET = """
+import time, json
+t0 = time.perf_counter()
+import app
+t1 = time.perf_counter()
+client = app.app.test_client()
+resp = client.get(%r)
+t2 = time.perf_counter()
+print(json.dumps({'import_s': t1 - t0, 'first_request_s': t2 - t1,
+                  'total_s': t2 - t0, 'status': resp.status_code}))
+"""
+
+
+def parse_importtime(stderr):
+    """Return (top-level total in us, list of (cumulative_us, self_us, module))"""
+    rows = []
+    total = 0
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        try:
+            self_us, cumulative_us, name = line[len('import time:'):].split('|', 2)
+            self_us = int(self_us)
+            cumulative_us = int(cumulative_us)
+        except ValueError:
+            continue
+        # Top-level imports are not indented; their cumulative times add up to the total
+        if not name.startswith('  '):
+            total += cumulative_us
+        rows.append((cumulative_us, self_us, name.strip()))
+    return total, rows
+
+
+def measure_importtime(python):
+    proc = subprocess.run(
+        [python, '-X', 'importtime', '-c', 'import app'],
+        cwd=BACKEND_DIR, capture_output=True, text=True
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1])
+    return parse_importtime(proc.stderr)
+
+
+def measure_first_request(python, path):
+    proc = subprocess.run(
+        [python, '-c', FIRST_REQUEST_SNIPPET % path],
+        cwd=BACKEND_DIR, capture_output=True, text=True
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1])
+    # app.py prints debug lines; the timings are on the last line
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def run(runs=5, top=10, path='/api/test', python=sys.executable):
+    import_totals = []
+    slowest = {}
+    first_requests = []
+    for _ in range(runs):
+        total, rows = measure_importtime(python)
+        import_totals.append(total)
+        for cumulative_us, _, name in rows:
+            slowest.setdefault(name, []).append(cumulative_us)
+        first_requests.append(measure_first_request(python, path))
+
+    top_imports = sorted(
+        ((statistics.median(times), name) for name, times in slowest.items()),
+        reverse=True
+    )[:top]
+    return {
+        'runs': runs,
+        'path': path,
+        'importtime_total_ms': statistics.median(import_totals) / 1000,
+        'import_app_ms': statistics.median(r['import_s'] for r in first_requests) * 1000,
+        'first_request_ms': statistics.median(r['first_request_s'] for r in first_requests) * 1000,
+        'time_to_first_request_ms': statistics.median(r['total_s'] for r in first_requests) * 1000,
+        'status': first_requests[-1]['status'],
+        'slowest_imports': [{'module': name, 'cumulative_ms': us / 1000} for us, name in top_imports]
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark backend import time and time-to-first-request')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=10, help='How many of the slowest imports to list')
+    parser.add_argument('--path', default='/api/test', help='Route used for the first request')
+    parser.add_argument('--json', dest='json_path', help='Also write the report to this file')
+    args = parser.parse_args(argv)
+
+    report = run(args.runs, args.top, args.path)
+    print(f"importtime total:        {report['importtime_total_ms']:.1f} ms (median of {args.runs})")
+    print(f"import app:              {report['import_app_ms']:.1f} ms")
+    print(f"first request ({args.path}): {report['first_request_ms']:.1f} ms")
+    print(f"time to first request:   {report['time_to_first_request_ms']:.1f} ms")
+    print('slowest imports (cumulative):')
+    for entry in report['slowest_imports']:
+        print(f"  {entry['cumulative_ms']:8.1f} ms  {entry['module']}")
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+
+COMPRESSIBLE_TYPES = (
+    'text/',
+    'application/json',
+    'application/javascript',
+    'application/xml',
+    'image/svg+xml',
+)
+
+
+def accepts_gzip(accept_encoding):
+    """True if an Accept-Encoding header allows gzip (honours q=0)"""
+    gzip_q = None
+    star_q = None
+    for part in (accept_encoding or '').split(','):
+        pieces = part.strip().split(';')
+        coding = pieces[0].strip().lower()
+        q = 1.0
+        for param in pieces[1:]:
+            name, _, value = param.strip().partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if coding in ('gzip', 'x-gzip'):
+            gzip_q = q
+        elif coding == '*':
+            star_q = q
+    if gzip_q is not None:
+        return gzip_q > 0
+    return bool(star_q)
+
+
+class CompressedBodyCache:
+    """Byte-bounded LRU of gzip bodies keyed by a digest of the raw body.
+
+    The digest acts as the data version: while a payload is unchanged every
+    request reuses the same compressed bytes; once the data changes the body
+    hashes differently and is compressed once more.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            body = self.entries.get(key)
+            if body is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return body
+
+    def put(self, key, body):
+        if len(body) > self.max_bytes:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self.entries[key] = body
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+
+class Compress:
+    """gzip response compression for a Flask app.
+
+    Configured through app.config:
+      COMPRESS_MIN_SIZE    smallest body (bytes) worth compressing, default 500
+      COMPRESS_LEVEL       gzip level 1-9, default 6
+      COMPRESS_CACHE_BYTES size of the precompressed body cache, 0 disables it
+    """
+
+    def __init__(self, app=None):
+        self.cache = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('COMPRESS_MIN_SIZE', 500)
+        app.config.setdefault('COMPRESS_LEVEL', 6)
+        app.config.setdefault('COMPRESS_CACHE_BYTES', 8 * 1024 * 1024)
+        self.min_size = app.config['COMPRESS_MIN_SIZE']
+        self.level = app.config['COMPRESS_LEVEL']
+        if app.config['COMPRESS_CACHE_BYTES']:
+            self.cache = CompressedBodyCache(app.config['COMPRESS_CACHE_BYTES'])
+        app.extensions['compress'] = self
+        app.after_request(self.after_request)
+
+    def _compress(self, body):
+        return gzip.compress(body, compresslevel=self.level, mtime=0)
+
+    def compress_body(self, body, cacheable):
+        if not cacheable or self.cache is None:
+            return self._compress(body)
+        key = (self.level, hashlib.blake2b(body, digest_size=16).digest())
+        compressed = self.cache.get(key)
+        if compressed is None:
+            compressed = self._compress(body)
+            self.cache.put(key, compressed)
+        return compressed
+
+    def after_request(self, response):
+        from flask import request
+        response.vary.add('Accept-Encoding')
+        if (response.direct_passthrough
+                or response.is_streamed
+                or response.status_code < 200
+                or response.status_code in (204, 206, 304)
+                or 'Content-Encoding' in response.headers
+                or not (response.mimetype or '').startswith(COMPRESSIBLE_TYPES)
+                or not accepts_gzip(request.headers.get('Accept-Encoding'))):
+            return response
+        body = response.get_data()
+        if len(body) < self.min_size:
+            return response
+        # Only successful GET payloads are worth keeping around
+        cacheable = request.method in ('GET', 'HEAD') and response.status_code == 200
+        compressed = self.compress_body(body, cacheable)
+        if len(compressed) >= len(body):
+            return response
+        response.set_data(compressed)
+        response.headers['Content-Encoding'] = 'gzip'
+        response.headers['Content-Length'] = str(len(compressed))
+        if response.headers.get('ETag'):
+            # A strong ETag describes the identity body, not the gzip one
+            etag, weak = response.get_etag()
+            if not weak:
+                response.set_etag(etag + '-gzip')
+        return response
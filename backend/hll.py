@@ -0,0 +1,81 @@
+import base64
+import hashlib
+import math
+
+# Number of index bits. 2**12 registers gives ~1.6% standard error
+# in 4 KB per sketch, no matter how many items are added.
+DEFAULT_PRECISION = 12
+
+
+def _hash64(value):
+    digest = hashlib.blake2b(str(value).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big')
+
+
+def _alpha(m):
+    if m == 16:
+        return 0.673
+    if m == 32:
+        return 0.697
+    if m == 64:
+        return 0.709
+    return 0.7213 / (1 + 1.079 / m)
+
+
+class HyperLogLog:
+    """Mergeable distinct-count sketch with a fixed number of registers"""
+
+    def __init__(self, precision=DEFAULT_PRECISION, registers=None):
+        if not 4 <= precision <= 16:
+            raise ValueError('precision must be between 4 and 16')
+        self.precision = precision
+        self.m = 1 << precision
+        if registers is None:
+            self.registers = bytearray(self.m)
+        else:
+            if len(registers) != self.m:
+                raise ValueError('register count does not match precision')
+            self.registers = bytearray(registers)
+
+    def add(self, value):
+        """Add a value; None and empty strings are ignored"""
+        if value is None or value == '':
+            return
+        x = _hash64(value)
+        index = x >> (64 - self.precision)
+        rest = x & ((1 << (64 - self.precision)) - 1)
+        # Position of the leftmost 1-bit in the remaining bits
+        rank = (64 - self.precision) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        """Fold another sketch into this one (register-wise max)"""
+        if other.precision != self.precision:
+            raise ValueError('cannot merge sketches with different precision')
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def count(self):
+        """Estimated number of distinct values added"""
+        m = self.m
+        estimate = _alpha(m) * m * m / sum(2.0 ** -r for r in self.registers)
+        if estimate <= 2.5 * m:
+            zeros = self.registers.count(0)
+            if zeros:
+                # Linear counting is more accurate for small cardinalities
+                estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def copy(self):
+        return HyperLogLog(self.precision, self.registers)
+
+    def to_dict(self):
+        return {
+            'p': self.precision,
+            'registers': base64.b64encode(bytes(self.registers)).decode('ascii')
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['p'], base64.b64decode(data['registers']))
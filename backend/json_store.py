@@ -0,0 +1,148 @@
+"""JSON data files cached in memory, kept coherent across worker processes.
+
+Every backend worker process holds its own parsed copy of users.json,
+channels.json, etc. Writes replace the file atomically (temp file + rename),
+so each committed write gives the file a new inode and a strictly newer
+mtime_ns. The file's (inode, mtime_ns, size) triple is therefore a
+generation counter that every worker can read with one stat() call. A
+worker reloads its copy only when the generation on disk differs from the
+one it parsed.
+
+Staleness is bounded by `max_stale` seconds: a read may serve the cached
+copy without a stat() for that long after the last check. With the default
+of 0, every read checks, so a write by any worker is visible to the next
+request in every other worker.
+
+read() returns the shared cached object, which callers must not modify.
+load() returns a private copy for read-modify-write. It always checks the
+generation, so writers never start from stale data. Hold locked() around
+load() ... save(), so that concurrent writers in other processes (flock on
+<path>.lock) and other threads do not overwrite each other's changes.
+
+    users_file = JsonFile('users.json')
+    with locked(users_file):
+        users = users_file.load()
+        users[email]['download_count'] += 1
+        users_file.save(users)
+"""
+import json
+import os
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: writers are only serialized within a process
+    fcntl = None
+
+DEFAULT_MAX_STALE = 0.0
+
+
+def _generation(stat):
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+class JsonFile:
+    def __init__(self, path, indent=None, max_stale=DEFAULT_MAX_STALE):
+        self.path = path
+        self.indent = indent
+        self.max_stale = max_stale
+        self.stats = {'hits': 0, 'reloads': 0, 'writes': 0}
+        self._text = None  # JSON text of the cached generation
+        self._data = None  # parsed lazily from _text
+        self._generation = None
+        self._checked = 0.0
+        self._lock = threading.Lock()  # guards the cache
+        self._write_lock = threading.Lock()  # serializes writers in this process
+
+    def generation(self):
+        """The file's current generation on disk (None if it doesn't exist)"""
+        try:
+            return _generation(os.stat(self.path))
+        except FileNotFoundError:
+            return None
+
+    def _current_text(self, check):
+        """JSON text of the file, reloaded if another process changed it"""
+        now = time.monotonic()
+        if not check:
+            with self._lock:
+                if self._text is not None and now - self._checked < self.max_stale:
+                    self.stats['hits'] += 1
+                    return self._text
+        generation = self.generation()
+        with self._lock:
+            if self._text is not None and generation == self._generation:
+                self._checked = now
+                self.stats['hits'] += 1
+                return self._text
+        try:
+            with open(self.path, 'r') as f:
+                # fstat names the generation actually read, even if it was replaced since
+                generation = _generation(os.fstat(f.fileno()))
+                text = f.read()
+        except FileNotFoundError:
+            generation, text = None, '{}'
+        with self._lock:
+            self.stats['reloads'] += 1
+            self._text, self._data, self._generation, self._checked = text, None, generation, now
+        return text
+
+    def read(self):
+        """The shared cached data; callers must not modify it"""
+        text = self._current_text(check=False)
+        with self._lock:
+            if self._text is text and self._data is not None:
+                return self._data
+        data = json.loads(text)
+        with self._lock:
+            if self._text is text:
+                self._data = data
+        return data
+
+    def load(self):
+        """A fresh private copy of the data, safe to modify and save()"""
+        return json.loads(self._current_text(check=True))
+
+    def save(self, data):
+        """Atomically replace the file with `data` and cache it as the new generation"""
+        text = json.dumps(data, indent=self.indent)
+        directory = os.path.dirname(os.path.abspath(self.path))
+        tmp_path = os.path.join(directory, f'.{os.path.basename(self.path)}.{os.getpid()}.{threading.get_ident()}.tmp')
+        with open(tmp_path, 'w') as f:
+            f.write(text)
+        # A freed inode can be reused within one coarse timestamp tick, so make
+        # mtime_ns strictly increase from the generation being replaced
+        previous = self.generation()
+        mtime_ns = max(time.time_ns(), previous[1] + 1 if previous else 0)
+        os.utime(tmp_path, ns=(mtime_ns, mtime_ns))
+        # rename keeps the inode and mtime, so this is the generation other workers will see
+        generation = _generation(os.stat(tmp_path))
+        os.replace(tmp_path, self.path)
+        with self._lock:
+            self.stats['writes'] += 1
+            self._text, self._data, self._generation, self._checked = text, None, generation, time.monotonic()
+
+    @contextmanager
+    def locked(self):
+        """Hold the write lock for this file, across processes where flock exists"""
+        with self._write_lock:
+            if fcntl is None:
+                yield
+                return
+            with open(self.path + '.lock', 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+@contextmanager
+def locked(*files):
+    """Hold the write locks of several files, taken in path order to avoid deadlocks"""
+    with ExitStack() as stack:
+        for json_file in sorted(set(files), key=lambda f: os.path.abspath(f.path)):
+            stack.enter_context(json_file.locked())
+        yield
@@ -0,0 +1,502 @@
+"""Replay a realistic traffic mix against the backend and check the data afterwards.
+
+The flows are the ones the site's pages make: signup and login (auth.js),
+/api/user, track-event (script.js), join-channel and channel-stats
+(join-channels.html). Requests are sent open-loop at a target rate. Each
+latency is measured from the time the request was scheduled, so a slow
+server shows up as latency rather than as a lower send rate.
+
+By default the tool starts its own servers (`--servers` processes sharing
+one temporary data directory, each request sent to one of them at random)
+and stops them afterwards. `--url` points it at a running server instead.
+
+The HTTP client is a small asyncio HTTP/1.1 client with a keep-alive
+connection pool per server (standard library only). Each virtual user
+keeps its own session cookie. Werkzeug's development server closes every
+connection after one response, so against it each request opens a new one
+(see connections_opened in the report).
+
+After the run it checks that:
+  * channel-stats' totalJoins grew by exactly the number of successful joins
+  * every virtual user's /api/user-channels lists exactly the channels it joined
+  * the analytics sketches counted every tracked event (needs the
+    admin@example.com account, so only on a fresh data directory)
+During the run, channel-stats must never report fewer joins than had
+already succeeded when it was requested. /api/user must return the
+logged-in user.
+
+Usage:
+    python loadtest.py
+    python loadtest.py --rate 200 --duration 30 --servers 4 --json load.json
+    python loadtest.py --url http://127.0.0.1:5000 --mix user=50,channel-stats=50
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import secrets
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from collections import namedtuple
+from urllib.parse import urlsplit
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+HOST = '127.0.0.1'
+ADMIN_EMAIL = 'admin@example.com'
+
+# Relative weights of each flow in the traffic mix
+DEFAULT_MIX = {
+    'user': 30,
+    'channel-stats': 25,
+    'track-event': 20,
+    'join-channel': 15,
+    'login': 7,
+    'signup': 3,
+}
+PLATFORMS = ['discord', 'telegram', 'whatsapp']
+
+# Run in a fresh interpreter inside the data directory (the JSON files are relative paths)
+SERVER_SNIPPET = 'import app; app.app.run(host=%r, port=%d, threaded=True, debug=False)'
+
+Response = namedtuple('Response', ['status', 'headers', 'cookies', 'body'])
+
+
+class ConnectionPool:
+    """Keep-alive HTTP/1.1 connections to one server, at most `size` open at once"""
+
+    def __init__(self, host, port, size):
+        self.host = host
+        self.port = port
+        self.opened = 0
+        self._idle = []
+        self._slots = asyncio.Semaphore(size)
+
+    async def request(self, method, path, body=b'', headers=None):
+        async with self._slots:
+            while True:
+                reused = bool(self._idle)
+                if reused:
+                    reader, writer = self._idle.pop()
+                else:
+                    reader, writer = await asyncio.open_connection(self.host, self.port)
+                    self.opened += 1
+                try:
+                    response, keep_alive = await self._exchange(reader, writer, method, path, body, headers or {})
+                except (ConnectionError, asyncio.IncompleteReadError) as e:
+                    writer.close()
+                    # An idle connection the server already closed fails before any
+                    # response byte arrives; retry that once on a new connection
+                    if reused and getattr(e, 'partial', b'') == b'':
+                        continue
+                    raise
+                if keep_alive:
+                    self._idle.append((reader, writer))
+                else:
+                    writer.close()
+                return response
+
+    async def _exchange(self, reader, writer, method, path, body, headers):
+        lines = [f'{method} {path} HTTP/1.1', f'Host: {self.host}:{self.port}', f'Content-Length: {len(body)}']
+        lines += [f'{name}: {value}' for name, value in headers.items()]
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body)
+        await writer.drain()
+
+        status_line = await reader.readuntil(b'\r\n')
+        version, status = status_line.split()[:2]
+        status = int(status)
+        response_headers = {}
+        cookies = []
+        while True:
+            line = await reader.readuntil(b'\r\n')
+            if line == b'\r\n':
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            name = name.strip().lower()
+            if name == 'set-cookie':
+                cookies.append(value.strip())
+            else:
+                response_headers[name] = value.strip()
+
+        connection = response_headers.get('connection', '').lower()
+        keep_alive = connection == 'keep-alive' if version == b'HTTP/1.0' else connection != 'close'
+        if method == 'HEAD' or status in (204, 304) or status < 200:
+            data = b''
+        elif 'content-length' in response_headers:
+            data = await reader.readexactly(int(response_headers['content-length']))
+        elif response_headers.get('transfer-encoding', '').lower() == 'chunked':
+            data = await self._read_chunked(reader)
+        else:
+            data = await reader.read()
+            keep_alive = False
+        return Response(status, response_headers, cookies, data), keep_alive
+
+    async def _read_chunked(self, reader):
+        chunks = []
+        while True:
+            size = int((await reader.readuntil(b'\r\n')).split(b';')[0], 16)
+            if size == 0:
+                while await reader.readuntil(b'\r\n') != b'\r\n':
+                    pass  # trailers
+                return b''.join(chunks)
+            chunks.append(await reader.readexactly(size))
+            await reader.readexactly(2)
+
+    def close(self):
+        for _, writer in self._idle:
+            writer.close()
+        self._idle.clear()
+
+
+class VirtualUser:
+    """One simulated visitor: an account and its session cookie"""
+
+    def __init__(self, email, password, username):
+        self.email = email
+        self.password = password
+        self.username = username
+        self.cookies = {}
+        self.logged_in = False
+        self.joined = set()     # channels whose join succeeded
+        self.pending = set()    # joins sent but not yet answered
+        self.uncertain = set()  # joins whose outcome is unknown (connection failed)
+
+    async def call(self, pools, method, path, payload=None):
+        """Send a request with this user's cookies; returns (status, parsed JSON or None)"""
+        headers = {}
+        body = b''
+        if payload is not None:
+            body = json.dumps(payload).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f'{name}={value}' for name, value in self.cookies.items())
+        pool = pools[random.randrange(len(pools))]
+        response = await pool.request(method, path, body, headers)
+        for cookie in response.cookies:
+            name, _, value = cookie.split(';', 1)[0].partition('=')
+            self.cookies[name.strip()] = value.strip()
+        try:
+            return response.status, json.loads(response.body)
+        except ValueError:
+            return response.status, None
+
+
+class CheckFailed(Exception):
+    pass
+
+
+def expect(condition, message):
+    if not condition:
+        raise CheckFailed(message)
+
+
+class LoadRun:
+    def __init__(self, pools, users=50, channels=20, seed=None):
+        self.pools = pools
+        self.run_id = secrets.token_hex(4)
+        self.event_name = f'loadtest_{self.run_id}'
+        self.channel_ids = [f'loadtest-{self.run_id}-{i}' for i in range(channels)]
+        self.random = random.Random(seed)
+        self.users = [self._new_user() for _ in range(users)]
+        self.results = []   # (flow, latency seconds, error or None)
+        self.joins = 0
+        self.uncertain_joins = 0
+        self.events = 0
+        self.base_joins = 0
+
+    def _new_user(self):
+        name = f'load-{self.run_id}-{secrets.token_hex(4)}'
+        return VirtualUser(f'{name}@example.com', secrets.token_hex(8), name)
+
+    def _logged_in_user(self):
+        users = [user for user in self.users if user.logged_in]
+        return self.random.choice(users) if users else None
+
+    # --- flows -------------------------------------------------------------
+
+    async def flow_signup(self, user=None):
+        user = user or self._new_user()
+        status, data = await user.call(self.pools, 'POST', '/api/signup',
+                                       {'email': user.email, 'password': user.password, 'username': user.username})
+        expect(status == 200 and data and data.get('success'), f'signup: HTTP {status}')
+        if user not in self.users:
+            self.users.append(user)
+
+    async def flow_login(self, user=None):
+        user = user or self.random.choice(self.users)
+        status, data = await user.call(self.pools, 'POST', '/api/login',
+                                       {'email': user.email, 'password': user.password})
+        expect(status == 200 and data and data.get('username') == user.username, f'login: HTTP {status}')
+        user.logged_in = True
+
+    async def flow_user(self):
+        user = self._logged_in_user()
+        status, data = await user.call(self.pools, 'GET', '/api/user')
+        expect(status == 200, f'user: HTTP {status}')
+        expect(data.get('logged_in') and data['user']['email'] == user.email, 'user: wrong or missing session user')
+
+    async def flow_track_event(self):
+        user = self.random.choice(self.users)
+        status, data = await user.call(self.pools, 'POST', '/api/track-event',
+                                       {'event': self.event_name, 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S')})
+        expect(status == 200 and data and data.get('success'), f'track-event: HTTP {status}')
+        self.events += 1
+
+    async def flow_join_channel(self):
+        user = self._logged_in_user()
+        choices = [c for c in self.channel_ids if c not in user.joined | user.pending | user.uncertain]
+        if not choices:
+            return await self.flow_channel_stats()
+        channel_id = self.random.choice(choices)
+        user.pending.add(channel_id)
+        try:
+            status, data = await user.call(self.pools, 'POST', '/api/join-channel', {
+                'channelId': channel_id,
+                'link': f'https://example.com/{channel_id}',
+                'platform': PLATFORMS[self.channel_ids.index(channel_id) % len(PLATFORMS)],
+                'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            })
+        except (OSError, asyncio.IncompleteReadError):
+            user.uncertain.add(channel_id)
+            self.uncertain_joins += 1
+            raise
+        finally:
+            user.pending.discard(channel_id)
+        expect(status == 200 and data and data.get('success'), f'join-channel: HTTP {status}')
+        user.joined.add(channel_id)
+        self.joins += 1
+
+    async def flow_channel_stats(self):
+        confirmed = self.joins
+        status, data = await self.users[0].call(self.pools, 'GET', '/api/channel-stats')
+        expect(status == 200 and data and data.get('success'), f'channel-stats: HTTP {status}')
+        expect(data['stats']['totalJoins'] >= self.base_joins + confirmed,
+               'channel-stats: stale (fewer joins than already confirmed)')
+
+    FLOWS = {
+        'signup': flow_signup,
+        'login': flow_login,
+        'user': flow_user,
+        'track-event': flow_track_event,
+        'join-channel': flow_join_channel,
+        'channel-stats': flow_channel_stats,
+    }
+
+    # --- driving -------------------------------------------------------------
+
+    async def setup(self):
+        """Create and log in the virtual users (not timed)"""
+        for user in self.users:
+            await self.flow_signup(user)
+            await self.flow_login(user)
+        status, data = await self.users[0].call(self.pools, 'GET', '/api/channel-stats')
+        self.base_joins = data['stats']['totalJoins']
+
+    async def _one(self, flow, scheduled):
+        error = None
+        try:
+            await self.FLOWS[flow](self)
+        except CheckFailed as e:
+            error = str(e)
+        except (OSError, asyncio.IncompleteReadError, ValueError, KeyError, TypeError, AttributeError) as e:
+            error = f'{flow}: {type(e).__name__}: {e}'
+        self.results.append((flow, time.perf_counter() - scheduled, error))
+
+    async def drive(self, mix, rate, duration):
+        """Start requests at `rate` per second for `duration` seconds, then wait for them"""
+        flows = list(mix)
+        weights = [mix[flow] for flow in flows]
+        tasks = []
+        start = time.perf_counter()
+        for i in range(int(rate * duration)):
+            scheduled = start + i / rate
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            flow = self.random.choices(flows, weights)[0]
+            tasks.append(asyncio.create_task(self._one(flow, scheduled)))
+        await asyncio.gather(*tasks)
+        return time.perf_counter() - start
+
+    async def verify(self):
+        """Compare the server's data with what the run did; returns {check: (ok, detail)}"""
+        checks = {}
+        status, data = await self.users[0].call(self.pools, 'GET', '/api/channel-stats')
+        total = data['stats']['totalJoins'] - self.base_joins
+        low, high = self.joins, self.joins + self.uncertain_joins
+        checks['join_count'] = (low <= total <= high, f'{total} joins recorded, {self.joins} succeeded')
+
+        mismatched = 0
+        for user in self.users:
+            if not user.logged_in:
+                await self.flow_login(user)
+            status, data = await user.call(self.pools, 'GET', '/api/user-channels')
+            listed = {join['channelId'] for join in data.get('joinedChannels', [])}
+            if not user.joined <= listed <= user.joined | user.uncertain:
+                mismatched += 1
+        checks['user_channels'] = (mismatched == 0, f'{mismatched} of {len(self.users)} users differ')
+
+        admin = VirtualUser(ADMIN_EMAIL, secrets.token_hex(8), 'admin')
+        status, _ = await admin.call(self.pools, 'POST', '/api/signup',
+                                     {'email': admin.email, 'password': admin.password, 'username': admin.username})
+        if status == 200:
+            await admin.call(self.pools, 'POST', '/api/login', {'email': admin.email, 'password': admin.password})
+            status, data = await admin.call(self.pools, 'GET', f'/api/analytics/uniques?event={self.event_name}')
+            counted = data.get('events') if data else None
+            checks['tracked_events'] = (counted == self.events, f'{counted} counted, {self.events} tracked')
+        return checks
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def summarize(results, elapsed, rate):
+    flows = {}
+    for flow, latency, error in results:
+        flows.setdefault(flow, []).append((latency, error))
+    report = {}
+    for flow, entries in sorted(flows.items()):
+        latencies = sorted(latency for latency, _ in entries)
+        errors = [error for _, error in entries if error]
+        report[flow] = {
+            'requests': len(entries),
+            'errors': len(errors),
+            'error_rate': len(errors) / len(entries),
+            'p50_ms': percentile(latencies, 0.5) * 1000,
+            'p99_ms': percentile(latencies, 0.99) * 1000,
+            'max_ms': latencies[-1] * 1000,
+            'sample_errors': sorted(set(errors))[:3],
+        }
+    latencies = sorted(latency for _, latency, _ in results)
+    errors = sum(1 for _, _, error in results if error)
+    return {
+        'target_rate': rate,
+        'elapsed_s': elapsed,
+        'requests': len(results),
+        'throughput_rps': len(results) / elapsed if elapsed else 0,
+        'errors': errors,
+        'error_rate': errors / len(results) if results else 0,
+        'p50_ms': percentile(latencies, 0.5) * 1000 if latencies else None,
+        'p99_ms': percentile(latencies, 0.99) * 1000 if latencies else None,
+        'flows': report,
+    }
+
+
+def start_servers(count, port, data_dir):
+    env = dict(os.environ, FLASK_SECRET_KEY=secrets.token_hex(24),
+               PYTHONPATH=os.pathsep.join(filter(None, [BACKEND_DIR, os.environ.get('PYTHONPATH')])))
+    processes = [
+        subprocess.Popen([sys.executable, '-c', SERVER_SNIPPET % (HOST, port + i)], cwd=data_dir, env=env,
+                         stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        for i in range(count)
+    ]
+    deadline = time.time() + 30
+    for i, process in enumerate(processes):
+        while True:
+            try:
+                urllib.request.urlopen(f'http://{HOST}:{port + i}/api/test', timeout=1).close()
+                break
+            except OSError:
+                if process.poll() is not None or time.time() > deadline:
+                    stop_servers(processes)
+                    raise RuntimeError(f'server on port {port + i} did not start')
+                time.sleep(0.1)
+    return processes
+
+
+def stop_servers(processes):
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        flow, _, weight = part.partition('=')
+        flow = flow.strip()
+        if flow not in LoadRun.FLOWS:
+            raise argparse.ArgumentTypeError(f'unknown flow {flow!r} (choose from {", ".join(LoadRun.FLOWS)})')
+        mix[flow] = float(weight or 1)
+    return mix
+
+
+async def run_load(addresses, mix=DEFAULT_MIX, rate=50, duration=10, users=50, channels=20, concurrency=32, seed=None):
+    pools = [ConnectionPool(host, port, concurrency) for host, port in addresses]
+    load = LoadRun(pools, users, channels, seed)
+    try:
+        await load.setup()
+        elapsed = await load.drive(mix, rate, duration)
+        report = summarize(load.results, elapsed, rate)
+        report['checks'] = {name: {'ok': ok, 'detail': detail} for name, (ok, detail) in (await load.verify()).items()}
+        report['connections_opened'] = sum(pool.opened for pool in pools)
+        return report
+    finally:
+        for pool in pools:
+            pool.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Replay a realistic traffic mix against the backend')
+    parser.add_argument('--url', help='Target a running server instead of starting one')
+    parser.add_argument('--servers', type=int, default=1, help='Server processes to start (sharing one data directory)')
+    parser.add_argument('--port', type=int, default=5100, help='First port for started servers')
+    parser.add_argument('--rate', type=float, default=50, help='Requests per second')
+    parser.add_argument('--duration', type=float, default=10, help='Seconds of load')
+    parser.add_argument('--users', type=int, default=50, help='Virtual users created before the run')
+    parser.add_argument('--channels', type=int, default=20)
+    parser.add_argument('--concurrency', type=int, default=32, help='Connections per server')
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX,
+                        help='Flow weights, e.g. user=30,channel-stats=25,join-channel=15')
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--json', dest='json_path', help='Also write the report to this file')
+    args = parser.parse_args(argv)
+
+    processes = []
+    data_dir = None
+    if args.url:
+        target = urlsplit(args.url)
+        addresses = [(target.hostname, target.port or 80)]
+    else:
+        data_dir = tempfile.mkdtemp(prefix='emojie-load-')
+        processes = start_servers(args.servers, args.port, data_dir)
+        addresses = [(HOST, args.port + i) for i in range(args.servers)]
+    try:
+        report = asyncio.run(run_load(addresses, args.mix, args.rate, args.duration,
+                                      args.users, args.channels, args.concurrency, args.seed))
+    finally:
+        stop_servers(processes)
+        if data_dir:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    print(f"{report['requests']} requests in {report['elapsed_s']:.1f} s: {report['throughput_rps']:.1f} req/s "
+          f"(target {report['target_rate']:g}), p50 {report['p50_ms']:.1f} ms, p99 {report['p99_ms']:.1f} ms, "
+          f"errors {report['error_rate']:.2%}, {report['connections_opened']} connections")
+    for flow, numbers in report['flows'].items():
+        print(f"  {flow:14} {numbers['requests']:6d} req  p50 {numbers['p50_ms']:8.1f} ms  "
+              f"p99 {numbers['p99_ms']:8.1f} ms  max {numbers['max_ms']:8.1f} ms  errors {numbers['errors']}")
+        for error in numbers['sample_errors']:
+            print(f'      {error}')
+    failed = False
+    for name, check in report['checks'].items():
+        print(f"check {name}: {'ok' if check['ok'] else 'FAILED'} ({check['detail']})")
+        failed = failed or not check['ok']
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
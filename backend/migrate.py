@@ -0,0 +1,474 @@
+"""Stream users.json, channels.json and analytics.json into a SQLite database.
+
+The JSON files are parsed incrementally (one record at a time) so memory use
+is bounded by the chunk size plus the largest single record, not the file
+size. Records are written in batched transactions; each batch commits its
+checkpoint (byte offset into the source file) in the same transaction, so an
+interrupted run resumes exactly where the last commit left off.
+
+Usage:
+    python migrate.py --db emojie.db
+    python migrate.py --db emojie.db --verify
+    python migrate.py --db emojie.db --restart --batch-size 5000
+"""
+import argparse
+import codecs
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import time
+
+USERS_FILE = 'users.json'
+CHANNELS_FILE = 'channels.json'
+ANALYTICS_FILE = 'analytics.json'
+
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    email TEXT PRIMARY KEY,
+    username TEXT,
+    download_count INTEGER NOT NULL DEFAULT 0,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS channels (
+    id TEXT PRIMARY KEY,
+    platform TEXT,
+    join_count INTEGER NOT NULL DEFAULT 0,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS channel_members (
+    channel_id TEXT NOT NULL,
+    email TEXT NOT NULL,
+    PRIMARY KEY (channel_id, email)
+);
+CREATE TABLE IF NOT EXISTS analytics_events (
+    id INTEGER PRIMARY KEY,
+    event_type TEXT NOT NULL,
+    timestamp TEXT,
+    user_email TEXT,
+    user_agent TEXT,
+    ip TEXT
+);
+CREATE INDEX IF NOT EXISTS analytics_events_type_ts ON analytics_events (event_type, timestamp);
+CREATE TABLE IF NOT EXISTS migration_state (
+    source TEXT PRIMARY KEY,
+    offset INTEGER NOT NULL,
+    current_key TEXT,
+    records INTEGER NOT NULL,
+    checksum TEXT NOT NULL,
+    done INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+_WHITESPACE = ' \t\n\r'
+
+
+class JsonStreamReader:
+    """Incremental reader over a JSON file with byte-offset checkpoints"""
+
+    def __init__(self, path, offset=0, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.file = open(path, 'rb')
+        self.file.seek(offset)
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.json_decoder = json.JSONDecoder()
+        self.chunk_size = chunk_size
+        self.buf = ''
+        self.pos = 0
+        self.counted_pos = 0
+        self.base_offset = offset
+        self.eof = False
+
+    def close(self):
+        self.file.close()
+
+    def _fill(self):
+        if self.eof:
+            return False
+        data = self.file.read(self.chunk_size)
+        if not data:
+            self.eof = True
+            self.buf += self.decoder.decode(b'', final=True)
+            return False
+        # Drop what has already been consumed so the buffer stays bounded
+        if self.pos:
+            self.base_offset = self.offset()
+            self.buf = self.buf[self.pos:]
+            self.pos = 0
+            self.counted_pos = 0
+        self.buf += self.decoder.decode(data)
+        return True
+
+    def offset(self):
+        """Byte offset of the next unread character"""
+        # Only encode the characters consumed since the last call
+        if self.pos != self.counted_pos:
+            self.base_offset += len(self.buf[self.counted_pos:self.pos].encode('utf-8'))
+            self.counted_pos = self.pos
+        return self.base_offset
+
+    def peek(self):
+        """Next non-whitespace character, or '' at end of file"""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, chars):
+        char = self.peek()
+        if not char or char not in chars:
+            raise ValueError(f'Expected one of {chars!r} at byte {self.offset()}, got {char!r}')
+        self.pos += 1
+        return char
+
+    def read_value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.json_decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                # Possibly a value split across chunks; read more and retry
+                if not self._fill():
+                    raise
+                continue
+            # A number at the end of the buffer may continue in the next chunk
+            if end == len(self.buf) and not self.eof and isinstance(value, (int, float)):
+                self._fill()
+                continue
+            self.pos = end
+            return value
+
+
+def iter_object_entries(path, offset=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield (key, value, checkpoint_offset) for each entry of a top-level object"""
+    reader = JsonStreamReader(path, offset or 0, chunk_size)
+    try:
+        first = offset is None
+        if first:
+            reader.expect('{')
+        while True:
+            if reader.peek() == '}':
+                return
+            if not first:
+                if reader.expect(',}') == '}':
+                    return
+            first = False
+            key = reader.read_value()
+            reader.expect(':')
+            value = reader.read_value()
+            yield key, value, reader.offset()
+    finally:
+        reader.close()
+
+
+def iter_object_array_items(path, offset=None, current_key=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield (key, item, checkpoint_offset, current_key) for a top-level object of arrays.
+
+    Each array is streamed item by item. A checkpoint taken mid-array resumes
+    with (offset, current_key); one taken between keys has current_key None.
+    """
+    reader = JsonStreamReader(path, offset or 0, chunk_size)
+    try:
+        first_key = offset is None
+        if first_key:
+            reader.expect('{')
+        key = current_key
+        in_array = current_key is not None
+        first_item = False
+        while True:
+            if in_array:
+                if first_item:
+                    first_item = False
+                    if reader.peek() == ']':
+                        reader.expect(']')
+                        in_array = False
+                        continue
+                elif reader.expect(',]') == ']':
+                    in_array = False
+                    continue
+                item = reader.read_value()
+                yield key, item, reader.offset(), key
+                continue
+            if reader.peek() == '}':
+                return
+            if not first_key and reader.expect(',}') == '}':
+                return
+            first_key = False
+            key = reader.read_value()
+            reader.expect(':')
+            if reader.peek() == '[':
+                reader.expect('[')
+                in_array = True
+                first_item = True
+            else:
+                # Not a list; keep it as a single record so nothing is dropped
+                yield key, reader.read_value(), reader.offset(), None
+    finally:
+        reader.close()
+
+
+def _canonical(value):
+    return json.dumps(value, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+
+
+def _record_hash(*parts):
+    digest = hashlib.blake2b(_canonical(parts).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big')
+
+
+class Checksum:
+    """Order-independent checksum (sum of record hashes mod 2**64).
+
+    Unlike a running sha256 it can be persisted as an integer and continued
+    after a resume, and it does not depend on database row order.
+    """
+
+    def __init__(self, value=0):
+        self.value = value
+
+    def add(self, *parts):
+        self.value = (self.value + _record_hash(*parts)) & 0xFFFFFFFFFFFFFFFF
+
+    def hexdigest(self):
+        return f'{self.value:016x}'
+
+    @classmethod
+    def from_hex(cls, text):
+        return cls(int(text, 16))
+
+
+def _event_fields(event):
+    if not isinstance(event, dict):
+        event = {}
+    return (
+        event.get('timestamp'),
+        event.get('user_email'),
+        event.get('user_agent'),
+        event.get('ip'),
+    )
+
+
+# Per-source conversion: how to stream it, insert a record and checksum it
+
+def _insert_user(conn, email, user):
+    conn.execute(
+        'INSERT OR REPLACE INTO users (email, username, download_count, data) VALUES (?, ?, ?, ?)',
+        (email, user.get('username'), user.get('download_count', 0), _canonical(user))
+    )
+
+
+def _insert_channel(conn, channel_id, channel):
+    conn.execute(
+        'INSERT OR REPLACE INTO channels (id, platform, join_count, data) VALUES (?, ?, ?, ?)',
+        (channel_id, channel.get('platform'), channel.get('joinCount', 0), _canonical(channel))
+    )
+    conn.executemany(
+        'INSERT OR IGNORE INTO channel_members (channel_id, email) VALUES (?, ?)',
+        [(channel_id, member) for member in channel.get('members', [])]
+    )
+
+
+def _insert_event(conn, event_type, event):
+    conn.execute(
+        'INSERT INTO analytics_events (event_type, timestamp, user_email, user_agent, ip) '
+        'VALUES (?, ?, ?, ?, ?)',
+        (event_type,) + _event_fields(event)
+    )
+
+
+SOURCES = {
+    'users': {
+        'streams_arrays': False,
+        'insert': _insert_user,
+        'checksum': lambda key, value: (key, value),
+        'db_rows': 'SELECT email, data FROM users',
+        'db_record': lambda row: (row[0], json.loads(row[1])),
+        'tables': ['users'],
+    },
+    'channels': {
+        'streams_arrays': False,
+        'insert': _insert_channel,
+        'checksum': lambda key, value: (key, value),
+        'db_rows': 'SELECT id, data FROM channels',
+        'db_record': lambda row: (row[0], json.loads(row[1])),
+        'tables': ['channels', 'channel_members'],
+    },
+    'analytics': {
+        'streams_arrays': True,
+        'insert': _insert_event,
+        'checksum': lambda key, value: (key,) + _event_fields(value),
+        'db_rows': 'SELECT event_type, timestamp, user_email, user_agent, ip FROM analytics_events',
+        'db_record': lambda row: tuple(row),
+        'tables': ['analytics_events'],
+    },
+}
+
+
+def connect(db_path):
+    conn = sqlite3.connect(db_path)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def load_state(conn, source):
+    row = conn.execute(
+        'SELECT offset, current_key, records, checksum, done FROM migration_state WHERE source = ?',
+        (source,)
+    ).fetchone()
+    if not row:
+        return None
+    return {'offset': row[0], 'current_key': row[1], 'records': row[2],
+            'checksum': row[3], 'done': bool(row[4])}
+
+
+def _save_state(conn, source, offset, current_key, records, checksum, done=False):
+    conn.execute(
+        'INSERT OR REPLACE INTO migration_state (source, offset, current_key, records, checksum, done) '
+        'VALUES (?, ?, ?, ?, ?, ?)',
+        (source, offset, current_key, records, checksum.hexdigest(), int(done))
+    )
+
+
+def reset_source(conn, source):
+    with conn:
+        for table in SOURCES[source]['tables']:
+            conn.execute(f'DELETE FROM {table}')
+        conn.execute('DELETE FROM migration_state WHERE source = ?', (source,))
+
+
+def iter_source(source, path, state=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    offset = state['offset'] if state else None
+    if SOURCES[source]['streams_arrays']:
+        current_key = state['current_key'] if state else None
+        yield from iter_object_array_items(path, offset, current_key, chunk_size)
+    else:
+        for key, value, checkpoint in iter_object_entries(path, offset, chunk_size):
+            yield key, value, checkpoint, None
+
+
+def migrate_source(conn, source, path, batch_size=DEFAULT_BATCH_SIZE,
+                   chunk_size=DEFAULT_CHUNK_SIZE, log=print):
+    """Copy one JSON file into the database, resuming from its checkpoint"""
+    spec = SOURCES[source]
+    state = load_state(conn, source)
+    if state and state['done']:
+        log(f'{source}: already migrated ({state["records"]} records), skipping')
+        return state
+    if not os.path.exists(path):
+        log(f'{source}: {path} not found, nothing to migrate')
+        with conn:
+            _save_state(conn, source, 0, None, 0, Checksum(), done=True)
+        return load_state(conn, source)
+
+    records = state['records'] if state else 0
+    checksum = Checksum.from_hex(state['checksum']) if state else Checksum()
+    if state:
+        log(f'{source}: resuming at byte {state["offset"]} after {records} records')
+
+    started = time.time()
+    pending = 0
+    conn.execute('BEGIN')
+    try:
+        for key, value, checkpoint, current_key in iter_source(source, path, state, chunk_size):
+            spec['insert'](conn, key, value)
+            checksum.add(*spec['checksum'](key, value))
+            records += 1
+            pending += 1
+            if pending >= batch_size:
+                # Checkpoint commits atomically with the batch it describes
+                _save_state(conn, source, checkpoint, current_key, records, checksum)
+                conn.execute('COMMIT')
+                conn.execute('BEGIN')
+                pending = 0
+                log(f'{source}: {records} records ({checkpoint} bytes)')
+        _save_state(conn, source, os.path.getsize(path), None, records, checksum, done=True)
+        conn.execute('COMMIT')
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    elapsed = time.time() - started
+    log(f'{source}: migrated {records} records in {elapsed:.1f}s (checksum {checksum.hexdigest()})')
+    return load_state(conn, source)
+
+
+def source_stats(source, path, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Re-stream the JSON file and return (records, checksum)"""
+    spec = SOURCES[source]
+    checksum = Checksum()
+    records = 0
+    if os.path.exists(path):
+        for key, value, _, _ in iter_source(source, path, None, chunk_size):
+            checksum.add(*spec['checksum'](key, value))
+            records += 1
+    return records, checksum.hexdigest()
+
+
+def db_stats(conn, source):
+    """Return (records, checksum) computed from the migrated rows"""
+    spec = SOURCES[source]
+    checksum = Checksum()
+    records = 0
+    for row in conn.execute(spec['db_rows']):
+        checksum.add(*spec['db_record'](row))
+        records += 1
+    return records, checksum.hexdigest()
+
+
+def verify_source(conn, source, path, chunk_size=DEFAULT_CHUNK_SIZE, log=print):
+    expected = source_stats(source, path, chunk_size)
+    actual = db_stats(conn, source)
+    ok = expected == actual
+    status = 'OK' if ok else 'MISMATCH'
+    log(f'{source}: {status} source={expected[0]} records/{expected[1]} '
+        f'db={actual[0]} records/{actual[1]}')
+    return ok
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Migrate the JSON data files into SQLite')
+    parser.add_argument('--db', default='emojie.db', help='SQLite database to write')
+    parser.add_argument('--users', default=USERS_FILE)
+    parser.add_argument('--channels', default=CHANNELS_FILE)
+    parser.add_argument('--analytics', default=ANALYTICS_FILE)
+    parser.add_argument('--only', choices=sorted(SOURCES), action='append',
+                        help='Migrate only this source (repeatable)')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help='Records per transaction')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help='Bytes read from the JSON file at a time')
+    parser.add_argument('--restart', action='store_true',
+                        help='Discard checkpoints and migrated rows and start over')
+    parser.add_argument('--verify', action='store_true',
+                        help='Only compare record counts and checksums')
+    parser.add_argument('--compact', action='store_true',
+                        help='VACUUM the database after migrating')
+    args = parser.parse_args(argv)
+
+    paths = {'users': args.users, 'channels': args.channels, 'analytics': args.analytics}
+    sources = args.only or ['users', 'channels', 'analytics']
+    conn = connect(args.db)
+    conn.isolation_level = None  # transactions are managed explicitly
+    try:
+        if not args.verify:
+            for source in sources:
+                if args.restart:
+                    reset_source(conn, source)
+                migrate_source(conn, source, paths[source], args.batch_size, args.chunk_size)
+            if args.compact:
+                conn.execute('VACUUM')
+        ok = all(verify_source(conn, source, paths[source], args.chunk_size) for source in sources)
+    finally:
+        conn.close()
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,424 @@
+"""Background sticker rendering for the API.
+
+Uploaded photos are rendered by the same pipeline as the desktop app and
+the batch CLI (sticker_batch.render_one) in a process pool, so rendering
+never holds the GIL or a request thread. Admission control keeps it from
+starving the other routes:
+
+* at most `max_pending` jobs are queued or running in total; beyond that
+  submit() raises QueueFull (the API answers 503 with Retry-After)
+* each user may have at most `per_user_limit` unfinished jobs
+  (UserLimitReached, answered with 429)
+
+Workers append the pipeline's progress events (decode, enhance, each
+sticker, encode) to a per-job JSON-lines file and save every sticker as it
+is finished; follow_events() tails that file for the Server-Sent Events
+route. The parent adds the final 'done' or 'failed' event.
+
+Rendered sheets are kept in the shared sticker_store (the desktop app's
+too). A photo whose exact bytes were rendered before in the same style is
+served from it straight away, without a queue slot; workers also reuse
+sheets rendered from the same pixels.
+
+Job records live in <jobs_dir>/jobs.json (a json_store.JsonFile written
+under its lock), so every API worker process sees the same jobs: status,
+events and the admission limits work whichever worker a request lands on.
+The worker that accepted a job runs it and records its end; jobs of a
+worker that exited without finishing them are marked failed.
+
+Sticker packs and animations of a finished job are encoded in the same
+pool on first request (export_file()) and kept next to the sheet, so
+repeat downloads are served from disk.
+
+Finished jobs and their files are removed after `job_ttl` seconds.
+"""
+import atexit
+import glob
+import hashlib
+import shutil
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from json_store import JsonFile, locked
+except ImportError:
+    from backend.json_store import JsonFile, locked
+
+# The renderer lives at the repository root, next to emogi.py
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+if ROOT_DIR not in sys.path:
+    sys.path.append(ROOT_DIR)
+
+DEFAULT_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+DEFAULT_MAX_PENDING = 32
+DEFAULT_USER_LIMIT = 2
+DEFAULT_JOB_TTL = 3600
+EVENT_POLL_INTERVAL = 0.2
+EVENT_HEARTBEAT = 15
+FINAL_STAGES = ('done', 'failed')
+JOBS_FILE = 'jobs.json'
+
+
+def append_event(events_path, event):
+    with open(events_path, 'a') as f:
+        f.write(json.dumps(event) + '\n')
+
+
+def job_progress(output_path, events_path):
+    """Progress callback saving each sticker and logging the events"""
+    def progress(event):
+        image = event.pop('image', None)
+        if image is not None:
+            image.save(sticker_path(output_path, event['index']), format='PNG')
+        append_event(events_path, event)
+    return progress
+
+
+def mark_running(jobs_file, job_id):
+    with locked(jobs_file):
+        jobs = jobs_file.load()
+        job = jobs.get(job_id)
+        if job is not None and job['status'] == 'queued':
+            job['status'] = 'running'
+            jobs_file.save(jobs)
+
+
+def run_job(input_path, output_path, style, events_path, store_dir=None, store_bytes=None, source_hash=None,
+            jobs_path=None, job_id=None):
+    """Worker process: render one sheet, logging progress and each sticker"""
+    import sticker_batch
+    import sticker_store
+    if jobs_path:
+        mark_running(JsonFile(jobs_path), job_id)
+    store = sticker_store.get_store(store_dir, store_bytes)
+    return sticker_batch.render_one(input_path, output_path, 'png', style, job_progress(output_path, events_path),
+                                    store, source_hash)
+
+
+def init_renderer():
+    """Worker process start-up: label emoji come from the built sprite atlas"""
+    import sticker_renderer
+    sticker_renderer.use_built_atlas()
+
+
+def sticker_path(output_path, index):
+    return output_path[:-len('.png')] + f'_sticker{index}.png'
+
+
+def export_path(output_path, name):
+    return output_path[:-len('.png')] + f'_{name}'
+
+
+def run_export(sheet_path, target_path, kind, sizes=None, fmt=None, tween=0):
+    """Worker process: encode a finished sheet as a ZIP pack ('pack') or an animation ('animation')"""
+    from PIL import Image
+    with Image.open(sheet_path) as sheet:
+        sheet.load()
+    if kind == 'pack':
+        import sticker_export
+        sticker_export.write_export_zip(sheet, target_path, sizes)
+        return
+    import sticker_animate
+    data = sticker_animate.animate_sheet(sheet, fmt, tween)
+    tmp_path = f'{target_path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, target_path)
+
+
+class QueueFull(Exception):
+    pass
+
+
+class UserLimitReached(Exception):
+    pass
+
+
+class ExportFailed(Exception):
+    pass
+
+
+def _process_alive(pid):
+    if os.name == 'nt':
+        return True  # os.kill would terminate it; such jobs expire with job_ttl instead
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class StickerJobs:
+    def __init__(self, jobs_dir, workers=DEFAULT_WORKERS, max_pending=DEFAULT_MAX_PENDING,
+                 per_user_limit=DEFAULT_USER_LIMIT, job_ttl=DEFAULT_JOB_TTL, store_dir=None, store_bytes=None):
+        self.jobs_dir = os.path.abspath(jobs_dir)
+        self.store_dir = store_dir
+        self.store_bytes = store_bytes
+        self.workers = workers
+        self.max_pending = max_pending
+        self.per_user_limit = per_user_limit
+        self.job_ttl = job_ttl
+        os.makedirs(self.jobs_dir, exist_ok=True)
+        self.jobs_file = JsonFile(os.path.join(self.jobs_dir, JOBS_FILE))
+        self._futures = {}  # jobs running in this process's pool
+        self._exports = {}  # export file path -> future building it
+        self._exports_lock = threading.Lock()
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    def _get_pool(self):
+        # Started on first use so app startup doesn't fork workers (or import Pillow)
+        with self._pool_lock:
+            if self._pool is None:
+                # The parent computes store keys too, so it needs the same atlas as the workers
+                init_renderer()
+                self._pool = ProcessPoolExecutor(max_workers=self.workers, initializer=init_renderer)
+                atexit.register(self.shutdown)
+            return self._pool
+
+    @staticmethod
+    def _unfinished(jobs):
+        return [job for job in jobs.values() if job['status'] in ('queued', 'running')]
+
+    def submit(self, owner, photo_bytes, style=None):
+        """Queue a render of the uploaded photo; returns the job dict"""
+        import sticker_enhance
+        import sticker_store
+        style = style or sticker_enhance.DEFAULT_STYLE
+        if style not in sticker_enhance.STYLE_PRESETS:
+            raise ValueError(f'Unknown style: {style}')
+        source_hash = hashlib.sha256(photo_bytes).hexdigest()
+        store = sticker_store.get_store(self.store_dir, self.store_bytes)
+        key = store.lookup_source(source_hash, style)
+        if key:
+            job = self._submit_stored(owner, style, store, key)
+            if job:
+                return job
+        with locked(self.jobs_file):
+            jobs = self.jobs_file.load()
+            if self._expire(jobs):
+                self.jobs_file.save(jobs)
+            unfinished = self._unfinished(jobs)
+            if len(unfinished) >= self.max_pending:
+                raise QueueFull('Sticker queue is full, try again shortly')
+            if sum(1 for job in unfinished if job['owner'] == owner) >= self.per_user_limit:
+                raise UserLimitReached(f'At most {self.per_user_limit} sticker jobs at a time')
+            job = self._new_job(owner, style)
+            with open(job['input_path'], 'wb') as f:
+                f.write(photo_bytes)
+            append_event(job['events_path'], {'stage': 'queued', 'progress': 0})
+            jobs[job['id']] = job
+            self.jobs_file.save(jobs)
+        future = self._get_pool().submit(run_job, job['input_path'], job['output_path'], style, job['events_path'],
+                                         self.store_dir, self.store_bytes, source_hash, self.jobs_file.path, job['id'])
+        self._futures[job['id']] = future
+        future.add_done_callback(lambda done: self._finish(job['id'], done))
+        return self.describe(job)
+
+    def _new_job(self, owner, style):
+        job_id = uuid.uuid4().hex
+        return {
+            'id': job_id,
+            'owner': owner,
+            'style': style,
+            'status': 'queued',
+            'cached': False,
+            'created': time.time(),
+            'finished': None,
+            'error': None,
+            'pid': os.getpid(),  # the API worker that runs it
+            'input_path': os.path.join(self.jobs_dir, f'{job_id}_input'),
+            'output_path': os.path.join(self.jobs_dir, f'{job_id}.png'),
+            'events_path': os.path.join(self.jobs_dir, f'{job_id}.events'),
+        }
+
+    def _submit_stored(self, owner, style, store, key):
+        """A finished job for a sheet already in the store, or None if it was evicted meanwhile"""
+        import sticker_store
+        from PIL import Image
+        stored = store.path(key)
+        if stored is None:
+            return None
+        job = self._new_job(owner, style)
+        try:
+            shutil.copyfile(stored, job['output_path'])
+            with Image.open(job['output_path']) as sheet:
+                sheet.load()
+        except OSError:
+            self._remove_file(job['output_path'])
+            return None
+        sticker_store.replay(sheet, job_progress(job['output_path'], job['events_path']))
+        append_event(job['events_path'], {'stage': 'done', 'progress': 1})
+        job.update(status='done', cached=True, finished=time.time())
+        with locked(self.jobs_file):
+            jobs = self.jobs_file.load()
+            jobs[job['id']] = job
+            self.jobs_file.save(jobs)
+        return self.describe(job)
+
+    def _finish(self, job_id, future):
+        self._futures.pop(job_id, None)
+        if future.cancelled():
+            return  # shutdown() has already failed the job
+        error = future.exception()
+        with locked(self.jobs_file):
+            jobs = self.jobs_file.load()
+            job = jobs.get(job_id)
+            if job is None or job['finished']:
+                return  # expired, or failed by shutdown()
+            job['status'] = 'failed' if error else 'done'
+            # The real error mentions server paths, so it only goes to the log
+            job['error'] = 'Could not render this photo' if error else None
+            job['finished'] = time.time()
+            self.jobs_file.save(jobs)
+        if error:
+            print(f"Sticker job {job_id} failed: {error}")
+            append_event(job['events_path'], {'stage': 'failed', 'progress': 1, 'error': job['error']})
+        else:
+            append_event(job['events_path'], {'stage': 'done', 'progress': 1})
+        self._remove_file(job['input_path'])
+
+    def _fail(self, job, error):
+        job.update(status='failed', error=error, finished=time.time())
+        append_event(job['events_path'], {'stage': 'failed', 'progress': 1, 'error': error})
+        self._remove_file(job['input_path'])
+
+    def _expire(self, jobs):
+        """Drop jobs finished more than job_ttl ago and fail those whose worker is gone.
+
+        Called with the jobs file locked; returns True if `jobs` changed.
+        """
+        cutoff = time.time() - self.job_ttl
+        changed = False
+        for job_id, job in list(jobs.items()):
+            if job['finished'] and job['finished'] < cutoff:
+                del jobs[job_id]
+                for path in glob.glob(os.path.join(self.jobs_dir, f'{job_id}*')):
+                    self._remove_file(path)
+                changed = True
+            elif not job['finished'] and job['pid'] != os.getpid() and not _process_alive(job['pid']):
+                self._fail(job, 'The server restarted, please try again')
+                changed = True
+        return changed
+
+    @staticmethod
+    def _remove_file(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def get(self, job_id, owner):
+        """The owner's job, or None"""
+        job = self.jobs_file.read().get(job_id)
+        if job is None or job['owner'] != owner:
+            return None
+        return job
+
+    def sticker_file(self, job, index):
+        """Path of one finished sticker of a job, or None"""
+        path = sticker_path(job['output_path'], index)
+        return path if os.path.isfile(path) else None
+
+    def export_file(self, job, name, kind, **options):
+        """Path of a finished job's export (e.g. a pack), or None while the pool builds it.
+
+        The first request queues the encode; once the file exists it is
+        served as is. Raises QueueFull when too many exports are pending and
+        ExportFailed if the encode failed (the next request retries it).
+        """
+        path = export_path(job['output_path'], name)
+        if os.path.isfile(path):
+            return path
+        with self._exports_lock:
+            future = self._exports.get(path)
+            if future is not None:
+                if not future.done():
+                    return None
+                # Only failed exports are still listed once done
+                del self._exports[path]
+                print(f"Sticker export {os.path.basename(path)} failed: {future.exception()}")
+                raise ExportFailed('Could not export these stickers')
+            if len(self._exports) >= self.max_pending:
+                raise QueueFull('Sticker queue is full, try again shortly')
+            future = self._get_pool().submit(run_export, job['output_path'], path, kind, **options)
+            self._exports[path] = future
+        future.add_done_callback(lambda done: self._export_done(path, done))
+        return None
+
+    def _export_done(self, path, future):
+        if future.cancelled() or future.exception() is None:
+            with self._exports_lock:
+                self._exports.pop(path, None)
+
+    def follow_events(self, job, last_id=0, poll_interval=EVENT_POLL_INTERVAL, heartbeat=EVENT_HEARTBEAT):
+        """Yield (event_id, event) as the job logs them, or None as a keep-alive.
+
+        Events are numbered from 1 by their line in the log, so a client
+        reconnecting with Last-Event-ID resumes where it stopped. Ends after
+        the final 'done'/'failed' event.
+        """
+        event_id = 0
+        pending = ''
+        idle = 0.0
+        with open(job['events_path'], 'r') as f:
+            while True:
+                chunk = f.read()
+                if chunk:
+                    idle = 0.0
+                    pending += chunk
+                    *lines, pending = pending.split('\n')
+                    for line in lines:
+                        event_id += 1
+                        if event_id <= last_id:
+                            continue
+                        event = json.loads(line)
+                        yield event_id, event
+                        if event['stage'] in FINAL_STAGES:
+                            return
+                    continue
+                if job['id'] not in self.jobs_file.read():
+                    return  # expired while we were waiting
+                time.sleep(poll_interval)
+                idle += poll_interval
+                if idle >= heartbeat:
+                    idle = 0.0
+                    yield None
+
+    def describe(self, job):
+        """Public view of a job (no file paths)"""
+        info = {key: job[key] for key in ('id', 'style', 'status', 'cached', 'created', 'finished', 'error')}
+        if job['status'] == 'queued':
+            queued = [other for other in self.jobs_file.read().values() if other['status'] == 'queued']
+            info['queue_position'] = sum(1 for other in queued if other['created'] < job['created'])
+        return info
+
+    def stats(self):
+        """Queue totals across all API workers"""
+        unfinished = self._unfinished(self.jobs_file.read())
+        return {
+            'workers': self.workers,
+            'queued': sum(1 for job in unfinished if job['status'] == 'queued'),
+            'running': sum(1 for job in unfinished if job['status'] == 'running'),
+            'max_pending': self.max_pending,
+        }
+
+    def shutdown(self):
+        """Stop the pool (registered with atexit); jobs it hadn't finished are failed"""
+        if self._pool is None:
+            return
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        with locked(self.jobs_file):
+            jobs = self.jobs_file.load()
+            for job_id in list(self._futures):
+                job = jobs.get(job_id)
+                if job is not None and not job['finished']:
+                    self._fail(job, 'The server restarted, please try again')
+            self.jobs_file.save(jobs)
@@ -0,0 +1,270 @@
+"""Headless per-stage benchmark of the sticker pipeline.
+
+Each input (synthetic images at several resolutions, saved as JPEG so the
+decode is measured too, plus any fixture photos) runs in a fresh worker
+process through these stages:
+
+  decode          sticker_renderer.load_photo (reduced-resolution decode)
+  base            prepare_base: resize, enhance, smooth, circular crop (uncached)
+  overlays        building the 12 expression overlay layers (uncached)
+  single_sticker  create_single_chibi for each expression (warm caches)
+  add_overlay     add_expression_overlay on a copy of the base, per expression
+  sheet           create_chibi_stickers with a prepared base
+  encode          PNG encode of the sheet
+
+Per stage it reports best/mean wall time, tracemalloc's peak (Python-level
+allocations only; Pillow's pixel buffers are allocated in C) and how far
+the process's RSS peaked above its level at the start of the stage, which
+does capture the pixel buffers (per stage on Linux, where the peak can be
+reset; elsewhere only growth past the earlier stages shows up, and Windows
+reports none).
+
+    python bench_pipeline.py
+    python bench_pipeline.py --sizes 1920x1080 8000x6000 --images photos/ --json bench.json
+    python bench_pipeline.py --compare bench.json      # exit 1 on regressions
+    python bench_pipeline.py --profile profiles/       # cProfile dump per stage
+"""
+import argparse
+import cProfile
+import io
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+import sticker_batch
+import sticker_enhance
+import sticker_renderer
+
+DEFAULT_SIZES = ['640x480', '1920x1080', '4000x3000']
+STAGES = ['decode', 'base', 'overlays', 'single_sticker', 'add_overlay', 'sheet', 'encode']
+# Stages whose sum is the cost of one sheet from a file on disk
+END_TO_END = ['decode', 'base', 'overlays', 'sheet', 'encode']
+DEFAULT_THRESHOLD = 1.25
+
+
+def _proc_status_kb(field):
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def _reset_peak_rss():
+    """Reset the kernel's peak-RSS mark (Linux only); returns whether it worked"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _rss_kb():
+    rss = _proc_status_kb('VmRSS')
+    return rss if rss is not None else _peak_rss_kb()
+
+
+def _peak_rss_kb():
+    # VmHWM rather than ru_maxrss: Linux carries ru_maxrss over exec, so a
+    # spawned worker would report its parent's peak
+    peak = _proc_status_kb('VmHWM')
+    if peak is not None:
+        return peak
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak  # bytes on macOS, KiB elsewhere
+
+
+def _mb(kb, digits=0):
+    return 'n/a' if kb is None else f'{kb / 1024:.{digits}f}'
+
+
+def _stage_functions(path, style):
+    state = {}
+
+    def decode():
+        state['image'] = sticker_renderer.load_photo(path)
+
+    def base():
+        sticker_renderer.clear_base_cache()
+        state['base'] = sticker_renderer.prepare_base(state['image'], style)
+
+    def overlays():
+        sticker_renderer.overlay_layer.cache_clear()
+        for name, emoji in sticker_renderer.EXPRESSIONS:
+            sticker_renderer.overlay_layer(name, emoji)
+
+    def single_sticker():
+        for info in sticker_renderer.EXPRESSIONS:
+            sticker_renderer.create_single_chibi(state['image'], info, style)
+
+    def add_overlay():
+        for name, emoji in sticker_renderer.EXPRESSIONS:
+            sticker_renderer.add_expression_overlay(state['base'].copy(), name, emoji)
+
+    def sheet():
+        state['sheet'] = sticker_renderer.create_chibi_stickers(state['image'], style=style)
+
+    def encode():
+        state['sheet'].save(io.BytesIO(), format='PNG')
+
+    functions = locals()
+    return [(name, functions[name]) for name in STAGES]
+
+
+def run_case(label, path, repeat=5, style=sticker_enhance.DEFAULT_STYLE, profile_dir=None):
+    """Benchmark every stage for one input; runs in a worker process"""
+    sticker_renderer.overlay_layer.cache_clear()
+    sticker_renderer.clear_base_cache()
+    stages = {}
+    max_rss = None
+    for name, function in _stage_functions(path, style):
+        # Memory pass first, so the RSS peak reflects this stage's first run.
+        # Without a resettable peak this only shows growth past earlier stages.
+        rss_before = _rss_kb() if _reset_peak_rss() else _peak_rss_kb()
+        tracemalloc.start()
+        function()
+        traced_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        peak = _peak_rss_kb()
+        if peak is None:
+            rss_growth = None  # no RSS figures on this platform
+        else:
+            max_rss = max(max_rss or 0, peak)
+            rss_growth = max(0, peak - rss_before)
+
+        times = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            function()
+            times.append(time.perf_counter() - started)
+
+        if profile_dir:
+            profiler = cProfile.Profile()
+            profiler.runcall(function)
+            profiler.dump_stats(os.path.join(profile_dir, f'{label}_{name}.prof'))
+
+        stages[name] = {
+            'best_ms': min(times) * 1000,
+            'mean_ms': sum(times) / len(times) * 1000,
+            'tracemalloc_peak_kb': traced_peak / 1024,
+            'rss_growth_kb': rss_growth,
+        }
+
+    expressions = len(sticker_renderer.EXPRESSIONS)
+    end_to_end = sum(stages[name]['best_ms'] for name in END_TO_END) / 1000
+    return {
+        'label': label,
+        'stages': stages,
+        # Share of a sheet from disk, the inverse of stickers_per_second
+        'per_sticker_ms': end_to_end * 1000 / expressions,
+        # One more sticker once the photo is decoded and the caches are warm
+        'warm_per_sticker_ms': stages['single_sticker']['best_ms'] / expressions,
+        'sheet_ms': end_to_end * 1000,
+        'sheets_per_second': 1 / end_to_end,
+        'stickers_per_second': expressions / end_to_end,
+        'peak_rss_kb': max_rss,
+    }
+
+
+def synthetic_size(text):
+    """argparse type for WxH sizes such as 1920x1080"""
+    width, sep, height = text.lower().partition('x')
+    if not (sep and width.isdigit() and height.isdigit() and int(width) > 0 and int(height) > 0):
+        raise argparse.ArgumentTypeError(f'{text!r} is not a size like 1920x1080')
+    return f'{int(width)}x{int(height)}'
+
+
+def make_synthetic(size, directory):
+    width, height = (int(n) for n in synthetic_size(size).split('x'))
+    path = os.path.join(directory, f'synthetic_{width}x{height}.jpg')
+    sticker_enhance.synthetic_image(width, height).save(path, format='JPEG', quality=90)
+    return f'{width}x{height}', path
+
+
+def run(sizes=DEFAULT_SIZES, images=(), repeat=5, style=sticker_enhance.DEFAULT_STYLE, profile_dir=None):
+    if profile_dir:
+        os.makedirs(profile_dir, exist_ok=True)
+    # A fresh process per input keeps caches and RSS peaks independent
+    context = multiprocessing.get_context('spawn')
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        cases = [make_synthetic(size, tmp) for size in sizes]
+        cases += [(os.path.basename(path), path) for path in sticker_batch.collect_inputs(images)]
+        for label, path in cases:
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                results.append(pool.submit(run_case, label, path, repeat, style, profile_dir).result())
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'style': style,
+        'repeat': repeat,
+        'cases': results,
+    }
+
+
+def compare(report, baseline, threshold=DEFAULT_THRESHOLD):
+    """List (case, stage, ratio) where best time grew by more than `threshold`x"""
+    previous = {case['label']: case for case in baseline['cases']}
+    regressions = []
+    for case in report['cases']:
+        old = previous.get(case['label'])
+        if not old:
+            continue
+        for stage, numbers in case['stages'].items():
+            before = old['stages'].get(stage, {}).get('best_ms')
+            if before and numbers['best_ms'] / before > threshold:
+                regressions.append((case['label'], stage, numbers['best_ms'] / before))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Per-stage benchmark of the sticker pipeline')
+    parser.add_argument('--sizes', nargs='*', type=synthetic_size, default=DEFAULT_SIZES,
+                        help='Synthetic input sizes, e.g. 1920x1080')
+    parser.add_argument('--images', nargs='*', default=[], help='Fixture photo directories or globs')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--style', default=sticker_enhance.DEFAULT_STYLE, choices=sorted(sticker_enhance.STYLE_PRESETS))
+    parser.add_argument('--profile', dest='profile_dir', help='Write a cProfile dump per case and stage here')
+    parser.add_argument('--json', dest='json_path', help='Also write the report to this file')
+    parser.add_argument('--compare', dest='baseline', help='Baseline JSON to check for regressions')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='Slowdown ratio counted as a regression')
+    args = parser.parse_args(argv)
+
+    report = run(args.sizes, args.images, args.repeat, args.style, args.profile_dir)
+    for case in report['cases']:
+        print(f"{case['label']}: {case['sheet_ms']:.1f} ms/sheet, {case['sheets_per_second']:.1f} sheets/s, "
+              f"{case['stickers_per_second']:.0f} stickers/s, {case['per_sticker_ms']:.3f} ms/sticker "
+              f"({case['warm_per_sticker_ms']:.3f} ms warm), "
+              f"peak RSS {_mb(case['peak_rss_kb'])} MB")
+        for stage, numbers in case['stages'].items():
+            print(f"  {stage:15} best {numbers['best_ms']:9.3f} ms  mean {numbers['mean_ms']:9.3f} ms  "
+                  f"tracemalloc {numbers['tracemalloc_peak_kb']:8.1f} KB  rss +{_mb(numbers['rss_growth_kb'], 1)} MB")
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        for label, stage, ratio in regressions:
+            print(f'REGRESSION {label} {stage}: x{ratio:.2f}')
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
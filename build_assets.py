@@ -0,0 +1,308 @@
+"""Build the static site into dist/ for deployment.
+
+* minifies the CSS and JS files
+* content-hashes their filenames (style.css -> static/style.<hash>.css)
+* rewrites the references in the HTML pages to the hashed names
+* writes a .gz sibling next to every emitted file
+* writes dist/manifest.json mapping source names to built names
+* packs the emoji library into sprite atlas pages (atlas_builder.py) under
+  static/atlas and puts a link to its CSS where a page has <!-- atlas.css -->
+
+Only files whose content changed get new names, so browsers can cache the
+hashed files forever (the backend serves them with immutable headers) and
+only re-download what actually changed.
+
+Usage:
+    python build_assets.py
+    python build_assets.py --out dist --no-minify
+    python build_assets.py --no-atlas
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+PAGES = ['index.html', 'join-channels.html', 'error.html']
+STATIC_DIR = 'static'
+HASH_LENGTH = 10
+# Pages mark where the atlas stylesheet goes; left as is when no atlas is built
+ATLAS_PLACEHOLDER = '<!-- atlas.css -->'
+
+# Characters after which a '/' starts a regex literal rather than a division
+_REGEX_PRECEDERS = set('(,=:[!&|?{};+-*%<>~^')
+_REGEX_KEYWORDS = {'return', 'typeof', 'instanceof', 'in', 'of', 'new', 'delete',
+                   'void', 'throw', 'case', 'do', 'else', 'yield', 'await'}
+
+
+def minify_css(source):
+    """Strip comments and redundant whitespace; strings are left untouched"""
+    out = []
+    i = 0
+    n = len(source)
+    while i < n:
+        c = source[i]
+        if c in '"\'':
+            end = i + 1
+            while end < n and source[end] != c:
+                end += 2 if source[end] == '\\' else 1
+            out.append(source[i:end + 1])
+            i = end + 1
+        elif source.startswith('/*', i):
+            end = source.find('*/', i + 2)
+            i = n if end == -1 else end + 2
+        elif c.isspace():
+            while i < n and source[i].isspace():
+                i += 1
+            out.append(' ')
+        else:
+            out.append(c)
+            i += 1
+    css = ''.join(out)
+    # Spaces are never significant next to these outside of strings; strings
+    # were copied verbatim above so split them out before substituting.
+    parts = re.split(r'("(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\')', css)
+    for index in range(0, len(parts), 2):
+        part = re.sub(r'\s*([{};,>])\s*', r'\1', parts[index])
+        part = re.sub(r':\s+', ':', part)
+        parts[index] = part.replace(';}', '}')
+    return ''.join(parts).strip()
+
+
+def minify_js(source):
+    """Conservative JS minifier.
+
+    Removes comments, indentation, trailing spaces, blank lines and repeated
+    spaces. Line breaks are kept so automatic semicolon insertion behaves
+    exactly as in the original. Strings, template literals and regex
+    literals are copied verbatim.
+    """
+    out = []
+    i = 0
+    n = len(source)
+    last_sig = ''       # last significant (non-space) character emitted
+    last_word = ''      # last identifier emitted, for regex detection
+    template_depth = []  # brace depth for each open ${ ... } inside a template
+    at_line_start = True
+
+    def emit(text):
+        nonlocal last_sig, at_line_start
+        out.append(text)
+        stripped = text.rstrip()
+        if stripped:
+            last_sig = stripped[-1]
+        at_line_start = False
+
+    def copy_template(start):
+        # Copy a template literal from `start` (just past the backtick) up to
+        # its end or the next ${, returning the index after what was copied.
+        j = start
+        while j < n:
+            ch = source[j]
+            if ch == '\\':
+                j += 2
+                continue
+            if ch == '`':
+                emit(source[start:j + 1])
+                return j + 1, False
+            if source.startswith('${', j):
+                emit(source[start:j + 2])
+                return j + 2, True
+            j += 1
+        emit(source[start:])
+        return n, False
+
+    while i < n:
+        c = source[i]
+        if c in '"\'':
+            j = i + 1
+            while j < n and source[j] != c and source[j] != '\n':
+                j += 2 if source[j] == '\\' else 1
+            emit(source[i:j + 1])
+            last_word = ''
+            i = j + 1
+        elif c == '`':
+            out.append('`')
+            i, opened = copy_template(i + 1)
+            if opened:
+                template_depth.append(0)
+            last_word = ''
+        elif c == '}' and template_depth and template_depth[-1] == 0:
+            template_depth.pop()
+            out.append('}')
+            i, opened = copy_template(i + 1)
+            if opened:
+                template_depth.append(0)
+        elif source.startswith('//', i):
+            while i < n and source[i] != '\n':
+                i += 1
+        elif source.startswith('/*', i):
+            end = source.find('*/', i + 2)
+            i = n if end == -1 else end + 2
+        elif c == '/' and (last_sig in _REGEX_PRECEDERS or last_sig == '' or last_word in _REGEX_KEYWORDS):
+            j = i + 1
+            in_class = False
+            while j < n and source[j] != '\n':
+                ch = source[j]
+                if ch == '\\':
+                    j += 2
+                    continue
+                if ch == '[':
+                    in_class = True
+                elif ch == ']':
+                    in_class = False
+                elif ch == '/' and not in_class:
+                    break
+                j += 1
+            j += 1
+            while j < n and (source[j].isalnum()):
+                j += 1
+            emit(source[i:j])
+            last_word = ''
+            i = j
+        elif c == '\n':
+            while out and out[-1] in (' ', '\t'):
+                out.pop()
+            if out and not at_line_start:
+                out.append('\n')
+                at_line_start = True
+            i += 1
+        elif c in ' \t\r':
+            while i < n and source[i] in ' \t\r':
+                i += 1
+            if not at_line_start:
+                out.append(' ')
+        else:
+            if c == '{' and template_depth:
+                template_depth[-1] += 1
+            elif c == '}' and template_depth:
+                template_depth[-1] -= 1
+            if c.isalnum() or c in '_$':
+                j = i
+                while j < n and (source[j].isalnum() or source[j] in '_$'):
+                    j += 1
+                last_word = source[i:j]
+                emit(last_word)
+                i = j
+            else:
+                last_word = ''
+                emit(c)
+                i += 1
+    return ''.join(out).strip() + '\n'
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+
+
+def write_file(path, data, gzip_level=9):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+    with open(path + '.gz', 'wb') as f:
+        f.write(gzip.compress(data, compresslevel=gzip_level, mtime=0))
+
+
+def find_local_assets(pages, root=ROOT):
+    """CSS/JS files referenced by src= or href= in the pages"""
+    assets = []
+    for page in pages:
+        with open(os.path.join(root, page), 'r', encoding='utf-8') as f:
+            html = f.read()
+        for ref in re.findall(r'(?:src|href)="([^"#?:]+\.(?:css|js))"', html):
+            ref = ref.lstrip('./')
+            if ref not in assets and os.path.exists(os.path.join(root, ref)):
+                assets.append(ref)
+    return assets
+
+
+def rewrite_references(html, manifest):
+    def replace(match):
+        attr, quote, ref = match.group(1), match.group(2), match.group(3)
+        built = manifest.get(ref.lstrip('./'))
+        return f'{attr}={quote}{built}{quote}' if built else match.group(0)
+    return re.sub(r'\b(src|href)=(["\'])([^"\']+)\2', replace, html)
+
+
+def insert_atlas_link(html, manifest):
+    if 'atlas.css' not in manifest:
+        return html
+    return html.replace(ATLAS_PLACEHOLDER, f'<link rel="stylesheet" href="{manifest["atlas.css"]}">')
+
+
+def build_atlas(out_dir, root=ROOT, log=print):
+    """Update the emoji sprite atlas; returns its CSS file's built name"""
+    import atlas_builder  # needs Pillow, which the rest of the build doesn't
+    index = atlas_builder.build_atlas(os.path.join(root, 'assests', 'emojis'),
+                                      os.path.join(out_dir, STATIC_DIR, 'atlas'), log=log)
+    return f"{STATIC_DIR}/atlas/{index['css']}"
+
+
+def build(out_dir, pages=PAGES, minify=True, root=ROOT, log=print, atlas=True):
+    """Build the site into out_dir and return the manifest"""
+    previous = {}
+    manifest_path = os.path.join(out_dir, 'manifest.json')
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r') as f:
+            previous = json.load(f)
+
+    manifest = {}
+    if atlas:
+        manifest['atlas.css'] = build_atlas(out_dir, root, log)
+    total_in = total_out = 0
+    for name in find_local_assets(pages, root):
+        with open(os.path.join(root, name), 'r', encoding='utf-8') as f:
+            source = f.read()
+        if minify:
+            text = minify_css(source) if name.endswith('.css') else minify_js(source)
+        else:
+            text = source
+        data = text.encode('utf-8')
+        stem, ext = os.path.splitext(name)
+        built = f'{STATIC_DIR}/{stem}.{content_hash(data)}{ext}'
+        manifest[name] = built
+        target = os.path.join(out_dir, built)
+        if not os.path.exists(target):
+            write_file(target, data)
+        total_in += len(source.encode('utf-8'))
+        total_out += len(data)
+        log(f'{name:20} {len(source.encode("utf-8")):>8} -> {len(data):>8} bytes  {built}')
+
+    for page in pages:
+        with open(os.path.join(root, page), 'r', encoding='utf-8') as f:
+            html = f.read()
+        html = insert_atlas_link(rewrite_references(html, manifest), manifest)
+        write_file(os.path.join(out_dir, page), html.encode('utf-8'))
+
+    # Drop hashed files that are no longer referenced
+    stale = set(previous.values()) - set(manifest.values())
+    for built in stale:
+        for path in (os.path.join(out_dir, built), os.path.join(out_dir, built) + '.gz'):
+            if os.path.exists(path):
+                os.remove(path)
+
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    if total_in:
+        log(f'minified {total_in} -> {total_out} bytes ({100 * total_out / total_in:.0f}%), '
+            f'{len(stale)} stale file(s) removed')
+    return manifest
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Minify, fingerprint and precompress the static site')
+    parser.add_argument('--out', default=os.path.join(ROOT, 'dist'), help='Output directory')
+    parser.add_argument('--no-minify', action='store_true', help='Only fingerprint and compress')
+    parser.add_argument('--clean', action='store_true', help='Remove the output directory first')
+    parser.add_argument('--no-atlas', action='store_true', help="Don't build the emoji sprite atlas")
+    args = parser.parse_args(argv)
+    if args.clean and os.path.isdir(args.out):
+        shutil.rmtree(args.out)
+    build(args.out, minify=not args.no_minify, atlas=not args.no_atlas)
+
+
+if __name__ == '__main__':
+    main()
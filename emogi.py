@@ -1,27 +1,46 @@
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, scrolledtext
 import os
+import importlib.util
 import threading
-import base64
-import io
+import queue
 from datetime import datetime
 
 # Import required libraries with error handling
 try:
-    from PIL import Image, ImageTk, ImageDraw, ImageFilter, ImageEnhance, ImageOps
+    from PIL import Image, ImageTk
     PIL_AVAILABLE = True
 except ImportError:
     PIL_AVAILABLE = False
     messagebox.showerror("Missing Library", "Please install Pillow: pip install Pillow")
 
+# The sticker modules need Pillow; errors inside them are reported as they are
+if PIL_AVAILABLE:
+    import sticker_renderer
+    from asset_library import AssetLibrary, EMOJI_EXTENSIONS, GIF_EXTENSIONS
+    from gif_index import GifIndex
+    import gemini_client
+    import photo_ingest
+    import sticker_export
+    import sticker_animate
+    import sticker_store
+
+# gemini_client imports the SDK on first use; only check that it is installed
 try:
-    import google.generativeai as genai
-    GENAI_AVAILABLE = True
+    GENAI_AVAILABLE = importlib.util.find_spec("google.generativeai") is not None
 except ImportError:
     GENAI_AVAILABLE = False
+if not GENAI_AVAILABLE:
     messagebox.showerror("Missing Library", "Please install Google AI: pip install google-generativeai")
 
 class ChibiStickerGenerator:
+    # Progress bar value when sticker rendering starts (after the AI step)
+    RENDER_PROGRESS_START = 40
+    # Size of each sticker cell in the result preview, and how often the
+    # Tk thread drains the preview queue (ms)
+    PREVIEW_CELL_SIZE = 118
+    PREVIEW_POLL_MS = 30
+    
     def __init__(self, root):
         self.root = root
         self.root.title("🎨 Chibi Sticker Generator with AI")
@@ -41,15 +60,24 @@ class ChibiStickerGenerator:
         
         # Variables
         self.uploaded_image = None
+        self.uploaded_photo = None
         self.generated_stickers = None
         self.api_key = ""
+        # Filled by the generation thread, drained on the Tk thread by _poll_previews
+        self.preview_queue = queue.Queue()
+        self.preview_polling = False
+        self.preview_after_id = None
         self.emoji_dir = os.path.join(os.path.dirname(__file__), "..", "assets", "emojis")
         self.gif_dir = os.path.join(os.path.dirname(__file__), "..", "assets", "gifs")
         self.loaded_emojis = self.load_emojis()
         self.loaded_gifs = self.load_gifs()
+        self.gif_index = self.index_gifs()
         
         if not PIL_AVAILABLE or not GENAI_AVAILABLE:
             return
+        
+        # Sticker labels draw their emoji from the sprite atlas once it is built
+        sticker_renderer.use_built_atlas()
             
         self.setup_ui()
         
@@ -323,15 +351,15 @@ class ChibiStickerGenerator:
         content = tk.Frame(self.result_frame, bg=self.colors['bg_secondary'])
         content.pack(fill='both', expand=True, padx=15, pady=15)
         
-        # Image display
-        self.result_display = tk.Label(
-            content,
-            text="Your 12 chibi stickers will appear here ✨",
-            font=('Arial', 12),
-            fg='#95a5a6',
-            bg=self.colors['bg_secondary']
-        )
-        self.result_display.pack(expand=True, pady=20)
+        # One cell per sticker, filled in as each sticker is rendered
+        self.preview_grid = tk.Frame(content, bg=self.colors['bg_secondary'])
+        self.preview_grid.pack(expand=True)
+        self.preview_cells = []
+        for i in range(len(sticker_renderer.EXPRESSIONS)):
+            row, col = divmod(i, sticker_renderer.GRID_COLUMNS)
+            cell = tk.Label(self.preview_grid, text="⏳", bg=self.colors['bg_secondary'], fg='#95a5a6')
+            cell.grid(row=row, column=col, padx=2, pady=2)
+            self.preview_cells.append(cell)
         
         # Action buttons
         button_frame = tk.Frame(content, bg=self.colors['bg_secondary'])
@@ -367,11 +395,18 @@ class ChibiStickerGenerator:
             return
             
         try:
-            genai.configure(api_key=api_key)
-            model = genai.GenerativeModel('gemini-1.5-flash')
-            response = model.generate_content("Hello, testing API connection.")
-            
-            if response and response.text:
+            # Runs on the client's worker pool so the window stays responsive
+            future = gemini_client.get_client(api_key).test_connection()
+        except Exception as e:
+            self.api_status.config(text="❌ API error - check your key", fg=self.colors['accent'])
+            return
+        self.api_status.config(text="⏳ Testing API key...", fg=self.colors['warning'])
+        future.add_done_callback(lambda f: self.root.after(0, lambda: self._api_test_done(api_key, f)))
+        
+    def _api_test_done(self, api_key, future):
+        """Show the API test result (main thread)"""
+        try:
+            if future.result():
                 self.api_key = api_key
                 self.api_status.config(text="✅ API key verified successfully!", fg=self.colors['success'])
                 self.update_generate_button()
@@ -395,11 +430,11 @@ class ChibiStickerGenerator:
             if not file_path:
                 return
                 
-            # Load image
-            image = Image.open(file_path)
-            if image.mode != 'RGB':
-                image = image.convert('RGB')
+            # Load image, decoded straight to a bounded working size
+            photo = photo_ingest.ingest(file_path)
+            image = photo.image
                 
+            self.uploaded_photo = photo
             self.uploaded_image = image
             
             # Create preview
@@ -432,6 +467,9 @@ class ChibiStickerGenerator:
             messagebox.showwarning("Warning", "Please set up API key and upload an image first!")
             return
             
+        # Clear old previews before the thread can queue new ones
+        self._clear_previews()
+        
         # Start generation in thread
         thread = threading.Thread(target=self._generate_thread)
         thread.daemon = True
@@ -443,13 +481,21 @@ class ChibiStickerGenerator:
             # Update UI
             self.root.after(0, self._start_generation)
             
-            # Prepare image for API
-            buffered = io.BytesIO()
-            self.uploaded_image.save(buffered, format="JPEG", quality=85)
-            img_base64 = base64.b64encode(buffered.getvalue()).decode()
+            # Same photo as before (or the same pixels): reuse the stored sheet,
+            # skipping the AI call and the rendering
+            store = sticker_store.get_store()
+            stickers = store.find(self.uploaded_image, source_hash=self.uploaded_photo.content_hash)
+            if stickers is not None:
+                sticker_store.replay(stickers, self._post_progress)
+                self.generated_stickers = stickers
+                self.root.after(0, lambda: self._finish_generation(stickers, cached=True))
+                return
+            
+            # Prepare image for API (cached by the photo's content hash)
+            image_bytes = photo_ingest.derived_jpeg(self.uploaded_photo)
             
-            # Configure API
-            genai.configure(api_key=self.api_key)
+            # Shared client: configured once, cached by prompt + image hash
+            client = gemini_client.get_client(self.api_key)
             
             # Update progress
             self.root.after(0, lambda: self.progress_var.set(30))
@@ -481,17 +527,14 @@ Style requirements:
 - Each sticker should be circular or rounded square
 - Maintain the same character design across all expressions"""
 
-            # Generate with Gemini
-            model = genai.GenerativeModel('gemini-1.5-flash')
-            response = model.generate_content(prompt)
+            # Generate with Gemini (retries with backoff; repeats come from the cache)
+            response_text = client.generate(prompt, image_bytes)
             
-            self.root.after(0, lambda: self.progress_var.set(60))
+            self.root.after(0, lambda: self.progress_var.set(self.RENDER_PROGRESS_START))
             self.root.after(0, lambda: self.status_label.config(text="🎨 Creating your chibi stickers..."))
             
-            # Create actual stickers
-            stickers = self._create_chibi_stickers()
-            
-            self.root.after(0, lambda: self.progress_var.set(100))
+            # Create actual stickers; the pipeline reports each stage as it happens
+            stickers = self._create_chibi_stickers(progress=self._post_progress)
             
             if stickers:
                 self.generated_stickers = stickers
@@ -502,168 +545,102 @@ Style requirements:
         except Exception as e:
             self.root.after(0, lambda: self._generation_error(str(e)))
             
-    def _create_chibi_stickers(self):
+    def _post_progress(self, event):
+        """Pipeline progress callback (worker thread): hand the event to the Tk thread"""
+        image = event.pop('image', None)
+        preview = None
+        if image is not None:
+            # Resize here, off the Tk thread; only the PhotoImage is made there
+            size = self.PREVIEW_CELL_SIZE
+            preview = image.resize((size, size), Image.Resampling.LANCZOS)
+        self.preview_queue.put((event, preview))
+        
+    def _poll_previews(self):
+        """Drain the preview queue and reschedule while generating"""
+        self.preview_after_id = None
+        self._drain_previews()
+        if self.preview_polling:
+            self.preview_after_id = self.root.after(self.PREVIEW_POLL_MS, self._poll_previews)
+            
+    def _drain_previews(self):
+        """Show queued progress events and stickers (Tk thread)"""
+        while True:
+            try:
+                event, preview = self.preview_queue.get_nowait()
+            except queue.Empty:
+                return
+            self._show_progress(event)
+            if preview is not None:
+                # Tk objects may only be created on the Tk thread
+                photo = ImageTk.PhotoImage(preview)
+                cell = self.preview_cells[event['index']]
+                cell.config(image=photo, text="")
+                cell.image = photo
+                
+    def _clear_previews(self):
+        """Empty the sticker cells and any queued previews"""
+        while not self.preview_queue.empty():
+            self.preview_queue.get_nowait()
+        for cell in self.preview_cells:
+            cell.config(image="", text="⏳")
+            cell.image = None
+            
+    def _show_progress(self, event):
+        """Show a pipeline progress event"""
+        span = 100 - self.RENDER_PROGRESS_START
+        self.progress_var.set(self.RENDER_PROGRESS_START + span * event['progress'])
+        if event['stage'] == 'enhance':
+            self.status_label.config(text="🎨 Enhancing your photo...")
+        elif event['stage'] == 'sticker':
+            self.status_label.config(
+                text=f"🎨 Sticker {event['index'] + 1}/{event['total']}: {event['expression']}"
+            )
+            
+    def _create_chibi_stickers(self, progress=None):
         """Create the actual chibi sticker grid"""
         try:
             if not self.uploaded_image:
                 return None
-                
-            # Sticker dimensions
-            sticker_size = 150
-            padding = 10
-            grid_width = 3 * (sticker_size + padding) - padding
-            grid_height = 4 * (sticker_size + padding) - padding
-            
-            # Create canvas
-            canvas = Image.new('RGB', (grid_width, grid_height), (255, 255, 255))
-            
-            # Expression types
-            expressions = [
-                ("Happy", "😄"), ("Angry", "😠"), ("Sad", "😢"),
-                ("Sulking", "😤"), ("Thinking", "🤔"), ("Sleepy", "😴"),
-                ("Kiss", "😘"), ("Winking", "😉"), ("Surprised", "😲"),
-                ("Love", "😍"), ("Cool", "😎"), ("Embarrassed", "😳")
-            ]
-            
-            # Create each sticker
-            for i in range(12):
-                row = i // 3
-                col = i % 3
-                
-                # Create individual chibi sticker
-                sticker = self._create_single_chibi(expressions[i])
-                
-                if sticker:
-                    x = col * (sticker_size + padding)
-                    y = row * (sticker_size + padding)
-                    canvas.paste(sticker, (x, y))
-            
-            return canvas
+            # Kept in the shared sticker store, so the sheet survives without saving it
+            store = sticker_store.get_store()
+            return store.render(self.uploaded_image, progress=progress,
+                                source_hash=self.uploaded_photo.content_hash).sheet
             
         except Exception as e:
             print(f"Error creating stickers: {e}")
             return None
             
-    def _create_single_chibi(self, expression_info):
-        """Create a single chibi sticker"""
-        try:
-            expression_name, emoji = expression_info
-            
-            # Process original image
-            base_img = self.uploaded_image.copy()
-            base_img = base_img.resize((120, 120), Image.Resampling.LANCZOS)
-            
-            # Create chibi-style enhancements
-            enhancer = ImageEnhance.Color(base_img)
-            base_img = enhancer.enhance(1.3)  # More vibrant
-            
-            enhancer = ImageEnhance.Contrast(base_img)
-            base_img = enhancer.enhance(1.2)  # Better contrast
-            
-            enhancer = ImageEnhance.Brightness(base_img)
-            base_img = enhancer.enhance(1.1)  # Slightly brighter
-            
-            # Apply cartoon effect
-            base_img = base_img.filter(ImageFilter.SMOOTH_MORE)
-            
-            # Create circular mask
-            mask = Image.new('L', (120, 120), 0)
-            draw = ImageDraw.Draw(mask)
-            draw.ellipse((0, 0, 120, 120), fill=255)
-            
-            # Create final sticker
-            sticker = Image.new('RGB', (150, 150), (255, 255, 255))
-            
-            # Apply circular crop
-            circular_img = Image.new('RGBA', (120, 120), (255, 255, 255, 0))
-            circular_img.paste(base_img, (0, 0))
-            circular_img.putalpha(mask)
-            
-            # Convert back to RGB for pasting
-            final_circular = Image.new('RGB', (120, 120), (255, 255, 255))
-            final_circular.paste(circular_img, (0, 0), circular_img)
-            
-            # Center on sticker
-            sticker.paste(final_circular, (15, 15))
-            
-            # Add expression effects
-            self._add_expression_overlay(sticker, expression_name, emoji)
-            
-            return sticker
-            
-        except Exception as e:
-            print(f"Error creating single chibi: {e}")
-            return None
-            
-    def _add_expression_overlay(self, sticker, expression, emoji):
-        """Add expression-specific overlays"""
-        try:
-            draw = ImageDraw.Draw(sticker)
-            
-            # Add expression indicator
-            if expression == "Happy":
-                # Add smile arc
-                draw.arc([50, 80, 100, 110], 0, 180, fill="gold", width=3)
-            elif expression == "Angry":
-                # Add angry eyebrows
-                draw.line([40, 50, 55, 45], fill="red", width=3)
-                draw.line([95, 45, 110, 50], fill="red", width=3)
-            elif expression == "Love":
-                # Add heart
-                self._draw_heart(draw, 120, 40, "pink")
-            elif expression == "Cool":
-                # Add sunglasses
-                draw.rectangle([45, 60, 65, 70], fill="black")
-                draw.rectangle([85, 60, 105, 70], fill="black")
-                draw.line([65, 65, 85, 65], fill="black", width=2)
-            
-            # Add emoji and label at bottom
-            try:
-                draw.text((5, 135), f"{emoji} {expression}", fill="navy")
-            except:
-                draw.text((5, 135), expression, fill="navy")
-                
-        except Exception as e:
-            print(f"Error adding overlay: {e}")
-            
-    def _draw_heart(self, draw, x, y, color):
-        """Draw a small heart"""
-        try:
-            size = 8
-            # Simple heart shape
-            draw.ellipse([x-size//2, y-size//4, x, y+size//4], fill=color)
-            draw.ellipse([x, y-size//4, x+size//2, y+size//4], fill=color)
-            draw.polygon([x-size//4, y+size//4, x, y+size//2, x+size//4, y+size//4], fill=color)
-        except:
-            pass
-            
     def _start_generation(self):
         """Start generation UI updates"""
         self.generate_btn.config(state='disabled', text="🎨 Generating...")
         self.progress_var.set(10)
         self.status_label.config(text="🚀 Starting generation...")
         
-    def _finish_generation(self, stickers):
+        # Show the result panel now; stickers appear in it one by one
+        self.result_frame.pack(fill='x', pady=(0, 0))
+        self.preview_polling = True
+        if self.preview_after_id is None:
+            self._poll_previews()
+        
+    def _finish_generation(self, stickers, cached=False):
         """Finish generation"""
+        # Show any stickers still queued; the grid then holds the whole sheet
+        self.preview_polling = False
+        self._drain_previews()
         self.progress_var.set(100)
-        self.status_label.config(text="✅ Chibi stickers created successfully!")
-        
-        # Display result
-        display_img = stickers.copy()
-        display_img.thumbnail((400, 500), Image.Resampling.LANCZOS)
-        photo = ImageTk.PhotoImage(display_img)
-        
-        self.result_display.config(image=photo, text="")
-        self.result_display.image = photo
-        
-        # Show result frame
-        self.result_frame.pack(fill='x', pady=(0, 0))
+        if cached:
+            self.status_label.config(text="✅ Same photo as before - stickers loaded instantly!")
+        else:
+            self.status_label.config(text="✅ Chibi stickers created successfully!")
         
         # Reset button
         self.generate_btn.config(state='normal', text="🚀 Generate 12 Chibi Stickers")
         
     def _generation_error(self, error):
         """Handle generation error"""
+        self.preview_polling = False
+        self._clear_previews()
+        self.result_frame.pack_forget()
         self.progress_var.set(0)
         self.status_label.config(text=f"❌ Error: {error}")
         self.generate_btn.config(state='normal', text="🚀 Generate 12 Chibi Stickers")
@@ -679,19 +656,48 @@ Style requirements:
         file_path = filedialog.asksaveasfilename(
             defaultextension=".png",
             initialvalue=f"chibi_stickers_{timestamp}.png",
-            filetypes=[("PNG files", "*.png"), ("JPEG files", "*.jpg")]
+            filetypes=[("PNG files", "*.png"), ("JPEG files", "*.jpg"),
+                       ("Sticker pack (PNG + WebP, 64/128/512 px)", "*.zip"),
+                       ("Animated GIF", "*.gif"), ("Animated WebP", "*.webp")]
         )
         
-        if file_path:
+        if file_path and file_path.lower().endswith('.zip'):
+            # Dozens of encodes: run them off the Tk thread
+            self.status_label.config(text="📦 Exporting sticker pack...")
+            thread = threading.Thread(target=self._export_pack_thread, args=(self.generated_stickers, file_path))
+            thread.daemon = True
+            thread.start()
+        elif file_path and file_path.lower().endswith(('.gif', '.webp')):
+            try:
+                fmt = 'webp' if file_path.lower().endswith('.webp') else 'gif'
+                with open(file_path, 'wb') as f:
+                    f.write(sticker_animate.animate_sheet(self.generated_stickers, fmt, tween=4))
+                messagebox.showinfo("Success", f"Animated stickers saved to:\n{file_path}")
+            except Exception as e:
+                messagebox.showerror("Error", f"Failed to save: {str(e)}")
+        elif file_path:
             try:
                 self.generated_stickers.save(file_path, quality=95)
                 messagebox.showinfo("Success", f"Stickers saved to:\n{file_path}")
             except Exception as e:
                 messagebox.showerror("Error", f"Failed to save: {str(e)}")
                 
+    def _export_pack_thread(self, sheet, file_path):
+        """Write the ZIP sticker pack in background"""
+        try:
+            sticker_export.write_export_zip(sheet, file_path)
+            self.root.after(0, lambda: self.status_label.config(text="✅ Sticker pack exported!"))
+            self.root.after(0, lambda: messagebox.showinfo("Success", f"Sticker pack saved to:\n{file_path}"))
+        except Exception as e:
+            # `e` is unbound once the except block ends, so the callbacks get the message instead
+            message = str(e)
+            self.root.after(0, lambda: self.status_label.config(text=f"❌ Export failed: {message}"))
+            self.root.after(0, lambda: messagebox.showerror("Error", f"Failed to export: {message}"))
+                
     def reset_app(self):
         """Reset the application"""
         self.uploaded_image = None
+        self.uploaded_photo = None
         self.generated_stickers = None
         
         self.upload_icon.config(image="", text="📷\nClick to upload image")
@@ -702,34 +708,32 @@ Style requirements:
         self.generate_btn.config(state='disabled', text="🚀 Generate 12 Chibi Stickers")
         
         # Hide result frame
+        self._clear_previews()
         self.result_frame.pack_forget()
 
     def load_emojis(self):
-        """Load emoji images from emoji_dir"""
-        emojis = {}
-        if os.path.exists(self.emoji_dir):
-            for fname in os.listdir(self.emoji_dir):
-                if fname.lower().endswith(('.png', '.jpg', '.jpeg', '.webp')):
-                    path = os.path.join(self.emoji_dir, fname)
-                    try:
-                        img = Image.open(path)
-                        emojis[fname] = img
-                    except Exception as e:
-                        print(f"Error loading emoji {fname}: {e}")
-        return emojis
+        """Index emoji images in emoji_dir; each one is decoded on first use"""
+        try:
+            return AssetLibrary(self.emoji_dir, EMOJI_EXTENSIONS)
+        except Exception as e:
+            print(f"Error indexing emojis: {e}")
+            return {}
 
     def load_gifs(self):
-        """Load GIFs from gif_dir"""
-        gifs = {}
-        if os.path.exists(self.gif_dir):
-            for fname in os.listdir(self.gif_dir):
-                if fname.lower().endswith('.gif'):
-                    path = os.path.join(self.gif_dir, fname)
-                    try:
-                        gifs[fname] = path
-                    except Exception as e:
-                        print(f"Error loading gif {fname}: {e}")
-        return gifs
+        """Index GIF paths in gif_dir"""
+        try:
+            return AssetLibrary(self.gif_dir, GIF_EXTENSIONS, decode=False)
+        except Exception as e:
+            print(f"Error indexing gifs: {e}")
+            return {}
+
+    def index_gifs(self):
+        """Start reading GIF metadata and poster thumbnails in the background"""
+        if not isinstance(self.loaded_gifs, AssetLibrary):
+            return None
+        gif_index = GifIndex(self.loaded_gifs)
+        gif_index.start()
+        return gif_index
 
 def main():
     """Run the application"""
@@ -0,0 +1,216 @@
+"""Shared Gemini client for the sticker generator.
+
+* The model is configured once per API key and reused.
+* Calls run on a small worker pool, so the Tk main thread never blocks:
+  submit() returns a Future straight away.
+* Each attempt has a timeout; rate-limit, timeout and server errors are
+  retried with exponential backoff plus jitter.
+* Identical requests that are already in flight share one Future.
+* Responses are cached on disk keyed by model, prompt and the sha256 of the
+  input image, so regenerating for the same photo costs no latency or quota.
+
+Set EMOJIE_GEMINI_STUB=1 (or pass backend=StubBackend()) to run offline.
+
+    client = get_client(api_key)
+    future = client.submit(prompt, image_bytes)
+    text = future.result()
+"""
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from asset_library import default_cache_dir, write_json_atomic
+
+DEFAULT_MODEL = 'gemini-1.5-flash'
+DEFAULT_TIMEOUT = 60
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 1.0
+MAX_BACKOFF = 30.0
+TEST_PROMPT = "Hello, testing API connection."
+CACHE_VERSION = 1
+
+# google.api_core exception names worth another try
+RETRYABLE_ERRORS = {
+    'ResourceExhausted', 'TooManyRequests', 'ServiceUnavailable', 'DeadlineExceeded',
+    'InternalServerError', 'GatewayTimeout', 'BadGateway', 'Aborted', 'RetryError',
+}
+
+
+def is_retryable(error):
+    return isinstance(error, (TimeoutError, ConnectionError)) or type(error).__name__ in RETRYABLE_ERRORS
+
+
+def request_key(model, prompt, image_bytes=None):
+    """Cache/dedupe key for one request"""
+    image_hash = hashlib.sha256(image_bytes).hexdigest() if image_bytes else ''
+    return hashlib.sha256(f'{model}\0{prompt}\0{image_hash}'.encode('utf-8')).hexdigest()
+
+
+class GeminiBackend:
+    """google-generativeai, configured once per key"""
+
+    def __init__(self, api_key):
+        import google.generativeai as genai
+        self._genai = genai
+        self._models = {}
+        self._lock = threading.Lock()
+        genai.configure(api_key=api_key)
+
+    def _model(self, name):
+        with self._lock:
+            model = self._models.get(name)
+            if model is None:
+                model = self._models[name] = self._genai.GenerativeModel(name)
+            return model
+
+    def generate(self, model, prompt, image_bytes=None, timeout=DEFAULT_TIMEOUT):
+        contents = [prompt, {'mime_type': 'image/jpeg', 'data': image_bytes}] if image_bytes else prompt
+        response = self._model(model).generate_content(contents, request_options={'timeout': timeout})
+        return response.text
+
+
+class StubBackend:
+    """Offline stand-in: canned answers, optional latency and injected failures"""
+
+    def __init__(self, latency=0.0, failures=0, error=TimeoutError):
+        self.latency = latency
+        self.failures = failures
+        self.error = error
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def generate(self, model, prompt, image_bytes=None, timeout=DEFAULT_TIMEOUT):
+        with self._lock:
+            self.calls += 1
+            fail = self.failures > 0
+            if fail:
+                self.failures -= 1
+        if self.latency:
+            time.sleep(min(self.latency, timeout))
+        if fail:
+            raise self.error('stub failure')
+        digest = hashlib.sha256(image_bytes or b'').hexdigest()[:12]
+        return f'[stub {model}] {len(prompt)} char prompt, image {digest}'
+
+
+class GeminiClient:
+    def __init__(self, api_key=None, backend=None, model=DEFAULT_MODEL, cache_dir=None,
+                 timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF, max_workers=2):
+        if backend is None:
+            backend = StubBackend() if os.environ.get('EMOJIE_GEMINI_STUB') else GeminiBackend(api_key)
+        self.backend = backend
+        self.model = model
+        self.cache_dir = os.path.join(cache_dir or default_cache_dir(), 'gemini')
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.stats = {'calls': 0, 'cache_hits': 0, 'deduped': 0, 'retries': 0}
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='gemini')
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    # --- disk cache ------------------------------------------------------
+
+    def _cache_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f'{key}.json')
+
+    def cached(self, prompt, image_bytes=None):
+        """Cached response text for a request, or None"""
+        return self._read_cache(request_key(self.model, prompt, image_bytes))
+
+    def _read_cache(self, key):
+        try:
+            with open(self._cache_path(key), 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return data['text'] if data.get('version') == CACHE_VERSION else None
+
+    def _write_cache(self, key, text):
+        path = self._cache_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        write_json_atomic(path, {'version': CACHE_VERSION, 'model': self.model, 'text': text,
+                                 'created': time.time()})
+
+    # --- requests --------------------------------------------------------
+
+    def submit(self, prompt, image_bytes=None, use_cache=True):
+        """Start a request on the worker pool and return its Future (never blocks)"""
+        key = request_key(self.model, prompt, image_bytes)
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is not None:
+                self.stats['deduped'] += 1
+                return future
+            future = self._executor.submit(self._call, key, prompt, image_bytes, use_cache)
+            self._in_flight[key] = future
+        future.add_done_callback(lambda done: self._forget(key, done))
+        return future
+
+    def _forget(self, key, future):
+        with self._lock:
+            if self._in_flight.get(key) is future:
+                del self._in_flight[key]
+
+    def generate(self, prompt, image_bytes=None, use_cache=True):
+        """Blocking convenience wrapper around submit() (for worker threads)"""
+        return self.submit(prompt, image_bytes, use_cache).result()
+
+    def test_connection(self):
+        """Future resolving to True if the key works; never served from cache"""
+        future = Future()
+
+        def done(inner):
+            error = inner.exception()
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(bool(inner.result()))
+        self.submit(TEST_PROMPT, use_cache=False).add_done_callback(done)
+        return future
+
+    def _call(self, key, prompt, image_bytes, use_cache):
+        if use_cache:
+            text = self._read_cache(key)
+            if text is not None:
+                with self._lock:
+                    self.stats['cache_hits'] += 1
+                return text
+        attempt = 0
+        while True:
+            with self._lock:
+                self.stats['calls'] += 1
+            try:
+                text = self.backend.generate(self.model, prompt, image_bytes, self.timeout)
+                break
+            except Exception as e:
+                if attempt >= self.retries or not is_retryable(e):
+                    raise
+            delay = min(MAX_BACKOFF, self.backoff * 2 ** attempt) * random.uniform(0.5, 1.0)
+            attempt += 1
+            with self._lock:
+                self.stats['retries'] += 1
+            time.sleep(delay)
+        if use_cache and text:
+            self._write_cache(key, text)
+        return text
+
+    def shutdown(self, wait=False):
+        self._executor.shutdown(wait=wait)
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(api_key, **kwargs):
+    """One shared client (and configured model) per API key"""
+    with _clients_lock:
+        client = _clients.get(api_key)
+        if client is None:
+            client = _clients[api_key] = GeminiClient(api_key, **kwargs)
+        return client
@@ -0,0 +1,253 @@
+"""Metadata and poster thumbnails for the GIF library, without decoding frames.
+
+read_gif_info() walks the GIF block structure (descriptors, extensions and
+the length-prefixed data sub-blocks) and skips over the compressed image
+data, so frame count, total duration, size and loop count come out without
+any LZW decoding. The poster thumbnail is the first frame only.
+
+GifIndex persists the results next to the AssetLibrary index and only
+re-reads files whose size or mtime changed, so gallery listings are served
+straight from the index:
+
+    gifs = GifIndex(AssetLibrary('assests/gifs', GIF_EXTENSIONS, decode=False))
+    gifs.start()                 # index in a background thread
+    for item in gifs.listing():  # name, width, height, frames, duration_ms, loop, thumb
+        ...
+"""
+import argparse
+import json
+import os
+import struct
+import threading
+
+from asset_library import AssetLibrary, GIF_EXTENSIONS, write_json_atomic
+
+GIF_INDEX_VERSION = 1
+DEFAULT_POSTER_SIZE = (128, 128)
+# Browsers play frames with a delay below 2/100 s at 10/100 s
+MIN_FRAME_DELAY = 2
+DEFAULT_FRAME_DELAY = 10
+# Save progress every this many newly indexed files
+SAVE_EVERY = 50
+
+
+def _skip_sub_blocks(f):
+    while True:
+        size = f.read(1)
+        if not size:
+            raise ValueError('truncated GIF data')
+        if size[0] == 0:
+            return
+        f.seek(size[0], os.SEEK_CUR)
+
+
+def read_gif_info(path):
+    """Width, height, frame count, duration (ms) and loop count of a GIF.
+
+    `loop` is 0 for "forever", N for N extra plays, or None when the file
+    has no NETSCAPE loop extension (it plays once).
+    """
+    with open(path, 'rb') as f:
+        header = f.read(13)
+        if len(header) < 13 or header[:6] not in (b'GIF87a', b'GIF89a'):
+            raise ValueError('not a GIF file')
+        width, height, flags = struct.unpack('<HHB', header[6:11])
+        if flags & 0x80:
+            f.seek(3 << ((flags & 0x07) + 1), os.SEEK_CUR)
+        frames = 0
+        duration = 0
+        delay = None
+        loop = None
+        while True:
+            block = f.read(1)
+            if not block or block == b'\x3b':
+                # A missing trailer is common; count what was there
+                break
+            if block == b'\x21':
+                label = f.read(1)
+                if label == b'\xf9':
+                    data = f.read(6)
+                    if len(data) < 6:
+                        raise ValueError('truncated graphic control extension')
+                    delay = struct.unpack('<H', data[2:4])[0]
+                    if data[5] != 0:
+                        _skip_sub_blocks(f)
+                elif label == b'\xff':
+                    size = f.read(1)
+                    app = f.read(size[0]) if size else b''
+                    if app[:11] in (b'NETSCAPE2.0', b'ANIMEXTS1.0'):
+                        size = f.read(1)
+                        data = f.read(size[0]) if size else b''
+                        if len(data) >= 3 and data[0] == 1:
+                            loop = struct.unpack('<H', data[1:3])[0]
+                    _skip_sub_blocks(f)
+                else:
+                    _skip_sub_blocks(f)
+            elif block == b'\x2c':
+                descriptor = f.read(9)
+                if len(descriptor) < 9:
+                    raise ValueError('truncated image descriptor')
+                if descriptor[8] & 0x80:
+                    f.seek(3 << ((descriptor[8] & 0x07) + 1), os.SEEK_CUR)
+                f.seek(1, os.SEEK_CUR)  # LZW minimum code size
+                _skip_sub_blocks(f)
+                frames += 1
+                if delay is None or delay < MIN_FRAME_DELAY:
+                    delay = DEFAULT_FRAME_DELAY
+                duration += delay * 10
+                delay = None
+            else:
+                raise ValueError(f'unexpected block 0x{block[0]:02x}')
+    if not frames:
+        raise ValueError('GIF has no frames')
+    return {
+        'width': width,
+        'height': height,
+        'frames': frames,
+        'duration_ms': duration if frames > 1 else 0,
+        'loop': loop,
+    }
+
+
+class GifIndex:
+    """Persisted GIF metadata + poster thumbnails, updated incrementally"""
+
+    def __init__(self, library, poster_size=DEFAULT_POSTER_SIZE):
+        self.library = library
+        self.poster_size = tuple(poster_size)
+        self.index_path = library.index_path.replace('index_', 'gifs_', 1)
+        self.entries = {}
+        self.ready = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._load()
+
+    @property
+    def directory(self):
+        return self.library.directory
+
+    def _load(self):
+        try:
+            with open(self.index_path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if (data.get('version') == GIF_INDEX_VERSION and data.get('directory') == self.directory
+                and data.get('poster_size') == list(self.poster_size)):
+            self.entries = data['entries']
+
+    def save(self):
+        with self._lock:
+            entries = dict(self.entries)
+        write_json_atomic(self.index_path, {
+            'version': GIF_INDEX_VERSION,
+            'directory': self.directory,
+            'poster_size': list(self.poster_size),
+            'entries': entries,
+        })
+
+    def update(self, progress=None):
+        """Index new or changed GIFs and drop deleted ones; returns how many were (re)read"""
+        library = self.library
+        library.refresh(force=True)
+        with self._lock:
+            stale = [name for name in self.entries if name not in library]
+            for name in stale:
+                del self.entries[name]
+        todo = [name for name in library if not self._is_current(name)]
+        for done, name in enumerate(todo, 1):
+            entry = self._index_one(name)
+            with self._lock:
+                self.entries[name] = entry
+            if progress:
+                progress(done, len(todo), name)
+            if done % SAVE_EVERY == 0:
+                self.save()
+                library.save_index()
+        if todo or stale:
+            self.save()
+        library.save_index()
+        self.ready.set()
+        return len(todo)
+
+    def _is_current(self, name):
+        entry = self.entries.get(name)
+        info = self.library.entries[name]
+        return entry is not None and entry['size'] == info['size'] and entry['mtime'] == info['mtime']
+
+    def _index_one(self, name):
+        info = self.library.entries[name]
+        entry = {'size': info['size'], 'mtime': info['mtime']}
+        try:
+            entry.update(read_gif_info(self.library.path(name)))
+            entry['sha256'] = self.library.content_hash(name)
+            # First frame only: opening a GIF doesn't decode the later frames
+            self.library.thumbnail(name, self.poster_size)
+        except (OSError, ValueError) as e:
+            # Remembered until the file changes, so a broken GIF isn't retried
+            entry['error'] = str(e)
+        return entry
+
+    def start(self):
+        """Run update() in a daemon thread (once at a time); returns the thread"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self.ready.clear()
+                self._thread = threading.Thread(target=self._run, name='gif-indexer', daemon=True)
+                self._thread.start()
+            return self._thread
+
+    def _run(self):
+        try:
+            self.update()
+        except Exception as e:
+            print(f"Error indexing gifs: {e}")
+            self.ready.set()
+
+    def wait(self, timeout=None):
+        return self.ready.wait(timeout)
+
+    def get(self, name):
+        """Metadata for one GIF (None if not indexed yet)"""
+        with self._lock:
+            entry = self.entries.get(name)
+        if entry is None or 'error' in entry:
+            return None
+        item = dict(entry, name=name)
+        item['thumb'] = os.path.join(self.library.thumb_dir,
+                                     f"{entry['sha256']}_{self.poster_size[0]}x{self.poster_size[1]}.png")
+        return item
+
+    def listing(self):
+        """Metadata for every indexed GIF, sorted by name"""
+        with self._lock:
+            names = sorted(self.entries)
+        return [item for item in map(self.get, names) if item is not None]
+
+    def errors(self):
+        with self._lock:
+            return {name: entry['error'] for name, entry in self.entries.items() if 'error' in entry}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Index GIF metadata and poster thumbnails')
+    parser.add_argument('directory', nargs='?',
+                        default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'assests', 'gifs'))
+    parser.add_argument('--size', type=int, default=DEFAULT_POSTER_SIZE[0], help='Poster thumbnail size')
+    parser.add_argument('-q', '--quiet', action='store_true', help='Only print the summary')
+    args = parser.parse_args(argv)
+
+    index = GifIndex(AssetLibrary(args.directory, GIF_EXTENSIONS, decode=False), (args.size, args.size))
+    updated = index.update()
+    if not args.quiet:
+        for item in index.listing():
+            loop = 'forever' if item['loop'] == 0 else item['loop']
+            print(f"{item['name']:40} {item['width']:4}x{item['height']:<4} {item['frames']:4} frames "
+                  f"{item['duration_ms'] / 1000:6.2f}s  loop {loop}")
+    for name, error in sorted(index.errors().items()):
+        print(f'{name}: {error}')
+    print(f'{len(index.listing())} GIFs indexed ({updated} read this run, {len(index.errors())} unreadable)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""Reduced-resolution ingest for uploaded photos.
+
+Stickers only ever use a 120px crop and the preview is 100px, so there is
+no point decoding a 48-megapixel phone photo at full size. ingest() keeps a
+bounded proxy instead:
+
+* JPEGs are decoded with draft(), which makes libjpeg scale by 1/2, 1/4 or
+  1/8 while decoding (less work and memory than a full decode).
+* Anything still larger is shrunk with reduce(), a fast integer box
+  filter, and only the last step uses a LANCZOS resize.
+
+Encodings derived from the proxy (the JPEG sent to Gemini) are cached on
+disk by the source file's content hash, so re-uploading the same photo
+skips the encode.
+
+    photo = ingest('IMG_0001.jpg')
+    photo.image            # RGB proxy, at most PROXY_SIZE on each side
+    jpeg = derived_jpeg(photo)
+"""
+import argparse
+import io
+import os
+import time
+from collections import namedtuple
+
+from PIL import Image
+
+from asset_library import default_cache_dir, file_sha256
+
+# Longest side of the kept proxy image
+PROXY_SIZE = 1024
+DERIVED_QUALITY = 85
+
+Photo = namedtuple('Photo', ['image', 'content_hash', 'original_size', 'path'])
+
+
+def open_proxy(path, max_size=PROXY_SIZE):
+    """Decode an image straight to at most max_size x max_size (RGB)"""
+    with open(path, 'rb') as f:
+        image = Image.open(f)
+        original_size = image.size
+        if max_size:
+            # JPEG only: pick a DCT scale that still covers max_size
+            image.draft('RGB', (max_size, max_size))
+        image.load()
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    if max_size and max(image.size) > max_size:
+        factor = max(image.size) // max_size
+        if factor >= 2:
+            image = image.reduce(factor)
+        if max(image.size) > max_size:
+            scale = max_size / max(image.size)
+            size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+            image = image.resize(size, Image.Resampling.LANCZOS)
+    return image, original_size
+
+
+def ingest(path, max_size=PROXY_SIZE):
+    """Hash and decode an uploaded photo into a bounded Photo proxy"""
+    image, original_size = open_proxy(path, max_size)
+    return Photo(image, file_sha256(path), original_size, path)
+
+
+def derived_path(content_hash, kind):
+    return os.path.join(default_cache_dir(), 'derived', content_hash[:2], f'{content_hash}_{kind}')
+
+
+def derived_jpeg(photo, quality=DERIVED_QUALITY):
+    """JPEG bytes of the proxy, cached by the source's content hash"""
+    path = derived_path(photo.content_hash, f'{max(photo.image.size)}_q{quality}.jpg')
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except OSError:
+        pass
+    buffered = io.BytesIO()
+    photo.image.save(buffered, format='JPEG', quality=quality)
+    data = buffered.getvalue()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    return data
+
+
+def _timed(load):
+    started = time.perf_counter()
+    image = load()
+    return image, time.perf_counter() - started
+
+
+def decode_size(path, max_size=PROXY_SIZE):
+    """Size the decoder will produce for open_proxy(), without decoding"""
+    with Image.open(path) as image:
+        image.draft('RGB', (max_size, max_size))
+        return image.size
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare full and reduced-resolution photo decoding')
+    parser.add_argument('photos', nargs='+')
+    parser.add_argument('--size', type=int, default=PROXY_SIZE, help='Proxy longest side')
+    args = parser.parse_args(argv)
+
+    for path in args.photos:
+        full, full_time = _timed(lambda: Image.open(path).convert('RGB'))
+        proxy, proxy_time = _timed(lambda: open_proxy(path, args.size)[0])
+        width, height = decode_size(path, args.size)
+        # Peak pixel buffers: the full decode vs the (drafted) decode the proxy starts from
+        print(f'{os.path.basename(path)} {full.width}x{full.height}: '
+              f'full {full_time * 1000:.0f} ms / {full.width * full.height * 3 / 2 ** 20:.0f} MB, '
+              f'proxy {proxy.width}x{proxy.height} {proxy_time * 1000:.0f} ms / '
+              f'{width * height * 3 / 2 ** 20:.1f} MB (x{full_time / proxy_time:.1f} faster)')
+
+
+if __name__ == '__main__':
+    main()
@@ -179,6 +179,14 @@ class EmojiGifWebsite {
         }, 1000);
     }
 
+    // Class of an emoji's sprite in atlas.css (built by atlas_builder.py from codepoint file names)
+    emojiSpriteClass(emoji) {
+        const codepoints = Array.from(emoji)
+            .filter(char => char !== '\ufe0f')
+            .map(char => char.codePointAt(0).toString(16));
+        return `emoji-${codepoints.join('-')}`;
+    }
+
     displayEmojis(emojis) {
         const emojiGrid = document.getElementById('emoji-grid');
         emojiGrid.innerHTML = '';
@@ -194,7 +202,7 @@ class EmojiGifWebsite {
             emojiItem.style.animationDelay = `${index * 0.1}s`;
             
             emojiItem.innerHTML = `
-                <span class="emoji">${emojiData.emoji}</span>
+                <span class="emoji emoji-sprite ${this.emojiSpriteClass(emojiData.emoji)}">${emojiData.emoji}</span>
                 <div class="name">${emojiData.name}</div>
                 <button class="download-btn" onclick="emojiWebsite.downloadEmoji('${emojiData.emoji}', '${emojiData.name}')">
                     Download
@@ -0,0 +1,212 @@
+"""Animated stickers: cycle (or cross-fade) through the 12 expressions.
+
+Letting Pillow save RGB frames as a GIF quantizes every frame on its own:
+each frame gets a different palette (written as a local colour table) and,
+because identical pixels map to different indices, almost every pixel
+"changes" between frames. Here instead:
+
+* one global palette is computed once from all frames (median cut over a
+  mosaic of the frames) and every frame is mapped onto it without
+  dithering, so unchanged pixels keep the same index;
+* each frame after the first is cropped to the bounding box of the pixels
+  that changed, and unchanged pixels inside that box are set to a reserved
+  transparent index (disposal "do not dispose"), which LZW compresses to
+  almost nothing.
+
+The frames are written with GifImagePlugin.getheader()/getdata(), which
+Pillow exports but does not document. If a Pillow release drops or changes
+them, the same frames go through the public save(save_all=True) writer
+instead: identical pixels, somewhat larger files.
+
+Animated WebP goes through libwebp's animation encoder, which already does
+sub-frame rectangles; frames can be fed palette-mapped for lossless output.
+
+    python sticker_animate.py sheet.png -o stickers.gif --tween 4
+    python sticker_animate.py sheet.png --bench
+"""
+import argparse
+import io
+import time
+
+from PIL import Image, ImageChops, GifImagePlugin
+
+import sticker_export
+
+HOLD_MS = 600
+TWEEN_MS = 60
+PALETTE_COLORS = 255
+TRANSPARENT_INDEX = 255  # never produced by the 255-colour quantization
+WEBP_QUALITY = 80
+
+
+def build_frames(stickers, tween=0, hold=HOLD_MS, tween_duration=TWEEN_MS):
+    """(frames, durations) cycling through the stickers, with `tween` cross-fade frames between each"""
+    frames = []
+    durations = []
+    for i, sticker in enumerate(stickers):
+        following = stickers[(i + 1) % len(stickers)]
+        frames.append(sticker)
+        durations.append(hold)
+        for step in range(1, tween + 1):
+            frames.append(Image.blend(sticker, following, step / (tween + 1)))
+            durations.append(tween_duration)
+    return frames, durations
+
+
+def global_palette(frames, colors=PALETTE_COLORS):
+    """One palette image for all frames, quantized once"""
+    width, height = frames[0].size
+    mosaic = Image.new('RGB', (width, height * len(frames)))
+    for i, frame in enumerate(frames):
+        mosaic.paste(frame, (0, height * i))
+    return mosaic.quantize(colors, method=Image.Quantize.MEDIANCUT)
+
+
+def quantize_frames(frames, palette):
+    # No dithering: the same colour must always get the same index
+    return [frame.quantize(palette=palette, dither=Image.Dither.NONE) for frame in frames]
+
+
+def _indices(frame):
+    # Palette indices as an L image (convert('L') would map through the palette)
+    return Image.frombytes('L', frame.size, frame.tobytes())
+
+
+def delta_frames(frames, durations):
+    """(image, offset, duration) per frame with only the changed region kept.
+
+    Frames identical to the previous one are dropped and their time added
+    to the previous frame.
+    """
+    out = [[frames[0], (0, 0), durations[0]]]
+    previous = _indices(frames[0])
+    for frame, duration in zip(frames[1:], durations[1:]):
+        current = _indices(frame)
+        changed = ImageChops.difference(previous, current).point(lambda v: 255 if v else 0)
+        bbox = changed.getbbox()
+        if bbox is None:
+            out[-1][2] += duration
+            continue
+        region = frame.crop(bbox)
+        # Unchanged pixels show through from the previous frame
+        region.paste(TRANSPARENT_INDEX, mask=ImageChops.invert(changed.crop(bbox)))
+        out.append([region, bbox[:2], duration])
+        previous = current
+    return out
+
+
+def _write_gif_blocks(first, regions, loop):
+    # Writes each region at its offset, exactly as delta_frames() cut it
+    header, _ = GifImagePlugin.getheader(first, None, {'loop': loop})
+    out = io.BytesIO()
+    for chunk in header:
+        out.write(chunk)
+    for region, offset, duration in regions:
+        for chunk in GifImagePlugin.getdata(region, offset, duration=duration, disposal=1,
+                                            transparency=TRANSPARENT_INDEX):
+            out.write(chunk)
+    out.write(b';')
+    return out.getvalue()
+
+
+def _save_gif(first, regions, loop):
+    # Public writer: each region is pasted onto a transparent full-size frame
+    frames = [regions[0][0]]
+    for region, offset, _ in regions[1:]:
+        frame = Image.new('P', first.size, TRANSPARENT_INDEX)
+        frame.putpalette(first.getpalette())
+        frame.paste(region, offset)
+        frames.append(frame)
+    out = io.BytesIO()
+    frames[0].save(out, format='GIF', save_all=True, append_images=frames[1:],
+                   duration=[duration for _, _, duration in regions], loop=loop, disposal=1,
+                   transparency=TRANSPARENT_INDEX, optimize=False)
+    return out.getvalue()
+
+
+def encode_gif(frames, durations, loop=0, palette=None):
+    """Animated GIF with one global palette and changed-region frames"""
+    palette = palette or global_palette(frames)
+    indexed = quantize_frames(frames, palette)
+    regions = delta_frames(indexed, durations)
+    if hasattr(GifImagePlugin, 'getheader') and hasattr(GifImagePlugin, 'getdata'):
+        try:
+            return _write_gif_blocks(indexed[0], regions, loop)
+        except TypeError:
+            pass  # their signatures changed
+    return _save_gif(indexed[0], regions, loop)
+
+
+def encode_webp(frames, durations, loop=0, lossless=False, quality=WEBP_QUALITY):
+    """Animated WebP; lossless output maps frames to the global palette first"""
+    if lossless:
+        frames = [frame.convert('RGB') for frame in quantize_frames(frames, global_palette(frames))]
+    out = io.BytesIO()
+    frames[0].save(out, format='WEBP', save_all=True, append_images=frames[1:], duration=durations,
+                   loop=loop, lossless=lossless, quality=100 if lossless else quality, minimize_size=True)
+    return out.getvalue()
+
+
+def encode_gif_naive(frames, durations, loop=0):
+    """Baseline: let Pillow quantize each RGB frame separately"""
+    out = io.BytesIO()
+    frames[0].save(out, format='GIF', save_all=True, append_images=frames[1:], duration=durations, loop=loop)
+    return out.getvalue()
+
+
+def animate_sheet(sheet, fmt='gif', tween=0):
+    """Animated sticker bytes for a sheet from create_chibi_stickers()"""
+    frames, durations = build_frames(sticker_export.split_sheet(sheet.convert('RGB')), tween)
+    if fmt == 'gif':
+        return encode_gif(frames, durations)
+    if fmt == 'webp':
+        return encode_webp(frames, durations)
+    raise ValueError(f'Unknown animation format: {fmt}')
+
+
+def benchmark(sheet, tweens=(0, 4), repeat=3):
+    stickers = sticker_export.split_sheet(sheet.convert('RGB'))
+    encoders = [
+        ('gif naive', encode_gif_naive),
+        ('gif global palette', encode_gif),
+        ('webp lossy', encode_webp),
+        ('webp lossless palette', lambda f, d: encode_webp(f, d, lossless=True)),
+    ]
+    results = []
+    for tween in tweens:
+        frames, durations = build_frames(stickers, tween)
+        for name, encoder in encoders:
+            best = float('inf')
+            for _ in range(repeat):
+                started = time.perf_counter()
+                data = encoder(frames, durations)
+                best = min(best, time.perf_counter() - started)
+            results.append({'tween': tween, 'frames': len(frames), 'encoder': name,
+                            'bytes': len(data), 'seconds': best})
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Animate a sticker sheet as GIF or WebP')
+    parser.add_argument('sheet', help='Sticker sheet image')
+    parser.add_argument('-o', '--output', help='Output .gif or .webp')
+    parser.add_argument('--tween', type=int, default=0, help='Cross-fade frames between expressions')
+    parser.add_argument('--bench', action='store_true', help='Compare against per-frame quantization')
+    args = parser.parse_args(argv)
+
+    with Image.open(args.sheet) as sheet:
+        sheet = sheet.convert('RGB')
+    if args.bench:
+        for row in benchmark(sheet):
+            print(f"tween {row['tween']} ({row['frames']:3} frames)  {row['encoder']:22} "
+                  f"{row['bytes'] / 1024:7.1f} KB  {row['seconds'] * 1000:7.1f} ms")
+    if args.output:
+        fmt = 'webp' if args.output.lower().endswith('.webp') else 'gif'
+        data = animate_sheet(sheet, fmt, args.tween)
+        with open(args.output, 'wb') as f:
+            f.write(data)
+        print(f'Wrote {args.output}: {len(data) / 1024:.1f} KB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+"""Headless batch generation of chibi sticker sheets.
+
+Renders a sheet for every photo in a directory or glob across a process
+pool. No display is needed, so it can run overnight on a server.
+
+Library use:
+    from sticker_batch import render_batch
+    summary = render_batch(['photos/*.jpg'], 'out', workers=8)
+
+Command line:
+    python sticker_batch.py photos/ -o out --workers 8
+    python sticker_batch.py "photos/**/*.jpg" -o out --format jpg --overwrite
+"""
+import argparse
+import glob
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import sticker_enhance
+import sticker_renderer
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.gif', '.webp')
+
+
+def collect_inputs(patterns):
+    """Expand directories and glob patterns into a sorted list of image paths"""
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            candidates = [os.path.join(pattern, name) for name in os.listdir(pattern)]
+        else:
+            candidates = glob.glob(pattern, recursive=True)
+        paths.extend(
+            path for path in candidates
+            if os.path.isfile(path) and path.lower().endswith(IMAGE_EXTENSIONS)
+        )
+    return sorted(set(paths))
+
+
+def output_path(input_path, output_dir, fmt='png'):
+    stem = os.path.splitext(os.path.basename(input_path))[0]
+    return os.path.join(output_dir, f'{stem}_stickers.{fmt}')
+
+
+def render_one(input_path, output_file, fmt='png', style=sticker_enhance.DEFAULT_STYLE, progress=None,
+               store=None, source_hash=None):
+    """Render and save the sheet for one photo; returns the output path.
+
+    `progress` receives the sticker_renderer progress events, including
+    'decode' and 'encode'. With a sticker_store.StickerStore, a sheet
+    already rendered from the same pixels and style is reused, and new
+    sheets are added to it (linked to `source_hash`, the upload's SHA-256).
+    """
+    image = sticker_renderer.load_photo(input_path)
+    sticker_renderer.report_progress(progress, 'decode', sticker_renderer.STAGE_PROGRESS['decode'],
+                                     width=image.width, height=image.height)
+    copied = False
+    if store is not None:
+        sheet, key, _ = store.render(image, style, progress, source_hash)
+        stored = store.path(key) if fmt == 'png' else None
+        if stored:
+            try:
+                # Already encoded once for the store
+                shutil.copyfile(stored, output_file)
+                copied = True
+            except OSError:
+                pass  # evicted in between
+    else:
+        sheet = sticker_renderer.create_chibi_stickers(image, style=style, progress=progress)
+    if not copied and fmt == 'png':
+        sheet.save(output_file, format='PNG')
+    elif not copied:
+        sheet.save(output_file, format='JPEG', quality=95)
+    sticker_renderer.report_progress(progress, 'encode', sticker_renderer.STAGE_PROGRESS['encode'], format=fmt)
+    return output_file
+
+
+def render_batch(patterns, output_dir, workers=None, fmt='png', overwrite=False, progress=None,
+                 style=sticker_enhance.DEFAULT_STYLE):
+    """Render sticker sheets for every matching photo across a process pool.
+
+    `progress(done, total, path, error)` is called in the parent process as
+    each photo finishes. Existing outputs are skipped unless `overwrite`, so
+    an interrupted run can simply be started again.
+    Returns a summary dict with counts, failures and throughput.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    inputs = collect_inputs(patterns)
+    jobs = []
+    skipped = 0
+    for path in inputs:
+        target = output_path(path, output_dir, fmt)
+        if not overwrite and os.path.exists(target):
+            skipped += 1
+            continue
+        jobs.append((path, target))
+
+    started = time.perf_counter()
+    failures = {}
+    done = 0
+    if jobs:
+        with ProcessPoolExecutor(max_workers=workers, initializer=sticker_renderer.use_built_atlas) as pool:
+            futures = {pool.submit(render_one, path, target, fmt, style): path for path, target in jobs}
+            for future in as_completed(futures):
+                path = futures[future]
+                error = None
+                try:
+                    future.result()
+                except Exception as e:
+                    error = str(e)
+                    failures[path] = error
+                done += 1
+                if progress:
+                    progress(done, len(jobs), path, error)
+    elapsed = time.perf_counter() - started
+    rendered = done - len(failures)
+    return {
+        'total': len(inputs),
+        'rendered': rendered,
+        'skipped': skipped,
+        'failed': len(failures),
+        'failures': failures,
+        'seconds': elapsed,
+        'sheets_per_second': rendered / elapsed if elapsed else 0.0,
+        'stickers_per_second': rendered * len(sticker_renderer.EXPRESSIONS) / elapsed if elapsed else 0.0,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate chibi sticker sheets without the GUI')
+    parser.add_argument('inputs', nargs='+', help='Photo directories or glob patterns')
+    parser.add_argument('-o', '--output', default='stickers_out', help='Output directory')
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count(),
+                        help='Worker processes (default: CPU count)')
+    parser.add_argument('--format', choices=['png', 'jpg'], default='png')
+    parser.add_argument('--style', default=sticker_enhance.DEFAULT_STYLE,
+                        choices=sorted(sticker_enhance.STYLE_PRESETS), help='Enhancement preset')
+    parser.add_argument('--overwrite', action='store_true', help='Re-render existing sheets')
+    parser.add_argument('-q', '--quiet', action='store_true', help='Only print the summary')
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+
+    def report(done, total, path, error):
+        if args.quiet:
+            return
+        rate = done / (time.perf_counter() - started)
+        status = f'FAILED: {error}' if error else 'ok'
+        print(f'[{done}/{total}] {rate:.1f} sheets/s  {os.path.basename(path)} {status}', flush=True)
+
+    summary = render_batch(args.inputs, args.output, args.workers, args.format, args.overwrite, report,
+                           args.style)
+    print(f"Rendered {summary['rendered']} of {summary['total']} photos "
+          f"({summary['skipped']} skipped, {summary['failed']} failed) in {summary['seconds']:.1f}s "
+          f"- {summary['sheets_per_second']:.2f} sheets/s, {summary['stickers_per_second']:.1f} stickers/s")
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
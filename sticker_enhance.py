@@ -0,0 +1,215 @@
+"""Fused colour / contrast / brightness enhancement.
+
+The sticker look used to be three separate ImageEnhance passes
+(Color -> Contrast -> Brightness), each allocating a full intermediate
+image. This module applies the whole chain in one go:
+
+* "matrix": the three stages are affine, so they compose into a single 3x4
+  colour matrix that Pillow applies in one C pass. This is exact (up to
+  rounding) whenever clipping at 0/255 between stages can't change the
+  result, which covers all the presets below.
+* "numpy": an exact emulation of Pillow's arithmetic for any factors. The
+  colour stage becomes a 256x256 (luma, value) table and contrast +
+  brightness fold into one 256-entry table. Slower than "matrix" on large
+  images, so it is only picked when the matrix pass would not be exact.
+* "pillow": the original ImageEnhance chain, kept as the reference.
+
+    python sticker_enhance.py --verify
+    python sticker_enhance.py --bench --preset chibi
+"""
+import argparse
+import time
+from collections import namedtuple
+
+from PIL import Image, ImageChops, ImageEnhance, ImageStat
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+EnhanceParams = namedtuple('EnhanceParams', ['color', 'contrast', 'brightness'])
+
+# Enhancement factors per sticker style
+STYLE_PRESETS = {
+    'chibi': EnhanceParams(color=1.3, contrast=1.2, brightness=1.1),
+    'vivid': EnhanceParams(color=1.6, contrast=1.3, brightness=1.05),
+    'pastel': EnhanceParams(color=0.8, contrast=0.9, brightness=1.15),
+    'natural': EnhanceParams(color=1.0, contrast=1.0, brightness=1.0),
+}
+DEFAULT_STYLE = 'chibi'
+
+# ITU-R 601-2 luma weights, as used by Pillow's RGB -> L conversion
+_LUMA = (0.299, 0.587, 0.114)
+
+
+def get_params(style):
+    """Look up a preset by name, or pass an EnhanceParams/tuple through"""
+    if isinstance(style, str):
+        try:
+            return STYLE_PRESETS[style]
+        except KeyError:
+            raise ValueError(f'Unknown style preset: {style}') from None
+    return EnhanceParams(*style)
+
+
+def enhance_pillow(image, params):
+    """Reference implementation: the original three ImageEnhance passes"""
+    image = ImageEnhance.Color(image).enhance(params.color)
+    image = ImageEnhance.Contrast(image).enhance(params.contrast)
+    return ImageEnhance.Brightness(image).enhance(params.brightness)
+
+
+def can_use_matrix(params):
+    """True if clipping between stages can't change the result.
+
+    A stage only clips when its factor is > 1; that clip is harmless as long
+    as no later stage has a factor < 1 that would pull the value back into
+    range. Factors <= 1 are convex blends and never clip.
+    """
+    factors = list(params)
+    for i, factor in enumerate(factors):
+        if factor > 1.0 and min(factors[i + 1:], default=1.0) < 1.0:
+            return False
+    return True
+
+
+def enhance_matrix(image, params):
+    """Single colour-matrix pass; exact up to rounding when can_use_matrix()"""
+    f, k, b = params
+    # The colour stage preserves luma, so the contrast mean can be taken
+    # from the input instead of an intermediate image.
+    mean = int(ImageStat.Stat(image.convert('L')).mean[0] + 0.5)
+    # Pillow truncates after every stage that produces fractions (losing 0.5
+    # on average, scaled by the later stages) while the matrix pass rounds
+    # once; shift the offset to match.
+    truncation = 0.5 * ((k * b if f != 1 else 0) + (b if k != 1 else 0) + (1 if b != 1 else 0))
+    offset = b * (1 - k) * mean - truncation
+    rows = []
+    for channel in range(3):
+        row = []
+        for source in range(3):
+            weight = (1 - f) * _LUMA[source] + (f if source == channel else 0.0)
+            row.append(b * k * weight)
+        row.append(offset)
+        rows.extend(row)
+    return image.convert('RGB', tuple(rows))
+
+
+def _blend_u8(base, image, alpha):
+    # Pillow's Image.blend: float32 base + alpha * (image - base), clipped then truncated
+    out = base.astype(np.float32) + np.float32(alpha) * (image.astype(np.float32) - base)
+    return np.clip(out, 0, 255).astype(np.uint8)
+
+
+def enhance_numpy(image, params):
+    """Vectorised chain matching Pillow's arithmetic exactly, for any factors"""
+    if not NUMPY_AVAILABLE:
+        raise RuntimeError('numpy is not installed')
+    f, k, b = params
+    rgb = np.asarray(image)
+    values = np.arange(256, dtype=np.uint8)
+    # The colour stage depends only on (luma, channel value): a 256x256 table
+    color_lut = _blend_u8(values[:, None], values[None, :], f).ravel()
+    luma = np.asarray(image.convert('L'))
+    colored = color_lut[(luma.astype(np.uint16) << 8)[..., None] | rgb]
+    mean = int(ImageStat.Stat(Image.fromarray(colored, 'RGB').convert('L')).mean[0] + 0.5)
+    # Contrast and brightness are per-value, so both fold into one 256-entry table
+    tone_lut = _blend_u8(np.zeros(256, dtype=np.uint8), _blend_u8(np.full(256, mean, dtype=np.uint8), values, k), b)
+    return Image.fromarray(tone_lut[colored], 'RGB')
+
+
+def enhance(image, style=DEFAULT_STYLE, method='auto'):
+    """Apply a style preset's colour/contrast/brightness in a single pass"""
+    params = get_params(style)
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    if method == 'auto':
+        if can_use_matrix(params):
+            method = 'matrix'
+        elif NUMPY_AVAILABLE:
+            method = 'numpy'
+        else:
+            method = 'pillow'
+    if method == 'matrix':
+        return enhance_matrix(image, params)
+    if method == 'numpy':
+        return enhance_numpy(image, params)
+    if method == 'pillow':
+        return enhance_pillow(image, params)
+    raise ValueError(f'Unknown enhancement method: {method}')
+
+
+def compare(image, style=DEFAULT_STYLE, method='auto'):
+    """(max, mean) absolute channel difference against the Pillow chain"""
+    expected = enhance_pillow(image.convert('RGB'), get_params(style))
+    actual = enhance(image, style, method)
+    histogram = ImageChops.difference(expected, actual).histogram()
+    # One 256-bin histogram per band; fold them into one
+    counts = [sum(histogram[i::256]) for i in range(256)]
+    return max(i for i, n in enumerate(counts) if n), sum(i * n for i, n in enumerate(counts)) / sum(counts)
+
+
+def synthetic_image(width, height):
+    """Deterministic test image with gradients, saturated colours and noise"""
+    gradient = Image.linear_gradient('L').resize((width, height))
+    radial = Image.radial_gradient('L').resize((width, height))
+    noise = Image.effect_noise((width, height), 64)
+    return Image.merge('RGB', (gradient, radial, noise))
+
+
+BENCH_SIZES = [(120, 120), (512, 512), (3840, 2160)]
+
+
+def benchmark(style=DEFAULT_STYLE, sizes=BENCH_SIZES, repeat=5):
+    methods = ['pillow', 'matrix', 'numpy'] if NUMPY_AVAILABLE else ['pillow', 'matrix']
+    if not can_use_matrix(get_params(style)):
+        methods.remove('matrix')
+    results = []
+    for width, height in sizes:
+        image = synthetic_image(width, height)
+        row = {'size': f'{width}x{height}'}
+        for method in methods:
+            best = float('inf')
+            for _ in range(repeat):
+                started = time.perf_counter()
+                enhance(image, style, method)
+                best = min(best, time.perf_counter() - started)
+            row[method] = best
+        for method in methods[1:]:
+            row[method + '_speedup'] = row['pillow'] / row[method]
+            row[method + '_maxdiff'] = compare(image, style, method)[0]
+        results.append(row)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Verify and benchmark the fused enhancement engine')
+    parser.add_argument('--preset', default=DEFAULT_STYLE, choices=sorted(STYLE_PRESETS))
+    parser.add_argument('--verify', action='store_true', help='Compare every preset against Pillow')
+    parser.add_argument('--bench', action='store_true', help='Time 120px, 512px and 4K inputs')
+    parser.add_argument('--tolerance', type=int, default=2, help='Max allowed channel difference')
+    args = parser.parse_args(argv)
+
+    ok = True
+    if args.verify or not args.bench:
+        image = synthetic_image(512, 512)
+        for name in sorted(STYLE_PRESETS):
+            max_diff, mean_diff = compare(image, name)
+            passed = max_diff <= args.tolerance
+            ok = ok and passed
+            print(f"{name:8} max diff {max_diff}  mean diff {mean_diff:.3f}  {'OK' if passed else 'FAIL'}")
+    if args.bench:
+        for row in benchmark(args.preset):
+            parts = [f"{row['size']:>10}", f"pillow {row['pillow'] * 1000:8.2f} ms"]
+            for method in ('matrix', 'numpy'):
+                if method in row:
+                    parts.append(f"{method} {row[method] * 1000:8.2f} ms "
+                                 f"(x{row[method + '_speedup']:.1f}, max diff {row[method + '_maxdiff']})")
+            print('  '.join(parts))
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,185 @@
+"""Sticker pack export: every sticker as PNG and WebP at several sizes.
+
+Each of the 12 stickers is cut from the sheet and encoded at every size
+and format, plus the sheet itself and animated GIF/WebP versions
+(sticker_animate). The encodes run on a thread pool
+(Pillow's PNG and WebP encoders release the GIL, so threads use all cores
+without pickling images to other processes), and the results are written
+straight into a ZIP as they complete. Only a small window of encoded files
+is held in memory at a time, and iter_export_zip() yields the archive in
+chunks so a web response can stream it.
+
+    python sticker_export.py sheet.png -o pack.zip --sizes 64 128 512
+"""
+import argparse
+import io
+import os
+import re
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+import sticker_renderer
+
+EXPORT_SIZES = (64, 128, 512)
+EXPORT_FORMATS = ('png', 'webp')
+WEBP_QUALITY = 90
+EXPORT_WORKERS = os.cpu_count() or 1
+# Encoded files in flight per worker before we wait for the oldest
+WINDOW_PER_WORKER = 2
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=EXPORT_WORKERS, thread_name_prefix='sticker-export')
+        return _executor
+
+
+def split_sheet(sheet):
+    """The individual stickers of a sheet, in EXPRESSIONS order"""
+    stickers = []
+    for i in range(len(sticker_renderer.EXPRESSIONS)):
+        x, y = sticker_renderer.sticker_position(i)
+        stickers.append(sheet.crop((x, y, x + sticker_renderer.STICKER_SIZE, y + sticker_renderer.STICKER_SIZE)))
+    return stickers
+
+
+def sticker_name(index):
+    expression = sticker_renderer.EXPRESSIONS[index][0]
+    return f"{index + 1:02d}_{re.sub(r'[^a-z0-9]+', '_', expression.lower())}"
+
+
+def encode(image, fmt, size=None):
+    """Encode one image (optionally resized to size x size) to bytes"""
+    if size and image.size != (size, size):
+        image = image.resize((size, size), Image.Resampling.LANCZOS)
+    buffered = io.BytesIO()
+    if fmt == 'png':
+        image.save(buffered, format='PNG', optimize=True)
+    elif fmt == 'webp':
+        image.save(buffered, format='WEBP', quality=WEBP_QUALITY, method=4)
+    elif fmt in ('jpg', 'jpeg'):
+        image.save(buffered, format='JPEG', quality=95)
+    else:
+        raise ValueError(f'Unknown export format: {fmt}')
+    return buffered.getvalue()
+
+
+def _animate(sheet, fmt):
+    import sticker_animate  # imported here: sticker_animate imports this module
+    return sticker_animate.animate_sheet(sheet, fmt)
+
+
+def export_tasks(sheet, sizes=EXPORT_SIZES, formats=EXPORT_FORMATS, animated=True):
+    """(archive name, function, args) producing the bytes of every file in the pack"""
+    yield 'sheet.png', encode, (sheet, 'png')
+    if animated:
+        # Slowest files first so they overlap with the many small encodes
+        yield 'animated.gif', _animate, (sheet, 'gif')
+        yield 'animated.webp', _animate, (sheet, 'webp')
+    for index, sticker in enumerate(split_sheet(sheet)):
+        for size in sizes:
+            for fmt in formats:
+                yield f'{size}/{sticker_name(index)}.{fmt}', encode, (sticker, fmt, size)
+
+
+def iter_export_files(sheet, sizes=EXPORT_SIZES, formats=EXPORT_FORMATS, executor=None, animated=True,
+                      workers=EXPORT_WORKERS):
+    """Yield (archive name, bytes) as the parallel encodes finish.
+
+    `workers` is the thread count of `executor` (the shared export pool by
+    default); it sizes the window of encodes kept in flight.
+    """
+    executor = executor or _get_executor()
+    window = max(1, workers * WINDOW_PER_WORKER)
+    pending = []
+    for name, function, args in export_tasks(sheet, sizes, formats, animated):
+        pending.append((name, executor.submit(function, *args)))
+        if len(pending) >= window:
+            name, future = pending.pop(0)
+            yield name, future.result()
+    for name, future in pending:
+        yield name, future.result()
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only, unseekable file whose written bytes are collected for yielding"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def iter_export_zip(sheet, sizes=EXPORT_SIZES, formats=EXPORT_FORMATS, executor=None, animated=True,
+                    workers=EXPORT_WORKERS):
+    """Yield the ZIP pack in chunks (one or a few files per chunk)"""
+    sink = _ChunkSink()
+    # PNG and WebP are already compressed; storing them is as small and much faster
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for name, data in iter_export_files(sheet, sizes, formats, executor, animated, workers):
+            archive.writestr(name, data)
+            chunk = sink.take()
+            if chunk:
+                yield chunk
+    chunk = sink.take()
+    if chunk:
+        yield chunk
+
+
+def write_export_zip(sheet, path, sizes=EXPORT_SIZES, formats=EXPORT_FORMATS):
+    """Write the pack to `path`; returns its size in bytes"""
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    written = 0
+    with open(tmp_path, 'wb') as f:
+        for chunk in iter_export_zip(sheet, sizes, formats):
+            f.write(chunk)
+            written += len(chunk)
+    os.replace(tmp_path, path)
+    return written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Export a sticker sheet as a PNG/WebP sticker pack')
+    parser.add_argument('sheet', help='Sticker sheet image (from emogi.py or sticker_batch.py)')
+    parser.add_argument('-o', '--output', help='ZIP path (default: <sheet>_pack.zip)')
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(EXPORT_SIZES))
+    parser.add_argument('--formats', nargs='+', default=list(EXPORT_FORMATS), choices=['png', 'webp', 'jpg'])
+    parser.add_argument('--serial', action='store_true', help='Encode on one thread (for comparison)')
+    args = parser.parse_args(argv)
+
+    output = args.output or os.path.splitext(args.sheet)[0] + '_pack.zip'
+    sheet = sticker_renderer.load_photo(args.sheet, max_size=None)
+    started = time.perf_counter()
+    if args.serial:
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            with open(output, 'wb') as f:
+                for chunk in iter_export_zip(sheet, args.sizes, args.formats, executor, workers=1):
+                    f.write(chunk)
+        size = os.path.getsize(output)
+    else:
+        size = write_export_zip(sheet, output, args.sizes, args.formats)
+    files = 3 + len(sticker_renderer.EXPRESSIONS) * len(args.sizes) * len(args.formats)
+    print(f'Wrote {output}: {files} files, {size / 1024:.0f} KB in {time.perf_counter() - started:.2f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,309 @@
+"""Chibi sticker rendering pipeline, independent of the Tk UI.
+
+emogi.py's ChibiStickerGenerator drives these functions from its buttons;
+sticker_batch.py drives them headlessly over many photos.
+
+The photo processing (resize, enhance, smooth, circular crop) is the same
+for every expression, so it is done once per uploaded image by
+prepare_base() and memoized. Circular masks and expression overlays are
+prerendered once as transparent layers (keyed by size and expression), so
+each sticker is a single alpha_composite of base + layer.
+
+Pass a `progress` callback to follow the work: it receives event dicts
+with a `stage` ('decode', 'enhance', 'sticker', 'encode'), the overall
+`progress` fraction and stage details. 'sticker' events carry the
+finished sticker as `image`, so callers can show each one as it is done.
+"""
+import os
+import threading
+import weakref
+from collections import OrderedDict
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageDraw, ImageFilter
+
+import photo_ingest
+import sticker_enhance
+
+# Sticker dimensions
+STICKER_SIZE = 150
+PHOTO_SIZE = 120
+PADDING = 10
+GRID_COLUMNS = 3
+GRID_ROWS = 4
+
+# Expression types
+EXPRESSIONS = [
+    ("Happy", "😄"), ("Angry", "😠"), ("Sad", "😢"),
+    ("Sulking", "😤"), ("Thinking", "🤔"), ("Sleepy", "😴"),
+    ("Kiss", "😘"), ("Winking", "😉"), ("Surprised", "😲"),
+    ("Love", "😍"), ("Cool", "😎"), ("Embarrassed", "😳")
+]
+
+# Overall progress reached at the end of each stage; stickers share the
+# span between 'enhance' and 'encode'
+STAGE_PROGRESS = {'decode': 0.1, 'enhance': 0.25, 'stickers': 0.9, 'encode': 1.0}
+
+# How many uploads' prepared bases to keep
+BASE_CACHE_SIZE = 8
+
+_base_cache = OrderedDict()
+_base_cache_lock = threading.Lock()
+_overlay_executor = None
+_overlay_executor_lock = threading.Lock()
+
+
+def sheet_size():
+    """(width, height) of the full sticker sheet"""
+    width = GRID_COLUMNS * (STICKER_SIZE + PADDING) - PADDING
+    height = GRID_ROWS * (STICKER_SIZE + PADDING) - PADDING
+    return width, height
+
+
+def sticker_position(index):
+    """Top-left corner of sticker `index` on the sheet"""
+    row = index // GRID_COLUMNS
+    col = index % GRID_COLUMNS
+    return col * (STICKER_SIZE + PADDING), row * (STICKER_SIZE + PADDING)
+
+
+def load_photo(path, max_size=photo_ingest.PROXY_SIZE):
+    """Open a photo as an RGB image, decoded at reduced size (max_size=None for full)"""
+    return photo_ingest.open_proxy(path, max_size)[0]
+
+
+def report_progress(progress, stage, fraction, **details):
+    """Send one progress event to an optional callback"""
+    if progress:
+        progress(dict(details, stage=stage, progress=round(fraction, 3)))
+
+
+def _get_overlay_executor():
+    global _overlay_executor
+    with _overlay_executor_lock:
+        if _overlay_executor is None:
+            _overlay_executor = ThreadPoolExecutor(
+                max_workers=min(len(EXPRESSIONS), os.cpu_count() or 1),
+                thread_name_prefix='sticker-overlay'
+            )
+        return _overlay_executor
+
+
+def create_chibi_stickers(image, parallel=False, style=sticker_enhance.DEFAULT_STYLE, progress=None):
+    """Create the full 3x4 chibi sticker sheet for an RGB image.
+
+    With cached layers each sticker is a ~0.1 ms composite, which is cheaper
+    than a thread-pool hand-off, so `parallel` is off by default.
+    """
+    base = prepare_base(image, style)
+    report_progress(progress, 'enhance', STAGE_PROGRESS['enhance'], style=style)
+    canvas = Image.new('RGB', sheet_size(), (255, 255, 255))
+    if parallel:
+        executor = _get_overlay_executor()
+        stickers = executor.map(lambda info: render_expression(base, info), EXPRESSIONS)
+    else:
+        stickers = (render_expression(base, info) for info in EXPRESSIONS)
+    start, end = STAGE_PROGRESS['enhance'], STAGE_PROGRESS['stickers']
+    for i, sticker in enumerate(stickers):
+        canvas.paste(sticker, sticker_position(i))
+        report_progress(progress, 'sticker', start + (end - start) * (i + 1) / len(EXPRESSIONS),
+                        index=i, total=len(EXPRESSIONS), expression=EXPRESSIONS[i][0],
+                        position=sticker_position(i), image=sticker)
+    return canvas
+
+
+def create_single_chibi(image, expression_info, style=sticker_enhance.DEFAULT_STYLE):
+    """Create a single chibi sticker"""
+    return render_expression(prepare_base(image, style), expression_info)
+
+
+def render_expression(base, expression_info):
+    """Composite one expression's cached overlay layer onto a prepared base"""
+    expression_name, emoji = expression_info
+    sticker = Image.alpha_composite(base, overlay_layer(expression_name, emoji))
+    return sticker.convert('RGB')
+
+
+def prepare_base(image, style=sticker_enhance.DEFAULT_STYLE):
+    """Return the processed, circular-cropped sticker base for an image.
+
+    Memoized per image object, so repeated calls for the same upload (one
+    per expression, or a re-generation) reuse the first result. `style` is
+    a sticker_enhance preset name or (color, contrast, brightness) tuple.
+    """
+    key = (id(image), style)
+    with _base_cache_lock:
+        entry = _base_cache.get(key)
+        # The weakref guards against a new image reusing a freed object's id
+        if entry is not None and entry[0]() is image:
+            _base_cache.move_to_end(key)
+            return entry[1]
+    base = _process_base(image, style)
+    with _base_cache_lock:
+        _base_cache[key] = (weakref.ref(image), base)
+        _base_cache.move_to_end(key)
+        while len(_base_cache) > BASE_CACHE_SIZE:
+            _base_cache.popitem(last=False)
+    return base
+
+
+def clear_base_cache():
+    with _base_cache_lock:
+        _base_cache.clear()
+
+
+def _process_base(image, style):
+    # Process original image
+    base_img = image.resize((PHOTO_SIZE, PHOTO_SIZE), Image.Resampling.LANCZOS)
+
+    # Create chibi-style enhancements (colour, contrast, brightness in one pass)
+    base_img = sticker_enhance.enhance(base_img, style)
+
+    # Apply cartoon effect
+    base_img = base_img.filter(ImageFilter.SMOOTH_MORE)
+
+    # Centre the photo on a white sticker through the cached circular mask
+    sticker = Image.new('RGBA', (STICKER_SIZE, STICKER_SIZE), (255, 255, 255, 255))
+    offset = (STICKER_SIZE - PHOTO_SIZE) // 2
+    sticker.paste(base_img, (offset, offset), circle_mask(PHOTO_SIZE))
+    return sticker
+
+
+@lru_cache(maxsize=None)
+def circle_mask(size):
+    """Prerendered circular alpha mask"""
+    mask = Image.new('L', (size, size), 0)
+    draw = ImageDraw.Draw(mask)
+    draw.ellipse((0, 0, size, size), fill=255)
+    return mask
+
+
+# Expression name -> function drawing its effect with an ImageDraw.
+# Register a painter and the expression's layer is drawn once on first use.
+OVERLAY_PAINTERS = {}
+
+
+@lru_cache(maxsize=256)
+def overlay_layer(expression, emoji):
+    """Prerendered transparent RGBA layer with an expression's effect and label"""
+    layer = Image.new('RGBA', (STICKER_SIZE, STICKER_SIZE), (0, 0, 0, 0))
+    painter = OVERLAY_PAINTERS.get(expression)
+    if painter:
+        # The shapes are drawn without anti-aliasing, so opaque ink is exact
+        painter(ImageDraw.Draw(layer))
+    icon = _emoji_atlas.find_emoji(emoji) if _emoji_atlas is not None else None
+    if icon is not None:
+        icon = icon.convert('RGBA')
+        icon.thumbnail((EMOJI_ICON_SIZE, EMOJI_ICON_SIZE), Image.Resampling.LANCZOS)
+        layer.alpha_composite(icon, (5, 134))
+        mask = _label_mask(expression, expression, 7 + EMOJI_ICON_SIZE)
+    else:
+        mask = _label_mask(f"{emoji} {expression}", expression, 5)
+    # Anti-aliased text: solid colour with the glyph coverage as alpha
+    label = Image.new('RGBA', layer.size, (0, 0, 128, 0))  # navy
+    label.putalpha(mask)
+    return Image.alpha_composite(layer, label)
+
+
+def overlay_painter(expression):
+    """Decorator adding or replacing the effect drawn for an expression"""
+    def decorator(painter):
+        OVERLAY_PAINTERS[expression] = painter
+        overlay_layer.cache_clear()
+        return painter
+    return decorator
+
+
+@overlay_painter("Happy")
+def _paint_happy(draw):
+    # Add smile arc
+    draw.arc([50, 80, 100, 110], 0, 180, fill="gold", width=3)
+
+
+@overlay_painter("Angry")
+def _paint_angry(draw):
+    # Add angry eyebrows
+    draw.line([40, 50, 55, 45], fill="red", width=3)
+    draw.line([95, 45, 110, 50], fill="red", width=3)
+
+
+@overlay_painter("Love")
+def _paint_love(draw):
+    # Add heart
+    draw_heart(draw, 120, 40, "pink")
+
+
+@overlay_painter("Cool")
+def _paint_cool(draw):
+    # Add sunglasses
+    draw.rectangle([45, 60, 65, 70], fill="black")
+    draw.rectangle([85, 60, 105, 70], fill="black")
+    draw.line([65, 65, 85, 65], fill="black", width=2)
+
+
+def _label_mask(text, fallback, x):
+    mask = Image.new('L', (STICKER_SIZE, STICKER_SIZE), 0)
+    draw = ImageDraw.Draw(mask)
+    try:
+        draw.text((x, 135), text, fill=255)
+    except Exception:
+        # The default bitmap font can't encode emoji
+        draw.text((x, 135), fallback, fill=255)
+    return mask
+
+
+# Optional atlas_builder.SpriteAtlas used to draw emoji icons in labels
+_emoji_atlas = None
+EMOJI_ICON_SIZE = 12
+
+
+def use_atlas(atlas):
+    """Draw label emoji from a sprite atlas instead of the font (None to disable)"""
+    global _emoji_atlas
+    _emoji_atlas = atlas
+    overlay_layer.cache_clear()
+
+
+def use_built_atlas(out_dir=None):
+    """use_atlas() with the atlas written by atlas_builder.py, if it has been built.
+
+    Every process that renders or keys sheets (the app, batch and backend
+    workers, the backend itself) calls this at startup, so they all render
+    the same labels and agree on sticker_store keys.
+    """
+    import atlas_builder
+    atlas = atlas_builder.load_atlas(out_dir or atlas_builder.DEFAULT_OUT)
+    use_atlas(atlas)
+    return atlas
+
+
+def render_settings():
+    """Everything besides the photo and style that changes the rendered sheet"""
+    return {
+        'sticker_size': STICKER_SIZE,
+        'photo_size': PHOTO_SIZE,
+        'padding': PADDING,
+        'grid': [GRID_COLUMNS, GRID_ROWS],
+        'expressions': [list(info) for info in EXPRESSIONS],
+        # Atlas pages have content-hashed names, so they identify the icons
+        'atlas': [page['file'] for page in _emoji_atlas.index['pages']] if _emoji_atlas is not None else None,
+    }
+
+
+def add_expression_overlay(sticker, expression, emoji):
+    """Add expression-specific overlays"""
+    layer = overlay_layer(expression, emoji)
+    if sticker.mode == 'RGBA':
+        sticker.alpha_composite(layer)
+    else:
+        sticker.paste(layer, (0, 0), layer)
+
+
+def draw_heart(draw, x, y, color):
+    """Draw a small heart"""
+    size = 8
+    # Simple heart shape
+    draw.ellipse([x-size//2, y-size//4, x, y+size//4], fill=color)
+    draw.ellipse([x, y-size//4, x+size//2, y+size//4], fill=color)
+    draw.polygon([x-size//4, y+size//4, x, y+size//2, x+size//4, y+size//4], fill=color)
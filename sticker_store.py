@@ -0,0 +1,243 @@
+"""Content-addressed store of rendered sticker sheets.
+
+A sheet is keyed by the SHA-256 of the normalized input (the decoded RGB
+photo's pixels, so a renamed or re-saved copy of a photo still matches)
+plus the style parameters and renderer settings. Rendering the same photo
+again returns the stored sheet instead of redoing the work. A second,
+cheaper link maps the hash of the uploaded file itself to the sheet's key,
+so an identical re-upload is found without even decoding it.
+
+Entries live under <cache dir>/stickers and are shared by every process
+using that cache dir: the desktop app and the backend's render workers.
+Writes are atomic (temp file + rename). The total size is bounded by
+evicting the least recently used entries; file mtimes are the recency
+(touched on every hit), so all processes share one LRU order.
+
+    store = get_store()
+    sheet = store.find(photo.image, source_hash=photo.content_hash)
+    if sheet is None:
+        sheet = store.render(photo.image, source_hash=photo.content_hash).sheet
+"""
+import hashlib
+import io
+import json
+import os
+import threading
+from collections import namedtuple
+
+from PIL import Image
+
+from asset_library import default_cache_dir
+import sticker_enhance
+import sticker_renderer
+
+# Bump when the renderer's output changes in a way render_settings() doesn't show
+STORE_VERSION = 1
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+# Eviction trims to this fraction of max_bytes so it doesn't run on every put
+EVICT_TO = 0.9
+
+Rendered = namedtuple('Rendered', ['sheet', 'key', 'hit'])
+
+
+def image_digest(image):
+    """SHA-256 of an image's mode, size and pixels"""
+    digest = hashlib.sha256(f'{image.mode} {image.width}x{image.height}\n'.encode('utf-8'))
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+def _settings(style):
+    return json.dumps({
+        'version': STORE_VERSION,
+        'style': list(sticker_enhance.get_params(style)),
+        'renderer': sticker_renderer.render_settings(),
+    }, sort_keys=True)
+
+
+def sheet_key(image, style=sticker_enhance.DEFAULT_STYLE):
+    """Store key for the sheet of an RGB photo"""
+    return hashlib.sha256(f'{image_digest(image)}\n{_settings(style)}'.encode('utf-8')).hexdigest()
+
+
+def source_key(source_hash, style=sticker_enhance.DEFAULT_STYLE):
+    """Key of the link from an uploaded file's SHA-256 to its sheet"""
+    return hashlib.sha256(f'source {source_hash}\n{_settings(style)}'.encode('utf-8')).hexdigest()
+
+
+def replay(sheet, progress):
+    """Send the 'enhance' and per-sticker progress events for a stored sheet"""
+    sticker_renderer.report_progress(progress, 'enhance', sticker_renderer.STAGE_PROGRESS['enhance'], cached=True)
+    start, end = sticker_renderer.STAGE_PROGRESS['enhance'], sticker_renderer.STAGE_PROGRESS['stickers']
+    total = len(sticker_renderer.EXPRESSIONS)
+    size = sticker_renderer.STICKER_SIZE
+    for i, (expression, _) in enumerate(sticker_renderer.EXPRESSIONS):
+        x, y = sticker_renderer.sticker_position(i)
+        sticker_renderer.report_progress(progress, 'sticker', start + (end - start) * (i + 1) / total,
+                                         index=i, total=total, expression=expression, position=(x, y),
+                                         image=sheet.crop((x, y, x + size, y + size)), cached=True)
+
+
+class StickerStore:
+    def __init__(self, root=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.root = os.path.abspath(root or os.path.join(default_cache_dir(), 'stickers'))
+        self.max_bytes = max_bytes
+        self.stats = {'hits': 0, 'misses': 0, 'evicted': 0}
+        self._size = None  # bytes on disk, measured on the first put
+        self._lock = threading.Lock()
+
+    def _path(self, key, ext):
+        return os.path.join(self.root, key[:2], key + ext)
+
+    def path(self, key):
+        """Path of a stored sheet (marked as recently used), or None"""
+        path = self._path(key, '.png')
+        try:
+            os.utime(path)
+        except OSError:
+            return None
+        return path
+
+    def get(self, key):
+        """The stored sheet for a key, or None"""
+        path = self.path(key)
+        if path is None:
+            return None
+        try:
+            with Image.open(path) as sheet:
+                sheet.load()
+        except OSError:
+            return None  # evicted by another process in between
+        return sheet.convert('RGB')
+
+    def lookup_source(self, source_hash, style=sticker_enhance.DEFAULT_STYLE):
+        """Key of the sheet rendered from an identical uploaded file, or None"""
+        link = self._path(source_key(source_hash, style), '.key')
+        try:
+            with open(link, 'r') as f:
+                key = f.read().strip()
+            os.utime(link)
+        except OSError:
+            return None
+        return key if self.path(key) else None
+
+    def find(self, image, style=sticker_enhance.DEFAULT_STYLE, source_hash=None):
+        """The stored sheet for this photo and style, or None"""
+        key = self.lookup_source(source_hash, style) if source_hash else None
+        sheet = self.get(key) if key else None
+        if sheet is None:
+            key = sheet_key(image, style)
+            sheet = self.get(key)
+            if sheet is not None and source_hash:
+                self.link(source_hash, style, key)
+        with self._lock:
+            self.stats['hits' if sheet is not None else 'misses'] += 1
+        return sheet
+
+    def render(self, image, style=sticker_enhance.DEFAULT_STYLE, progress=None, source_hash=None):
+        """Rendered(sheet, key, hit): the stored sheet, or a fresh render that is then stored.
+
+        A stored sheet's stickers are still sent to `progress`, so callers
+        showing them one by one work the same either way.
+        """
+        key = sheet_key(image, style)
+        sheet = self.get(key)
+        with self._lock:
+            self.stats['hits' if sheet is not None else 'misses'] += 1
+        if sheet is not None:
+            replay(sheet, progress)
+            if source_hash:
+                self.link(source_hash, style, key)
+            return Rendered(sheet, key, True)
+        sheet = sticker_renderer.create_chibi_stickers(image, style=style, progress=progress)
+        self.put(key, sheet, source_hash, style)
+        return Rendered(sheet, key, False)
+
+    def put(self, key, sheet, source_hash=None, style=sticker_enhance.DEFAULT_STYLE):
+        buffered = io.BytesIO()
+        sheet.save(buffered, format='PNG')
+        added = self._write(self._path(key, '.png'), buffered.getvalue())
+        if source_hash:
+            added += self.link(source_hash, style, key, account=False)
+        self._added(added)
+
+    def link(self, source_hash, style, key, account=True):
+        """Remember that the uploaded file with this hash renders to `key`"""
+        added = self._write(self._path(source_key(source_hash, style), '.key'), key.encode('utf-8'))
+        if account:
+            self._added(added)
+        return added
+
+    def _write(self, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        return len(data)
+
+    # --- eviction --------------------------------------------------------
+
+    def _entries(self):
+        """(mtime, size, path) of every stored file"""
+        entries = []
+        try:
+            shards = [entry.path for entry in os.scandir(self.root) if entry.is_dir()]
+        except OSError:
+            return entries
+        for shard in shards:
+            try:
+                with os.scandir(shard) as it:
+                    for entry in it:
+                        if entry.name.endswith('.tmp'):
+                            continue
+                        try:
+                            stat = entry.stat()
+                        except OSError:
+                            continue
+                        entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+            except OSError:
+                continue
+        return entries
+
+    def size(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def _added(self, nbytes):
+        with self._lock:
+            if self._size is None:
+                self._size = self.size()  # already includes this write
+            else:
+                self._size += nbytes
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        # Rescan rather than trust our count: other processes add and evict too
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * EVICT_TO
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            self.stats['evicted'] += 1
+        self._size = total
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(root=None, max_bytes=None):
+    """One shared store per directory (default: <cache dir>/stickers)"""
+    store = StickerStore(root, max_bytes or DEFAULT_MAX_BYTES)
+    with _stores_lock:
+        shared = _stores.setdefault(store.root, store)
+        if max_bytes:
+            shared.max_bytes = max_bytes
+        return shared